@@ -1,9 +1,10 @@
+import asyncio
 import os
 import sys
 from logging.config import fileConfig
 
-from sqlalchemy import engine_from_config
 from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
 
@@ -13,9 +14,13 @@ from dotenv import load_dotenv
 load_dotenv() # Убедимся, что .env загружен
 
 sys.path.append(os.getcwd())
+# Каталог приложения рядом с alembic/ (в контейнере: /alembic и /app), чтобы
+# `alembic -c /alembic.ini upgrade head` работал из любого каталога
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
 
 # 2. Теперь, когда путь добавлен, мы можем импортировать напрямую.
 from db_models import Base
+from shared.config import settings
 
 # This is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -26,6 +31,10 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# 3. URL базы берем из тех же POSTGRES_* переменных, что и приложение (драйвер asyncpg).
+# "%" экранируется: значения alembic.ini проходят через интерполяцию configparser
+config.set_main_option("sqlalchemy.url", settings.database_url.replace("%", "%%"))
+
 # 4. Указываем Alembic на метаданные наших моделей
 # для автоматической генерации миграций ('autogenerate' support).
 target_metadata = Base.metadata
@@ -55,30 +64,41 @@ def run_migrations_offline() -> None:
         context.run_migrations()
 
 
-def run_migrations_online() -> None:
-    """Run migrations in 'online' mode.
+def do_run_migrations(connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata
+    )
 
-    In this scenario we need to create an Engine
-    and associate a connection with the context.
+    with context.begin_transaction():
+        context.run_migrations()
 
-    """
+
+async def run_async_migrations() -> None:
+    """Миграции через asyncpg: другого драйвера PostgreSQL в образе нет."""
     # Создаем engine на основе конфигурации из alembic.ini
-    connectable = engine_from_config(
+    connectable = async_engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
 
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+
+    await connectable.dispose()
+
+
+def run_migrations_online() -> None:
+    """Run migrations in 'online' mode.
+
+    In this scenario we need to create an Engine
+    and associate a connection with the context.
 
-        with context.begin_transaction():
-            context.run_migrations()
+    """
+    asyncio.run(run_async_migrations())
 
 
 if context.is_offline_mode():
     run_migrations_offline()
 else:
-    run_migrations_online()
\ No newline at end of file
+    run_migrations_online()
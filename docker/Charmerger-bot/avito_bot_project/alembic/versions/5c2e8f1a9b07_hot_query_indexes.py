@@ -0,0 +1,70 @@
+"""Индексы для горячих запросов
+
+Движок автоответов, правила пересылки, аккаунты пользователя, история операций,
+статистика сообщений и заметки автора. Индексы строятся CONCURRENTLY - без блокировки
+записи в таблицы; поэтому каждый создается вне транзакции (autocommit_block).
+
+Первая ревизия: таблицы существующих баз созданы через Base.metadata.create_all,
+на новой базе с create_all эти индексы уже есть (IF NOT EXISTS - ничего не делает).
+
+Revision ID: 5c2e8f1a9b07
+Revises:
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2e8f1a9b07"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (имя, таблица, колонки, условие частичного индекса)
+INDEXES = [
+    ("ix_auto_reply_rules_account_id_active", "auto_reply_rules", ["account_id"], "is_active"),
+    ("ix_auto_reply_rules_account_id_name", "auto_reply_rules", ["account_id", "name"], None),
+    ("ix_forwarding_rules_owner_id", "forwarding_rules", ["owner_id"], None),
+    ("ix_avito_accounts_user_id", "avito_accounts", ["user_id"], None),
+    ("ix_transactions_user_id_timestamp", "transactions", ["user_id", sa.text("timestamp DESC")], None),
+    ("ix_message_logs_account_id_timestamp", "message_logs", ["account_id", "timestamp"], None),
+    ("ix_chat_notes_author_id", "chat_notes", ["author_id"], None),
+]
+
+
+def _drop_if_invalid(name: str) -> None:
+    """Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс - IF NOT EXISTS его бы пропустил."""
+    if context.is_offline_mode():
+        # upgrade --sql: базы нет, проверять нечего
+        return
+    invalid = op.get_bind().execute(
+        sa.text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        op.drop_index(name, postgresql_concurrently=True, if_exists=True)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            _drop_if_invalid(name)
+            op.create_index(
+                name, table, columns,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,40 @@
+"""Таблица chat_view_snapshots: копии карточек чатов из Redis
+
+Заполняется стадией view_checkpointer (app/modules/telegram/view_snapshots.py).
+На базе, созданной через Base.metadata.create_all, таблица уже есть - миграция ее пропускает.
+
+Revision ID: 8d41b6e3c2f5
+Revises: 5c2e8f1a9b07
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8d41b6e3c2f5"
+down_revision: Union[str, None] = "5c2e8f1a9b07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("chat_view_snapshots"):
+        return
+    op.create_table(
+        "chat_view_snapshots",
+        sa.Column("account_id", sa.Integer(), sa.ForeignKey("avito_accounts.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("chat_id", sa.String(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("account_id", "chat_id"),
+    )
+    op.create_index("ix_chat_view_snapshots_updated_at", "chat_view_snapshots", ["updated_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chat_view_snapshots_updated_at", table_name="chat_view_snapshots")
+    op.drop_table("chat_view_snapshots")
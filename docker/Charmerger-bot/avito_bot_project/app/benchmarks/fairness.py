@@ -0,0 +1,90 @@
+# /app/benchmarks/fairness.py
+"""
+Справедливая обработка по владельцам (shared/streams.py, run_fair_stream_consumer).
+
+Запуск (из каталога /app):
+    python -m benchmarks.fairness
+
+Сценарий: пользователь EXPERT с 30 аккаунтами делает рассылку - в стрим разом приходит
+FLOOD_MESSAGES сообщений, а в это же время SMALL_TENANTS других пользователей присылают
+по несколько сообщений. Сравнивается задержка сообщений "маленьких" пользователей
+в обычном FIFO-потребителе и в справедливом режиме. Падает, если порядок в чатах нарушен.
+"""
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.priority import MemoryStreams, percentile
+from shared.streams import run_stream_consumer
+
+STREAM = "avito:incoming:messages"
+FLOOD_MESSAGES = 600
+SMALL_TENANTS = 10
+SMALL_MESSAGES = 5
+HANDLE_TIME = 0.002
+LANES = 4
+# Веса как в TARIFF_CONFIG (limits.pipeline_weight)
+PLAN_WEIGHTS = {"start": 1.0, "pro": 2.0, "expert": 4.0}
+
+
+def tenant_of(data: dict):
+    """Как modules.avito.tenants.message_tenant, но без обращения к БД."""
+    return f"owner:{data['owner_id']}", PLAN_WEIGHTS[data["owner_plan"]]
+
+
+async def run_scenario(fair: bool) -> List[float]:
+    store = MemoryStreams()
+    latencies: List[float] = []
+    seen: Dict[str, List[int]] = defaultdict(list)
+    total = FLOOD_MESSAGES + SMALL_TENANTS * SMALL_MESSAGES
+    done = asyncio.Event()
+    processed = 0
+
+    async def handler(message_id: str, data: dict):
+        nonlocal processed
+        await asyncio.sleep(HANDLE_TIME)
+        seen[data["chat_id"]].append(int(data["seq"]))
+        if data["owner_id"] != "1":
+            latencies.append(time.perf_counter() - float(data["queued_at"]))
+        processed += 1
+        if processed == total:
+            done.set()
+
+    now = str(time.perf_counter())
+    for i in range(FLOOD_MESSAGES):
+        store.add(STREAM, {
+            "account_id": str(1000 + i % 30), "chat_id": f"flood-{i % 90}", "seq": str(i),
+            "owner_id": "1", "owner_plan": "expert", "queued_at": now,
+        })
+    for i in range(SMALL_MESSAGES):
+        for tenant in range(SMALL_TENANTS):
+            store.add(STREAM, {
+                "account_id": str(2000 + tenant), "chat_id": f"small-{tenant}", "seq": str(i),
+                "owner_id": str(10 + tenant), "owner_plan": "start", "queued_at": str(time.perf_counter()),
+            })
+
+    consumer = asyncio.create_task(run_stream_consumer(
+        store, STREAM, "autoreply_workers", "bench", handler, lanes=LANES,
+        tenant_func=tenant_of if fair else None, read_ahead=1000
+    ))
+    await done.wait()
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+
+    for chat_id, seqs in seen.items():
+        assert seqs == sorted(seqs), f"Нарушен порядок в чате {chat_id}: {seqs}"
+    return latencies
+
+
+async def main():
+    fifo = await run_scenario(fair=False)
+    fair = await run_scenario(fair=True)
+    for name, values in (("FIFO", fifo), ("По владельцам (DRR)", fair)):
+        print(f"{name:>20}: задержка сообщений других пользователей "
+              f"p50={percentile(values, 0.5) * 1000:.0f} мс, p99={percentile(values, 0.99) * 1000:.0f} мс")
+    assert percentile(fair, 0.99) < percentile(fifo, 0.5), "Справедливый режим не снизил задержку"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
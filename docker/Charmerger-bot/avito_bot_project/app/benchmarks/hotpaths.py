@@ -0,0 +1,231 @@
+# /app/benchmarks/hotpaths.py
+"""
+Микробенчмарки CPU-горячих чисто питоновских путей с отслеживаемыми базовыми значениями.
+
+Запуск (из каталога /app):
+    python -m benchmarks.hotpaths                 # таблица: текущее время и отличие от базы
+    python -m benchmarks.hotpaths --check         # код возврата 1, если что-то медленнее базы больше порога
+    python -m benchmarks.hotpaths --save          # записать текущие значения как новую базу
+    python -m benchmarks.hotpaths -k render       # только случаи, в имени которых есть подстрока
+
+База хранится в benchmarks/baselines.json и коммитится вместе с кодом: оптимизация
+доказывается разницей с базой в том же прогоне, после нее база обновляется (--save).
+Абсолютные микросекунды зависят от машины, поэтому базу записывают и проверяют на одном
+и том же окружении (CI-раннер или выделенная машина); при другой версии Python или
+платформе печатается предупреждение.
+
+Время одного вызова - минимум из --repeat повторов (минимум меньше всего зависит от шума),
+число вызовов в повторе подбирается автоматически (timeit.Timer.autorange).
+"""
+import argparse
+import contextlib
+import hashlib
+import hmac
+import os
+import platform
+import sys
+import timeit
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from shared.config import settings
+from shared.serialization import json_dumps, json_dumps_str, json_loads
+from modules.autoreplies.engine import AutoReplyEngine
+from modules.avito.webhook import AvitoWebhookHandler
+from modules.telegram.view_renderer import ViewRenderer
+from modules.webapp.security import _validate_telegram_data
+from .payloads import NOW_TS, make_avito_webhook, make_view_model
+
+BASELINES_PATH = Path(__file__).with_name("baselines.json")
+# Допустимое замедление относительно базы (0.15 = на 15%)
+DEFAULT_THRESHOLD = 0.15
+
+
+# --- Данные ---
+
+def make_rules(count: int = 50) -> List[SimpleNamespace]:
+    """Набор правил автоответа как у крупного аккаунта: все типы триггеров, совпадает только последнее."""
+    trigger_types = ("contains_any", "contains_all", "exact", "contains_any")
+    rules = [
+        SimpleNamespace(
+            id=i, name=f"Правило {i}", trigger_type=trigger_types[i % len(trigger_types)],
+            trigger_keywords=[f"ключ{i}", f"доставка {i}", f"Скидка-{i}", f"самовывоз {i}-го"],
+        )
+        for i in range(count - 1)
+    ]
+    rules.append(SimpleNamespace(id=count - 1, name="Всегда", trigger_type="always", trigger_keywords=[]))
+    return rules
+
+
+def make_init_data(bot_token: str) -> str:
+    """initData Telegram WebApp с корректной подписью для заданного токена бота."""
+    user = json_dumps_str({
+        "id": 700000001, "first_name": "Ирина", "last_name": "Смирнова",
+        "username": "irina_shop", "language_code": "ru", "allows_write_to_pm": True,
+    })
+    params = {
+        "query_id": "AAHdF6IQAAAAAN0XohDhrOrc",
+        "user": quote(user),
+        "auth_date": str(NOW_TS),
+    }
+    data_check_string = "\n".join(f"{k}={v if k != 'user' else user}" for k, v in sorted(params.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return "&".join(f"{k}={v}" for k, v in params.items())
+
+
+class _BodyRequest:
+    """Минимальный Request для AvitoWebhookHandler: отдает готовое тело."""
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+class _CachedTenantRedis:
+    """Redis без сети: владелец аккаунта уже в кэше, xadd ничего не делает. Меряется только CPU."""
+    async def get(self, key):
+        return "1042:pro"
+
+    async def set(self, *args, **kwargs):
+        return True
+
+    async def xadd(self, *args, **kwargs):
+        return "0-1"
+
+
+def _run_sync(coro):
+    """Выполняет корутину, которая никогда не уступает управление, без цикла событий."""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("Корутина бенчмарка ушла в ожидание - проверьте заглушки ввода-вывода.")
+
+
+# --- Случаи ---
+
+def build_cases() -> List[Tuple[str, Callable[[], object]]]:
+    renderer = ViewRenderer(bot=None, redis_client=None)
+    model = make_view_model(notes=3, action_log=5)
+    model_large = make_view_model(notes=10, action_log=30, subscribers=10)
+    model_bytes = json_dumps(model)
+    model_large_bytes = json_dumps(model_large)
+
+    engine = AutoReplyEngine(redis_client=None)
+    rules = make_rules(50)
+    message_text = "Здравствуйте! Ещё актуально? Когда можно забрать, есть ли самовывоз сегодня вечером?"
+
+    def match_all_rules():
+        for rule in rules:
+            if engine._match_rule(rule, message_text):
+                return rule
+
+    if match_all_rules() is not rules[-1]:
+        raise RuntimeError("make_rules: с текстом совпадает не только последнее правило.")
+
+    webhook_handler = AvitoWebhookHandler(redis_client=_CachedTenantRedis())
+    webhook_text = _BodyRequest(json_dumps(make_avito_webhook("text")))
+    webhook_image = _BodyRequest(json_dumps(make_avito_webhook("image")))
+
+    init_data = make_init_data(settings.telegram_bot_token)
+    if _validate_telegram_data(init_data) is None:
+        raise RuntimeError("make_init_data: подпись initData не прошла проверку.")
+
+    return [
+        ("render: _build_text", lambda: renderer._build_text(model, "Europe/Moscow")),
+        ("render: _build_text (large)", lambda: renderer._build_text(model_large, "Asia/Novosibirsk")),
+        ("render: _build_keyboard", lambda: renderer._build_keyboard(model, 700000001).as_markup()),
+        ("autoreply: _match_rule x50", match_all_rules),
+        ("webhook: handle_request text", lambda: _run_sync(webhook_handler.handle_request(webhook_text, None))),
+        ("webhook: handle_request image", lambda: _run_sync(webhook_handler.handle_request(webhook_image, None))),
+        ("webapp: _validate_telegram_data", lambda: _validate_telegram_data(init_data)),
+        ("view_model: dumps", lambda: json_dumps(model)),
+        ("view_model: loads", lambda: json_loads(model_bytes)),
+        ("view_model: loads+dumps (large)", lambda: json_dumps(json_loads(model_large_bytes))),
+    ]
+
+
+# --- Измерение и база ---
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """Лучшее время одного вызова в микросекундах."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1_000_000
+
+
+def environment() -> Dict[str, str]:
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "system": platform.system()}
+
+
+def load_baselines() -> Optional[dict]:
+    if not BASELINES_PATH.exists():
+        return None
+    return json_loads(BASELINES_PATH.read_bytes())
+
+
+def save_baselines(results: Dict[str, float], previous: Optional[dict]):
+    cases = dict((previous or {}).get("cases", {}))
+    cases.update({name: round(us, 3) for name, us in results.items()})
+    data = {"environment": environment(), "cases": dict(sorted(cases.items()))}
+    BASELINES_PATH.write_text(json_dumps_str(data) + "\n", encoding="utf-8")
+    print(f"База записана: {BASELINES_PATH}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей.")
+    parser.add_argument("-k", dest="filter", help="Только случаи, в имени которых есть подстрока.")
+    parser.add_argument("--repeat", type=int, default=7, help="Число повторов на случай.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Допустимое замедление относительно базы (доля).")
+    parser.add_argument("--check", action="store_true", help="Код возврата 1 при регрессии или отсутствии базы.")
+    parser.add_argument("--save", action="store_true", help="Записать результаты как новую базу.")
+    args = parser.parse_args()
+
+    cases = [(name, func) for name, func in build_cases() if not args.filter or args.filter in name]
+    baselines = load_baselines()
+    base_cases = (baselines or {}).get("cases", {})
+    if baselines and baselines.get("environment") != environment():
+        print(f"ВНИМАНИЕ: база записана в другом окружении {baselines.get('environment')}, "
+              f"сравнение приблизительное.", file=sys.stderr)
+
+    results: Dict[str, float] = {}
+    regressions: List[str] = []
+    print(f"{'случай':<36}{'мкс':>12}{'база, мкс':>12}{'разница':>10}")
+    for name, func in cases:
+        # Отладочный вывод кода (print, логи) - тоже часть стоимости, но не должен засорять отчет
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            us = measure(func, args.repeat)
+        results[name] = us
+        base = base_cases.get(name)
+        if base:
+            change = us / base - 1
+            mark = "  РЕГРЕССИЯ" if change > args.threshold else ""
+            if mark:
+                regressions.append(name)
+            print(f"{name:<36}{us:>12.2f}{base:>12.2f}{change:>+10.1%}{mark}")
+        else:
+            print(f"{name:<36}{us:>12.2f}{'-':>12}{'-':>10}")
+
+    if args.save:
+        save_baselines(results, baselines)
+        return
+    if args.check:
+        missing = [name for name in results if name not in base_cases]
+        if missing:
+            print(f"Нет базы для: {', '.join(missing)}. Запишите ее: python -m benchmarks.hotpaths --save",
+                  file=sys.stderr)
+        if regressions:
+            print(f"Медленнее базы больше чем на {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        if missing or regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
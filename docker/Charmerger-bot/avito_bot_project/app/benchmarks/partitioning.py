@@ -0,0 +1,78 @@
+# /app/benchmarks/partitioning.py
+"""
+Проверка упорядоченных полос (shared/streams.py) на перемешанных пачках сообщений.
+
+Запуск (из каталога /app):
+    python -m benchmarks.partitioning
+
+Сценарий: несколько чатов одновременно присылают пачки сообщений, пачки перемешаны
+между собой, обработка каждого сообщения занимает случайное время. Скрипт проверяет,
+что внутри каждого чата порядок обработки совпадает с порядком в стриме, и печатает,
+во сколько раз полосы ускоряют обработку по сравнению с одной полосой.
+Падает с AssertionError, если порядок нарушен.
+"""
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from shared.streams import OrderedLanes
+
+CHATS = 40
+MESSAGES_PER_CHAT = 25
+MAX_HANDLER_DELAY = 0.004
+
+
+def make_interleaved_bursts(seed: int) -> List[Tuple[str, Dict[str, str]]]:
+    """Сообщения чатов идут пачками по 1-5 штук, пачки разных чатов перемешаны."""
+    rnd = random.Random(seed)
+    remaining = {f"u2i-chat-{i}": 0 for i in range(CHATS)}
+    stream = []
+    while remaining:
+        chat_id = rnd.choice(list(remaining))
+        for _ in range(rnd.randint(1, 5)):
+            seq = remaining[chat_id]
+            stream.append((f"{len(stream)}-0", {"account_id": "1042", "chat_id": chat_id, "seq": str(seq)}))
+            remaining[chat_id] = seq + 1
+            if remaining[chat_id] == MESSAGES_PER_CHAT:
+                del remaining[chat_id]
+                break
+    return stream
+
+
+async def replay(stream: List[Tuple[str, Dict[str, str]]], lanes: int, seed: int) -> float:
+    rnd = random.Random(seed)
+    processed: Dict[str, List[int]] = defaultdict(list)
+
+    async def handler(message_id: str, data: Dict[str, str]):
+        await asyncio.sleep(rnd.random() * MAX_HANDLER_DELAY)
+        processed[data["chat_id"]].append(int(data["seq"]))
+
+    workers = OrderedLanes(handler, lanes=lanes, name=f"replay-{lanes}")
+    workers.start()
+    started = time.perf_counter()
+    for message_id, data in stream:
+        await workers.submit(message_id, data)
+    await workers.join()
+    elapsed = time.perf_counter() - started
+    await workers.stop()
+
+    for chat_id, seqs in processed.items():
+        assert seqs == sorted(seqs), f"Нарушен порядок в чате {chat_id} ({lanes} полос): {seqs}"
+    assert sum(map(len, processed.values())) == len(stream), "Часть сообщений потеряна"
+    return elapsed
+
+
+async def main():
+    for seed in range(3):
+        stream = make_interleaved_bursts(seed)
+        baseline = await replay(stream, lanes=1, seed=seed)
+        print(f"seed={seed}: {len(stream)} сообщений, 1 полоса: {baseline:.2f} с")
+        for lanes in (4, 16):
+            elapsed = await replay(stream, lanes=lanes, seed=seed)
+            print(f"    {lanes:>2} полос: {elapsed:.2f} с ({baseline / elapsed:.1f}x), порядок в чатах сохранен")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
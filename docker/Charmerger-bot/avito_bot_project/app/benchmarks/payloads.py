@@ -0,0 +1,86 @@
+# /app/benchmarks/payloads.py
+"""
+Реалистичные данные для бенчмарков: ChatViewModel с заметками и логом действий,
+сырой вебхук Avito и контекст карточки (tg_context).
+"""
+import time
+from typing import Any, Dict
+
+NOW_TS = int(time.time())
+
+
+def make_view_model(notes: int = 3, action_log: int = 5, subscribers: int = 3) -> Dict[str, Any]:
+    """Собирает ChatViewModel, похожую на то, что лежит в Redis под ключом chat_view:*."""
+    return {
+        "view_version": 13,
+        "account_id": 1042,
+        "account_alias": "Магазин «Всё для дачи»",
+        "chat_id": "u2i-2Jd8fQ~r6cAbLzXwK3PkAg",
+        "interlocutor_name": "Александр Петров",
+        "interlocutor_id": 318765423,
+        "is_blocked": False,
+        "item_title": "Газонокосилка бензиновая Huter GLM-5.0 S, самоходная",
+        "item_price_string": "24 990 ₽",
+        "item_url": "https://www.avito.ru/moskva/dlya_doma_i_dachi/gazonokosilka_benzinovaya_huter_glm-5.0_s_3456789012",
+        "last_client_message_text": "Здравствуйте! Ещё продаёте? Можно посмотреть сегодня вечером после 19:00? "
+                                    "И подскажите, торг уместен, если заберу сам?",
+        "last_client_message_timestamp": NOW_TS - 120,
+        "is_last_message_read": False,
+        "subscribers": {str(700000000 + i): 5000 + i for i in range(subscribers)},
+        "notes": {
+            str(700000000 + i): {
+                "author_name": f"Менеджер {i}",
+                "text": "Клиент постоянный, просил отложить до выходных. Скидка не более 1000 ₽.",
+                "timestamp": NOW_TS - 3600 * (i + 1),
+            } for i in range(notes)
+        },
+        "action_log": [
+            {
+                "type": "manual_reply" if i % 2 else "auto_reply",
+                "author_name": "Автоответчик" if not i % 2 else "Ирина",
+                "text": "Добрый день! Да, товар в наличии. Адрес самовывоза: ул. Садовая, 15.",
+                "rule_name": "Приветствие",
+                "timestamp": NOW_TS - 60 * (i + 1),
+            } for i in range(action_log)
+        ],
+    }
+
+
+def make_avito_webhook(message_type: str = "text") -> Dict[str, Any]:
+    """Тело вебхука Avito messenger v3 в том виде, в котором оно приходит в /webhook/avito."""
+    content: Dict[str, Any] = {"text": "Здравствуйте! Ещё актуально? Когда можно забрать?"}
+    if message_type == "image":
+        content = {"image": {"sizes": {
+            "140x105": "https://00.img.avito.st/image/1/140x105/abc",
+            "640x480": "https://00.img.avito.st/image/1/640x480/abc",
+            "1280x960": "https://00.img.avito.st/image/1/1280x960/abc",
+        }}}
+    return {
+        "id": "1b3d0f1c-4c7a-4f55-a0d1-6e1c8c7f2f11",
+        "version": "v3.0.0",
+        "timestamp": NOW_TS,
+        "payload": {
+            "type": "message",
+            "value": {
+                "id": "3b2a1f0e9d8c7b6a5f4e3d2c1b0a9f8e",
+                "chat_id": "u2i-2Jd8fQ~r6cAbLzXwK3PkAg",
+                "user_id": 287654321,
+                "author_id": 318765423,
+                "created": NOW_TS,
+                "type": message_type,
+                "chat_type": "u2i",
+                "content": content,
+                "item_id": 3456789012,
+                "published_at": "2024-05-20T10:15:00Z",
+            },
+        },
+    }
+
+
+def make_tg_context() -> Dict[str, Any]:
+    """Контекст ответа, который сохраняется для каждой отправленной карточки."""
+    return {
+        "avito_chat_id": "u2i-2Jd8fQ~r6cAbLzXwK3PkAg",
+        "avito_account_id": 1042,
+        "can_reply": "true",
+    }
@@ -0,0 +1,151 @@
+# /app/benchmarks/priority.py
+"""
+Задержка ручных ответов во время "шторма" автоответов (shared/streams.py, run_priority_stream_consumer).
+
+Запуск (из каталога /app):
+    python -m benchmarks.priority
+
+Сценарий: в очереди уже лежат AUTOREPLY_BURST автоответов (например, отложенные, выпущенные
+разом), и в это время продавец каждые MANUAL_INTERVAL секунд отвечает вручную. Сравниваются
+один общий FIFO-стрим (как было) и приоритетные стримы с весами 8/3/1.
+Redis заменен простым хранилищем в памяти - измеряется только планирование.
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Dict, List
+
+from shared.streams import WeightedRoundRobin, run_priority_stream_consumer
+
+AUTOREPLY_BURST = 1500
+MANUAL_REPLIES = 40
+MANUAL_INTERVAL = 0.02
+SEND_TIME = 0.002
+LANES = 4
+
+
+class MemoryStreams:
+    """Минимум команд Redis, которые использует run_priority_stream_consumer."""
+
+    def __init__(self):
+        self.streams: Dict[str, deque] = defaultdict(deque)
+        self._seq = 0
+        self._new_message = asyncio.Event()
+
+    def add(self, stream: str, data: dict):
+        self._seq += 1
+        self.streams[stream].append((f"{self._seq}-0", data))
+        self._new_message.set()
+
+    async def xgroup_create(self, *args, **kwargs):
+        pass
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        result = self._read(streams, count)
+        if not result and block:
+            self._new_message.clear()
+            try:
+                await asyncio.wait_for(self._new_message.wait(), block / 1000)
+            except asyncio.TimeoutError:
+                return []
+            result = self._read(streams, count)
+        return result
+
+    def _read(self, streams, count):
+        result = []
+        for name, last_id in streams.items():
+            if last_id != ">":
+                # Чтение своего PEL: в памяти подтверждать нечего
+                continue
+            queue = self.streams[name]
+            messages = [queue.popleft() for _ in range(min(count or len(queue), len(queue)))]
+            if messages:
+                result.append([name, messages])
+        return result
+
+    async def xpending_range(self, *args, **kwargs):
+        return []
+
+    async def xinfo_consumers(self, *args, **kwargs):
+        return []
+
+    def pipeline(self, transaction=False):
+        return _MemoryPipeline(self)
+
+
+class _MemoryPipeline:
+    def __init__(self, owner: MemoryStreams):
+        self.owner = owner
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def xreadgroup(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+    async def execute(self):
+        return [await self.owner.xreadgroup(*args, **kwargs) for args, kwargs in self.calls]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_scenario(weights: Dict[str, int], stream_for: Dict[str, str]) -> List[float]:
+    store = MemoryStreams()
+    latencies = []
+    done = asyncio.Event()
+
+    async def handler(stream_name: str, message_id: str, data: dict):
+        await asyncio.sleep(SEND_TIME)
+        if data["action_type"] == "manual_reply":
+            latencies.append(time.perf_counter() - float(data["queued_at"]))
+            if len(latencies) == MANUAL_REPLIES:
+                done.set()
+
+    for i in range(AUTOREPLY_BURST):
+        store.add(stream_for["auto_reply"], {"chat_id": f"chat-{i}", "action_type": "auto_reply", "queued_at": "0"})
+
+    consumer = asyncio.create_task(run_priority_stream_consumer(
+        store, list(weights.items()), "avito_workers", "bench", handler, lanes=LANES
+    ))
+    for i in range(MANUAL_REPLIES):
+        store.add(stream_for["manual_reply"], {
+            "chat_id": f"manual-{i}", "action_type": "manual_reply", "queued_at": str(time.perf_counter())
+        })
+        await asyncio.sleep(MANUAL_INTERVAL)
+    await done.wait()
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+    return latencies
+
+
+def check_weights():
+    scheduler = WeightedRoundRobin([("high", 8), ("normal", 3), ("low", 1)])
+    plan = scheduler.plan(120, ["high", "normal", "low"])
+    assert plan == {"high": 80, "normal": 30, "low": 10}, plan
+    print(f"Доли при заполненных стримах (120 мест): {plan}")
+
+
+async def main():
+    check_weights()
+    fifo = await run_scenario(
+        {"avito:outgoing:messages": 1},
+        {"auto_reply": "avito:outgoing:messages", "manual_reply": "avito:outgoing:messages"},
+    )
+    weighted = await run_scenario(
+        {"high": 8, "normal": 3, "low": 1},
+        {"auto_reply": "low", "manual_reply": "high"},
+    )
+    for name, values in (("Один FIFO-стрим", fifo), ("Приоритеты 8/3/1", weighted)):
+        print(f"{name:>18}: p50={percentile(values, 0.5) * 1000:.0f} мс, p99={percentile(values, 0.99) * 1000:.0f} мс")
+    assert percentile(weighted, 0.99) < percentile(fifo, 0.5), "Приоритетные стримы не снизили задержку ручных ответов"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
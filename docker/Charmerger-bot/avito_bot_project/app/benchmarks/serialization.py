@@ -0,0 +1,84 @@
+# /app/benchmarks/serialization.py
+"""
+Сравнение stdlib json и shared.serialization (orjson) на реалистичных данных.
+
+Запуск (из каталога /app):
+    python -m benchmarks.serialization
+
+Для каждой операции печатается время на одно сообщение и выигрыш.
+"""
+import json
+import timeit
+from typing import Callable, List, Tuple
+
+from shared.serialization import json_dumps, json_loads
+from .payloads import make_view_model, make_avito_webhook, make_tg_context
+
+
+def _per_call_us(func: Callable[[], object], number: int) -> float:
+    """Возвращает лучшее время одного вызова в микросекундах (min из 5 повторов)."""
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    return best / number * 1_000_000
+
+
+_VIEW = make_view_model()
+_VIEW_STDLIB = json.dumps(_VIEW)
+_VIEW_FAST = json_dumps(_VIEW)
+_WEBHOOK = json.dumps(make_avito_webhook()).encode("utf-8")
+_CONTEXT = make_tg_context()
+
+
+def _message_path_stdlib():
+    json.loads(_WEBHOOK)
+    for _ in range(3):
+        json.dumps(json.loads(_VIEW_STDLIB))
+    json.dumps(_CONTEXT)
+
+
+def _message_path_fast():
+    json_loads(_WEBHOOK)
+    for _ in range(3):
+        json_dumps(json_loads(_VIEW_FAST))
+    json_dumps(_CONTEXT)
+
+
+def build_cases() -> List[Tuple[str, Callable[[], object], Callable[[], object]]]:
+    view, view_stdlib, view_fast = _VIEW, _VIEW_STDLIB, _VIEW_FAST
+    webhook_bytes, context = _WEBHOOK, _CONTEXT
+    context_stdlib = json.dumps(context)
+    context_fast = json_dumps(context)
+
+    return [
+        ("chat_view: dumps", lambda: json.dumps(view), lambda: json_dumps(view)),
+        ("chat_view: loads", lambda: json.loads(view_stdlib), lambda: json_loads(view_fast)),
+        (
+            "chat_view: get+set cycle",
+            lambda: json.dumps(json.loads(view_stdlib)),
+            lambda: json_dumps(json_loads(view_fast)),
+        ),
+        ("avito webhook: loads", lambda: json.loads(webhook_bytes), lambda: json_loads(webhook_bytes)),
+        ("tg_context: dumps", lambda: json.dumps(context), lambda: json_dumps(context)),
+        ("tg_context: loads", lambda: json.loads(context_stdlib), lambda: json_loads(context_fast)),
+    ]
+
+
+def main(number: int = 20000):
+    print(f"Размер chat_view: stdlib={len(_VIEW_STDLIB.encode('utf-8'))} B, "
+          f"orjson={len(_VIEW_FAST)} B")
+    print(f"{'операция':<28}{'stdlib, мкс':>14}{'orjson, мкс':>14}{'ускорение':>12}")
+
+    for name, stdlib_call, fast_call in build_cases():
+        stdlib_us = _per_call_us(stdlib_call, number)
+        fast_us = _per_call_us(fast_call, number)
+        print(f"{name:<28}{stdlib_us:>14.2f}{fast_us:>14.2f}{stdlib_us / fast_us:>11.1f}x")
+
+    # Одно входящее сообщение проходит примерно через: разбор вебхука, 2-3 цикла get+set
+    # модели (воркер событий, подписка, пометка "прочитано") и запись tg_context.
+    per_message_stdlib = _per_call_us(_message_path_stdlib, number // 4)
+    per_message_fast = _per_call_us(_message_path_fast, number // 4)
+    print(f"{'CPU на сообщение (итого)':<28}{per_message_stdlib:>14.2f}{per_message_fast:>14.2f}"
+          f"{per_message_stdlib / per_message_fast:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import uuid
 from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any
 from sqlalchemy import (
-    ForeignKey, DateTime, UUID, String, Boolean, Integer, Text, JSON, Float, BigInteger
+    ForeignKey, DateTime, UUID, String, Boolean, Integer, Text, JSON, Float, BigInteger, Index, LargeBinary, text
 )
 from sqlalchemy.orm import declarative_base, relationship, Mapped, mapped_column
 from sqlalchemy.sql import func
@@ -39,7 +39,8 @@ class User(Base):
 class AvitoAccount(Base):
     __tablename__ = "avito_accounts"
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Индекс: аккаунты пользователя (лимиты тарифа, списки в WebApp, арендатор вебхука)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     alias: Mapped[Optional[str]] = mapped_column(String(100))
     avito_user_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False, index=True)
     encrypted_oauth_token: Mapped[str] = mapped_column(String(512), nullable=False)
@@ -56,6 +57,12 @@ class AvitoAccount(Base):
 # --- МОДЕЛЬ ДЛЯ ПРАВИЛ АВТООТВЕТОВ ---
 class AutoReplyRule(Base):
     __tablename__ = "auto_reply_rules"
+    __table_args__ = (
+        # Списки правил аккаунта в WebApp (ORDER BY name)
+        Index("ix_auto_reply_rules_account_id_name", "account_id", "name"),
+        # Движок автоответов на каждое входящее: только активные правила аккаунта
+        Index("ix_auto_reply_rules_account_id_active", "account_id", postgresql_where=text("is_active")),
+    )
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     account_id: Mapped[int] = mapped_column(ForeignKey("avito_accounts.id", ondelete="CASCADE"), nullable=False)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -73,7 +80,7 @@ class AutoReplyRule(Base):
 class ForwardingRule(Base):
     __tablename__ = "forwarding_rules"
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     # Поле target_telegram_id будет заполняться ПОСЛЕ принятия приглашения
     target_telegram_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True, index=True)
     custom_rule_name: Mapped[str] = mapped_column(String(100)) # Это имя помощника, например, "Менеджер Василий"
@@ -87,6 +94,10 @@ class ForwardingRule(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # История операций пользователя, новые сверху
+        Index("ix_transactions_user_id_timestamp", "user_id", text("timestamp DESC")),
+    )
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     amount: Mapped[float] = mapped_column(Float, nullable=False)
@@ -109,7 +120,9 @@ class ChatNote(Base):
     # ---!!! ИЗМЕНЯЕМ ПЕРВИЧНЫЙ КЛЮЧ !!!---
     account_id: Mapped[int] = mapped_column(ForeignKey("avito_accounts.id", ondelete="CASCADE"), primary_key=True)
     chat_id: Mapped[str] = mapped_column(String, primary_key=True)
-    author_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True) 
+    # Поиск по (account_id, chat_id) покрывает первичный ключ; отдельный индекс - для заметок
+    # автора и каскадного удаления пользователя
+    author_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
     # ------------------------------------
 
     text: Mapped[str] = mapped_column(Text, nullable=False)
@@ -119,10 +132,25 @@ class ChatNote(Base):
     
 class MessageLog(Base):
     __tablename__ = "message_logs"
+    __table_args__ = (
+        # Статистика аккаунта за день/неделю
+        Index("ix_message_logs_account_id_timestamp", "account_id", "timestamp"),
+    )
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     account_id: Mapped[int] = mapped_column(ForeignKey("avito_accounts.id", ondelete="CASCADE"), nullable=False)
     chat_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
     direction: Mapped[str] = mapped_column(String(10), nullable=False, index=True) # 'in' (входящее) или 'out' (исходящее)
     is_autoreply: Mapped[bool] = mapped_column(Boolean, default=False)
     trigger_name: Mapped[Optional[str]] = mapped_column(String(100)) # Имя автоответа или шаблона
-    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
\ No newline at end of file
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
+
+
+class ChatViewSnapshot(Base):
+    """Копия ChatViewModel из Redis (chat_view:*): карточка переживает TTL и вытеснение ключа."""
+    __tablename__ = "chat_view_snapshots"
+    account_id: Mapped[int] = mapped_column(ForeignKey("avito_accounts.id", ondelete="CASCADE"), primary_key=True)
+    chat_id: Mapped[str] = mapped_column(String, primary_key=True)
+    # Значение ключа как есть, в формате view_codec (декодируется decode_view)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # Индекс: удаление копий старше VIEW_SNAPSHOT_RETENTION_DAYS
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
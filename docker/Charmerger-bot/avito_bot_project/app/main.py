@@ -11,35 +11,34 @@ import logging
 from contextlib import asynccontextmanager
 from fastapi.staticfiles import StaticFiles
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response
 
 # --- 3. БЛОК ИМПОРТОВ КОМПОНЕНТОВ ПРИЛОЖЕНИЯ ---
 # Этот engine используется для создания таблиц в lifespan
-from shared.database import engine
+from shared.database import engine, dispose_engines
 from shared.redis_client import init_redis, close_redis
-from shared.scheduler import start_scheduler, stop_scheduler
+from shared.metrics import render_metrics
+from shared.tracing import setup_tracing
+from shared.logs import setup_logging, run_log_level_sync
+from shared.diagnostics import run_diagnostics_listener
+from shared.loop_monitor import run_loop_monitor
+from shared.offload import shutdown_offload_pools
+from shared.db_stats import QueryStatsMiddleware
+
+# Стадии конвейера (фоновые воркеры)
+from shared.config import settings
+from stages import parse_stages, start_stages, stop_stages
 
-# Модули с фоновыми задачами (воркерами)
-from modules.telegram.worker import (
-    start_telegram_sender_worker, 
-    start_chat_action_worker,
-    start_event_processor_worker
-)
-from modules.avito.worker import start_avito_outgoing_worker
-from modules.autoreplies.worker import start_autoreply_worker
-from modules.avito.forwarder import avito_to_telegram_forwarder
 from routers import api_router as main_api_router
 from modules.webapp.routers import router as webapp_router
+from modules.webapp.diagnostics import router as diagnostics_router
 # Компоненты для инициализации
 from modules.database.initial_data import load_initial_data
 # Компоненты aiogram, которые нужны в main
-from modules.telegram.bot import bot, dp, set_telegram_webhook, remove_telegram_webhook
-from modules.telegram.middlewares import DbSessionMiddleware
+from modules.telegram.bot import bot, dp, set_telegram_webhook, remove_telegram_webhook, setup_dispatcher
 
-# Настраиваем логирование
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - [%(levelname)s] - %(name)s: %(message)s",
-)
+# Настраиваем логирование: запись через очередь в отдельном потоке (см. shared/logs.py)
+setup_logging("chatmerger-web")
 logger = logging.getLogger(__name__)
 
 # --- Жизненный цикл приложения: запуск и остановка ресурсов ---
@@ -76,30 +75,28 @@ async def lifespan(app: FastAPI):
     redis_client = await init_redis()
     app.state.redis = redis_client
     logger.info("Redis-соединение готово.")
+    # Уровни логгеров, заданные через /panel/api/admin/logging
+    log_levels_task = asyncio.create_task(run_log_level_sync(redis_client))
+    # Профилирование и снимки памяти по запросу админа (/panel/api/admin/diagnostics)
+    diagnostics_task = asyncio.create_task(run_diagnostics_listener(redis_client, "chatmerger-web"))
+    # Задержка цикла событий и блокирующие его корутины (event_loop_* метрики)
+    loop_monitor_task = asyncio.create_task(run_loop_monitor())
 
     # --- 4. Регистрация Middleware для Aiogram ---
     # Мы передаем в middleware наш уже созданный клиент Redis.
-    # dp.update.outer_middleware - значит, что он будет срабатывать на все типы апдейтов.
-    dp.update.outer_middleware(DbSessionMiddleware(redis_client))
-    logger.info("Aiogram DbSessionMiddleware зарегистрирован.")
+    setup_dispatcher(redis_client)
+    setup_tracing("chatmerger-web")
 
     # --- 5. Запуск планировщика и воркеров ---
-    start_scheduler()
-    logger.info("Запуск фоновых работников...")
-    tasks = [
-        # Воркеры Telegram
-        asyncio.create_task(start_telegram_sender_worker(redis_client, bot), name="TelegramSenderWorker"),
-        asyncio.create_task(start_event_processor_worker(redis_client, bot), name="EventProcessorWorker"),
-        asyncio.create_task(start_chat_action_worker(redis_client, bot), name="ChatActionWorker"),
-        
-        # Воркеры Avito
-        asyncio.create_task(start_avito_outgoing_worker(redis_client), name="AvitoOutgoingWorker"),
-        asyncio.create_task(avito_to_telegram_forwarder(redis_client), name="AvitoToTelegramForwarder"),
-
-        # Воркер Автоответов
-        asyncio.create_task(start_autoreply_worker(redis_client), name="AutoreplyWorker"),
-    ]
-    logger.info(f"Запуск {len(tasks)} фоновых задач.")
+    # В режиме "только API" (RUN_WORKERS_IN_WEB=false) стадии крутятся в отдельном
+    # процессе `python -m worker`, а веб можно масштабировать воркерами uvicorn.
+    tasks = []
+    if settings.run_workers_in_web:
+        logger.info("Запуск фоновых работников...")
+        tasks = start_stages(redis_client, parse_stages(settings.worker_stages, settings.worker_concurrency))
+        logger.info(f"Запуск {len(tasks)} фоновых задач.")
+    else:
+        logger.info("RUN_WORKERS_IN_WEB=false: фоновые работники запускаются отдельным процессом (python -m worker).")
     
     # --- 6. Установка вебхука Telegram ---
     await set_telegram_webhook()
@@ -113,16 +110,15 @@ async def lifespan(app: FastAPI):
     logger.info("Завершение работы приложения: Очистка ресурсов...")
     await remove_telegram_webhook()
 
-    for task in tasks:
-        task.cancel()
-    try:
-        await asyncio.gather(*tasks, return_exceptions=True)
-    except asyncio.CancelledError:
-        logger.info("Фоновые работники успешно остановлены.")
+    await stop_stages(tasks)
+    logger.info("Фоновые работники успешно остановлены.")
+    log_levels_task.cancel()
+    diagnostics_task.cancel()
+    loop_monitor_task.cancel()
     
-    stop_scheduler()
+    shutdown_offload_pools()
     await close_redis()
-    await engine.dispose()
+    await dispose_engines()
     logger.info("Приложение корректно завершает работу.")
 
 
@@ -131,12 +127,24 @@ app = FastAPI(
     title="Avito Bot Project",
     description="Bridge for messaging between Avito and Telegram.",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson вместо stdlib json для всех JSON-ответов API и WebApp
+    default_response_class=ORJSONResponse
 )
 
+# Число и время SQL-запросов на HTTP-запрос (db_scope_queries{kind="http"})
+app.add_middleware(QueryStatsMiddleware)
+
 app.mount("/panel/static", StaticFiles(directory="modules/webapp/static"), name="static")
 app.include_router(main_api_router)
 app.include_router(webapp_router)
+app.include_router(diagnostics_router)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Метрики Prometheus этого процесса: стадии, API Avito и Telegram, пулы Redis и БД."""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
 
 @app.api_route("/debug/{full_path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def debug_catch_all(request: Request, full_path: str):
@@ -5,6 +5,7 @@ from typing import List, Dict, Optional, Any
 from sqlalchemy import select
 import redis.asyncio as redis
 from shared.database import get_session
+from shared.metrics import timed
 from db_models import AutoReplyRule
 
 logger = logging.getLogger(__name__)
@@ -15,32 +16,23 @@ class AutoReplyEngine:
 
     def _match_rule(self, rule: AutoReplyRule, message_text: str) -> bool:
         trigger_type = rule.trigger_type
-        keywords = [kw.lower() for kw in (rule.trigger_keywords or [])]
-        text_lower = message_text.lower()
-        
         if trigger_type == "always":
-            print("Результат: Сработало (всегда)")
             return True
-        
+
+        keywords = rule.trigger_keywords
         if not keywords:
-            print("Результат: НЕ сработало (нет ключевых слов)")
             return False
 
-        if trigger_type == "exact" and text_lower == keywords[0]:
-            print("Результат: Сработало (точное совпадение)")
-            return True
-            
-        if trigger_type == "contains_any" and any(kw in text_lower for kw in keywords):
-            print("Результат: Сработало (содержит любое из)")
-            return True
-            
-        if trigger_type == "contains_all" and all(kw in text_lower for kw in keywords):
-            print("Результат: Сработало (содержит все)")
-            return True
-            
-        print("Результат: НЕ сработало (ни одно условие не выполнено)")
+        text_lower = message_text.lower()
+        if trigger_type == "exact":
+            return text_lower == keywords[0].lower()
+        if trigger_type == "contains_any":
+            return any(kw.lower() in text_lower for kw in keywords)
+        if trigger_type == "contains_all":
+            return all(kw.lower() in text_lower for kw in keywords)
         return False
 
+    @timed("autoreply.find_and_apply_rule")
     async def find_and_apply_rule(
         self, account_id: int, chat_id: str, message_text: str
     ) -> Optional[Dict[str, Any]]:
@@ -54,30 +46,30 @@ class AutoReplyEngine:
             rules = result.scalars().all()
 
         if not rules:
-            logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Не найдено активных правил для аккаунта: {account_id}")
+            logger.debug("ДВИЖОК_АВТООТВЕТОВ: Не найдено активных правил для аккаунта: %s", account_id)
             return None
         
-        logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Найдено {len(rules)} активных правил для аккаунта {account_id}. Начинаю проверку...")
+        logger.debug("ДВИЖОК_АВТООТВЕТОВ: Найдено %s активных правил для аккаунта %s. Начинаю проверку...", len(rules), account_id)
 
         for rule in rules:
-            logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Проверяю правило '{rule.name}' (ID: {rule.id}, Тип: {rule.trigger_type}, Ключевые слова: {rule.trigger_keywords})")
+            logger.debug("ДВИЖОК_АВТООТВЕТОВ: Проверяю правило '%s' (ID: %s, Тип: %s, Ключевые слова: %s)", rule.name, rule.id, rule.trigger_type, rule.trigger_keywords)
             
             if self._match_rule(rule, message_text):
-                logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Правило '{rule.name}' СОВПАЛО с текстом.")
+                logger.debug("ДВИЖОК_АВТООТВЕТОВ: Правило '%s' СОВПАЛО с текстом.", rule.name)
                 cooldown_key = f"autoreply:cooldown:{chat_id}:{rule.id}"
                 
                 is_on_cooldown = await self.redis.exists(cooldown_key)
                 if is_on_cooldown:
-                    logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Правило '{rule.name}' НА ПЕРЕЗАРЯДКЕ (cooldown). Пропускаю.")
+                    logger.debug("ДВИЖОК_АВТООТВЕТОВ: Правило '%s' НА ПЕРЕЗАРЯДКЕ (cooldown). Пропускаю.", rule.name)
                     continue
 
-                logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Правило '{rule.name}' прошло проверку перезарядки. ПРИМЕНЯЮ ПРАВИЛО.")
+                logger.info("ДВИЖОК_АВТООТВЕТОВ: Правило '%s' прошло проверку перезарядки. ПРИМЕНЯЮ ПРАВИЛО.", rule.name)
                 if rule.cooldown_seconds > 0:
                     await self.redis.set(cooldown_key, "1", ex=rule.cooldown_seconds)
                 
                 return { "text": rule.reply_text, "delay_seconds": rule.delay_seconds, "rule_name": rule.name }
             else:
-                logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Правило '{rule.name}' НЕ совпало с текстом.")
+                logger.debug("ДВИЖОК_АВТООТВЕТОВ: Правило '%s' НЕ совпало с текстом.", rule.name)
         
-        logger.info(f"ДВИЖОК_АВТООТВЕТОВ: Завершена проверка всех правил для аккаунта {account_id}. Подходящих правил не найдено.")
+        logger.debug("ДВИЖОК_АВТООТВЕТОВ: Завершена проверка всех правил для аккаунта %s. Подходящих правил не найдено.", account_id)
         return None
\ No newline at end of file
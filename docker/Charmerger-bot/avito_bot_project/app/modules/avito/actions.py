@@ -11,7 +11,10 @@ class AvitoChatActions:
         self.base_url = f"/messenger/v1/accounts/{client.account.avito_user_id}"
 
     async def mark_as_read(self, chat_id: str):
-        """Помечает все сообщения в чате как прочитанные."""
+        """
+        Помечает все сообщения в чате как прочитанные.
+        Ошибка пробрасывается дальше: воркер решает, повторить действие или отправить в DLQ.
+        """
         logger.info(f"ДЕЙСТВИЯ: Отмечаю чат {chat_id} как прочитанный." )
         try:
             headers = await self.client.get_auth_headers()
@@ -23,6 +26,7 @@ class AvitoChatActions:
             logger.info(f"ДЕЙСТВИЯ: Чат {chat_id} отмечен как прочитанный.")
         except Exception as e:
             logger.warning(f"ДЕЙСТВИЯ: Не удалось отметить чат {chat_id} как прочитанный. Причина: {e}")
+            raise
 
     async def block_chat(self, chat_id: str):
         """Блокирует чат (собеседника)."""
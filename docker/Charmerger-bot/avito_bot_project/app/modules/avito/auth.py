@@ -11,7 +11,7 @@ class AvitoOAuth:
     Управляет процессом OAuth 2.0 авторизации для Avito.
     """
     AUTH_URL = "https://www.avito.ru/oauth"
-    TOKEN_URL = "https://api.avito.ru/token"
+    TOKEN_URL = f"{settings.avito_api_base_url}/token"
 
     # ДОБАВЛЯЕМ КОНСТРУКТОР
     def __init__(self, redis_client: redis.Redis):
@@ -11,21 +11,26 @@ from db_models import AvitoAccount
 from shared.config import settings
 from shared.database import get_session
 from shared.security import encrypt_token, decrypt_token
-from shared.redis_client import redis_client
+from shared.redis_client import get_redis
 from shared.exceptions import AvitoAPIError
+from .policy import AvitoPolicyTransport
 
 logger = logging.getLogger(__name__)
 
 class AvitoAPIClient:
     """
     Базовый клиент, который умеет обновлять токены и предоставлять заголовки для авторизации.
+    Все запросы идут через AvitoPolicyTransport: лимиты на аккаунт и автомат (см. policy.py).
     """
-    BASE_URL = "https://api.avito.ru"
+    BASE_URL = settings.avito_api_base_url
     TOKEN_URL = f"{BASE_URL}/token"
 
     def __init__(self, account: AvitoAccount):
         self.account = account
-        self.http_client = httpx.AsyncClient(base_url=self.BASE_URL)
+        self.http_client = httpx.AsyncClient(
+            base_url=self.BASE_URL,
+            transport=AvitoPolicyTransport(account.id)
+        )
 
     async def _refresh_access_token(self):
         """Обновляет access_token с помощью refresh_token."""
@@ -65,7 +70,7 @@ class AvitoAPIClient:
                 
                 # >>> КЛЮЧЕВОЕ ИЗМЕНЕНИЕ <<<
                 # Публикуем событие о необходимости переавторизации
-                await redis_client.xadd("system:notifications", {
+                await get_redis().xadd("system:notifications", {
                     "type": "reauth_needed",
                     "account_id": str(self.account.id),
                     "text": f"Требуется повторная авторизация для аккаунта Avito {self.account.avito_user_id}!"
@@ -82,7 +87,6 @@ class AvitoAPIClient:
             await self._refresh_access_token()
 
         access_token = decrypt_token(self.account.encrypted_oauth_token)
-        logger.info(f"DEBUG: Using Access Token: {access_token}")
         return {"Authorization": f"Bearer {access_token}"}
 
     async def get_own_user_info(self) -> dict:
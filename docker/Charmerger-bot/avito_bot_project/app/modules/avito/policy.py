@@ -0,0 +1,189 @@
+# /app/modules/avito/policy.py
+"""
+Политика вызовов API Avito: лимиты запросов и автомат (circuit breaker).
+
+AvitoPolicyTransport встраивается в httpx.AsyncClient внутри AvitoAPIClient, поэтому
+через него проходят все запросы - и самого клиента, и AvitoMessaging/AvitoChatActions.
+Для каждого запроса:
+1. автомат группы эндпоинтов: если Avito недавно отвечал 5xx/таймаутами - сразу
+   AvitoCircuitOpenError (воркеры откладывают сообщение на повтор, см. shared/retry.py);
+2. токен-бакет в Redis на (аккаунт, группа): общий для всех процессов; ждем токен
+   не дольше AVITO_RATE_LIMIT_MAX_WAIT, иначе AvitoRateLimitError;
+3. ответ 429/503 с Retry-After ставит бакет на паузу для всех процессов.
+
+Автомат общий для группы (а не для аккаунта): сбой Avito затрагивает всех сразу.
+"""
+import logging
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from shared import redis_client as redis_state
+from shared.config import settings
+from shared.exceptions import AvitoCircuitOpenError, AvitoRateLimitError
+from shared.metrics import AVITO_API_LATENCY, AVITO_API_REQUESTS, AVITO_CIRCUIT_STATE, AVITO_RATE_LIMIT_WAIT
+from shared.rate_limit import CircuitBreaker, RedisTokenBucket
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY_TPL = "avito:ratelimit:{account_id}:{family}"
+
+# Группы эндпоинтов
+FAMILY_AUTH = "auth"
+FAMILY_READ = "read"
+FAMILY_WRITE = "write"
+FAMILY_UPLOAD = "upload"
+
+# Сегмент пути - идентификатор (аккаунт, чат, сообщение), а не часть эндпоинта; v1/v3 - версии API
+_VERSION_SEGMENT = re.compile(r"^v\d+$")
+
+# Пауза, если Avito вернул 429 без Retry-After
+DEFAULT_THROTTLE_PAUSE = 1.0
+
+_CIRCUIT_STATE_VALUES = {
+    CircuitBreaker.CLOSED: 0,
+    CircuitBreaker.HALF_OPEN: 1,
+    CircuitBreaker.OPEN: 2,
+}
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Разбирает "read=5/10,write=2/5" в {группа: (запросов в секунду, емкость бакета)}."""
+    limits = {}
+    for part in (p.strip() for p in spec.split(",")):
+        if not part:
+            continue
+        family, _, value = part.partition("=")
+        rate, _, capacity = value.partition("/")
+        rate = float(rate)
+        limits[family.strip()] = (rate, float(capacity) if capacity else max(1.0, rate))
+    return limits
+
+
+RATE_LIMITS = parse_rate_limits(settings.avito_rate_limits)
+
+
+def endpoint_family(method: str, path: str) -> str:
+    if path.endswith("/token"):
+        return FAMILY_AUTH
+    if path.endswith("/uploadImages"):
+        return FAMILY_UPLOAD
+    return FAMILY_READ if method == "GET" else FAMILY_WRITE
+
+
+def endpoint_label(method: str, path: str) -> str:
+    """Шаблон эндпоинта для метрик: "GET /messenger/v2/accounts/{id}/chats/{id}"."""
+    segments = [
+        "{id}" if any(ch.isdigit() for ch in segment) and not _VERSION_SEGMENT.match(segment) else segment
+        for segment in path.split("/")
+    ]
+    return f"{method} {'/'.join(segments)}"
+
+
+def _export_state(breaker: CircuitBreaker):
+    AVITO_CIRCUIT_STATE.labels(family=breaker.name).set(_CIRCUIT_STATE_VALUES[breaker.state])
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(family: str) -> CircuitBreaker:
+    breaker = _breakers.get(family)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            family,
+            failure_threshold=settings.avito_circuit_failure_threshold,
+            recovery_timeout=settings.avito_circuit_recovery_timeout,
+            on_state_change=_export_state,
+        )
+        _breakers[family] = breaker
+        _export_state(breaker)
+    return breaker
+
+
+def circuit_states() -> Dict[str, str]:
+    """Состояния автоматов этого процесса (для админки и логов)."""
+    return {family: breaker.state for family, breaker in _breakers.items()}
+
+
+def _retry_after_header(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After", "")
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class AvitoPolicyTransport(httpx.AsyncBaseTransport):
+    """Транспорт httpx с лимитером и автоматом поверх обычного AsyncHTTPTransport."""
+
+    def __init__(self, account_id: int, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.account_id = account_id
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    def _bucket(self, family: str) -> Optional[RedisTokenBucket]:
+        limit = RATE_LIMITS.get(family)
+        if limit is None:
+            return None
+        rate, capacity = limit
+        return RedisTokenBucket(
+            RATE_LIMIT_KEY_TPL.format(account_id=self.account_id, family=family), rate, capacity
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        family = endpoint_family(request.method, request.url.path)
+        endpoint = endpoint_label(request.method, request.url.path)
+        breaker = get_breaker(family)
+        if not breaker.allow_request():
+            AVITO_API_REQUESTS.labels(family=family, endpoint=endpoint, outcome="circuit_open").inc()
+            raise AvitoCircuitOpenError(
+                f"Avito API circuit '{family}' is open", retry_after=breaker.retry_after()
+            )
+
+        # Без Redis (утилиты, ранний старт) запросы не лимитируются
+        redis_client = redis_state.redis_client
+        bucket = self._bucket(family)
+        if bucket and redis_client is not None:
+            waited = await bucket.acquire(redis_client, settings.avito_rate_limit_max_wait)
+            if waited is None:
+                breaker.release_probe()
+                AVITO_API_REQUESTS.labels(family=family, endpoint=endpoint, outcome="rate_limited").inc()
+                retry_after = max(await bucket.pause_remaining(redis_client), 1 / bucket.rate)
+                raise AvitoRateLimitError(
+                    f"Avito rate limit for account {self.account_id} ({family}) exhausted",
+                    retry_after=retry_after,
+                )
+            AVITO_RATE_LIMIT_WAIT.labels(family=family).observe(waited)
+
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            breaker.record_failure()
+            AVITO_API_REQUESTS.labels(family=family, endpoint=endpoint, outcome="error").inc()
+            raise
+        AVITO_API_LATENCY.labels(family=family, endpoint=endpoint).observe(time.perf_counter() - started)
+        AVITO_API_REQUESTS.labels(family=family, endpoint=endpoint, outcome=str(response.status_code)).inc()
+
+        status = response.status_code
+        if status in (429, 503) and bucket and redis_client is not None:
+            pause = _retry_after_header(response)
+            if status == 429 or pause is not None:
+                pause = pause if pause is not None else DEFAULT_THROTTLE_PAUSE
+                logger.warning(
+                    f"AVITO_POLICY: {status} for account {self.account_id} ({family}), "
+                    f"pausing bucket for {pause:.1f}s."
+                )
+                await bucket.pause(redis_client, pause)
+
+        # 429 - это лимит аккаунта, а не сбой Avito: автомат считает только 5xx
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
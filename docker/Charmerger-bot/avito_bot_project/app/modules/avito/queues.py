@@ -0,0 +1,236 @@
+# /app/modules/avito/queues.py
+"""
+Стримы исходящих сообщений в Avito с приоритетами.
+
+Ручной ответ продавца не должен ждать за сотнями автоответов, поэтому исходящие
+сообщения раскладываются по трем стримам по action_type, а воркер
+(process_outgoing_messages) читает их с весами AVITO_OUTGOING_WEIGHTS:
+- high: ручные ответы (текст и фото из Telegram);
+- normal: шаблоны (прежний стрим avito:outgoing:messages - старые сообщения дочитываются);
+- low: автоответы.
+
+Действия с чатами (avito:chat:actions) ставятся через enqueue_chat_action(): повторные
+"прочитано" по одному чату, пока первое еще в очереди, схлопываются в одно.
+
+Повтор неудачной отправки возвращается в конец стрима (shared/retry.py), поэтому более
+поздние ответы в тот же чат обогнали бы его. Пока повтор ждет, чат "удержан" (hold_chat):
+новые сообщения чата откладываются в список (park_if_chat_held) и подтверждаются, а когда
+повтор отправлен или ушел в DLQ, release_chat_hold() по порядку возвращает их в стримы.
+Если обработчик до этого не дошел (повтор ушел в DLQ через PendingReclaimer), удержание
+истекает по TTL, и отложенные сообщения возвращает release_expired_chat_holds() в стадии retry_scheduler.
+"""
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+from shared.coalesce import enqueue_once
+from shared.config import settings, CHAT_ACTION_DEDUPE_TTL_MS
+from shared.redis_client import get_script
+from shared.retry import strip_service_fields
+from shared.serialization import json_dumps_str
+
+logger = logging.getLogger(__name__)
+
+OUTGOING_STREAM_HIGH = "avito:outgoing:messages:high"
+OUTGOING_STREAM_NORMAL = "avito:outgoing:messages"
+OUTGOING_STREAM_LOW = "avito:outgoing:messages:low"
+
+CHAT_ACTIONS_STREAM = "avito:chat:actions"
+CHAT_ACTION_DEDUPE_KEY_TPL = "coalesce:avito:{account_id}:{chat_id}:{action}"
+
+# Признак "в чате ждет повтор" (значение - id сообщения), отложенные за ним сообщения (LIST)
+# и индекс чатов с отложенными сообщениями (ZSET {account_id:chat_id: время}) для release_expired_chat_holds
+CHAT_HOLD_KEY_TPL = "avito:outgoing:hold:{account_id}:{chat_id}"
+CHAT_PARKED_KEY_TPL = "avito:outgoing:parked:{account_id}:{chat_id}"
+CHAT_PARKED_INDEX_KEY = "avito:outgoing:parked_chats"
+
+# Общее начало скриптов удержания. KEYS: hold, parked, индекс, затем стримы исходящих
+# (KEYS[4] - normal, для записей с неизвестным стримом); ARGV[1] - член индекса.
+# release() возвращает отложенные сообщения в их стримы по порядку и снимает удержание.
+_HOLD_SCRIPT_PRELUDE = """
+local streams = {}
+for i = 4, #KEYS do
+    streams[KEYS[i]] = KEYS[i]
+end
+local function release()
+    local parked = redis.call('LRANGE', KEYS[2], 0, -1)
+    for _, member in ipairs(parked) do
+        local entry = cjson.decode(member)
+        local args = {}
+        for field, value in pairs(entry.fields) do
+            table.insert(args, field)
+            table.insert(args, tostring(value))
+        end
+        redis.call('XADD', streams[entry.stream] or KEYS[4], '*', unpack(args))
+    end
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    return #parked
+end
+"""
+
+_RELEASE_SCRIPT = _HOLD_SCRIPT_PRELUDE + """
+return release()
+"""
+
+# Снимает удержание, только если его ключ уже истек (повтор потерян или ушел в DLQ мимо обработчика)
+_RELEASE_EXPIRED_SCRIPT = _HOLD_SCRIPT_PRELUDE + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return -1
+end
+return release()
+"""
+
+# Откладывает сообщение, если чат удержан, и подтверждает его. Если удержание истекло,
+# а отложенные остались - сообщение встает за ними и все возвращаются в стримы.
+# ARGV: член индекса, исходный стрим, группа, id сообщения, запись для списка, TTL списка (с), время
+_PARK_SCRIPT = _HOLD_SCRIPT_PRELUDE + """
+if redis.call('EXISTS', KEYS[1]) == 0 and redis.call('LLEN', KEYS[2]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[7], ARGV[1])
+redis.call('XACK', streams[ARGV[2]], ARGV[3], ARGV[4])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 1
+end
+return release()
+"""
+
+OUTGOING_STREAMS = {
+    "high": OUTGOING_STREAM_HIGH,
+    "normal": OUTGOING_STREAM_NORMAL,
+    "low": OUTGOING_STREAM_LOW,
+}
+
+ACTION_PRIORITY = {
+    "manual_reply": "high",
+    "image_reply": "high",
+    "template_reply": "normal",
+    "auto_reply": "low",
+}
+
+
+def outgoing_stream_for(action_type: str) -> str:
+    """Стрим для исходящего сообщения; неизвестные типы идут в normal."""
+    return OUTGOING_STREAMS[ACTION_PRIORITY.get(action_type, "normal")]
+
+
+def outgoing_stream_weights() -> List[Tuple[str, int]]:
+    """[(стрим, вес)] по убыванию приоритета из строки вида "high=8,normal=3,low=1"."""
+    weights = {}
+    for part in (p.strip() for p in settings.avito_outgoing_weights.split(",")):
+        if part:
+            name, _, weight = part.partition("=")
+            weights[name.strip()] = int(weight)
+    return [(stream, max(1, weights.get(name, 1))) for name, stream in OUTGOING_STREAMS.items()]
+
+
+def _chat_hold_member(account_id, chat_id: str) -> str:
+    return f"{account_id}:{chat_id}"
+
+
+def chat_hold_keys(account_id, chat_id: str) -> List[str]:
+    """KEYS скриптов удержания: hold, parked, индекс и все стримы исходящих (normal первым)."""
+    return [
+        CHAT_HOLD_KEY_TPL.format(account_id=account_id, chat_id=chat_id),
+        CHAT_PARKED_KEY_TPL.format(account_id=account_id, chat_id=chat_id),
+        CHAT_PARKED_INDEX_KEY,
+        OUTGOING_STREAM_NORMAL,
+        OUTGOING_STREAM_HIGH,
+        OUTGOING_STREAM_LOW,
+    ]
+
+
+def chat_hold_ttl() -> int:
+    """Удержание продлевается каждым повтором; TTL - страховка на случай потерянного повтора."""
+    return int(settings.avito_retry_max_delay * 2) + 60
+
+
+def chat_parked_ttl() -> int:
+    """
+    Отложенные сообщения живут вдвое дольше удержания: после его истечения их вернет
+    release_expired_chat_holds (стадия retry_scheduler), TTL - последняя страховка.
+    """
+    return chat_hold_ttl() * 2
+
+
+async def park_if_chat_held(
+    redis_client: redis.Redis,
+    stream_name: str,
+    group_name: str,
+    message_id: str,
+    data: Dict[str, Any]
+) -> bool:
+    """Откладывает сообщение за ожидающим повтором того же чата. True - сообщение отложено и подтверждено."""
+    account_id, chat_id = data["account_id"], data["chat_id"]
+    entry = json_dumps_str({"stream": stream_name, "fields": strip_service_fields(data)})
+    parked = await get_script(redis_client, _PARK_SCRIPT)(
+        keys=chat_hold_keys(account_id, chat_id),
+        args=[_chat_hold_member(account_id, chat_id), stream_name, group_name, message_id, entry,
+              chat_parked_ttl(), time.time()],
+        client=redis_client,
+    )
+    return parked != 0
+
+
+def hold_chat(pipeline, account_id, chat_id: str, message_id: str):
+    """Удерживает чат, пока повтор message_id ждет в delay set (в пайплайне постановки повтора)."""
+    hold_key, parked_key = chat_hold_keys(account_id, chat_id)[:2]
+    pipeline.set(hold_key, message_id, ex=chat_hold_ttl())
+    pipeline.expire(parked_key, chat_parked_ttl())
+
+
+async def release_chat_hold(pipeline, account_id, chat_id: str):
+    """Снимает удержание и возвращает отложенные сообщения чата в их стримы по порядку."""
+    await get_script(pipeline, _RELEASE_SCRIPT)(
+        keys=chat_hold_keys(account_id, chat_id), args=[_chat_hold_member(account_id, chat_id)], client=pipeline
+    )
+
+
+async def release_expired_chat_holds(redis_client: redis.Redis, batch_size: int = 100) -> int:
+    """
+    Возвращает в стримы отложенные сообщения чатов, удержание которых истекло, а снять его
+    было некому: повтор ушел в DLQ через PendingReclaimer или потерян. Возвращает число сообщений.
+    """
+    released = 0
+    for member in await redis_client.zrange(CHAT_PARKED_INDEX_KEY, 0, batch_size - 1):
+        account_id, _, chat_id = member.partition(":")
+        count = await get_script(redis_client, _RELEASE_EXPIRED_SCRIPT)(
+            keys=chat_hold_keys(account_id, chat_id), args=[member], client=redis_client
+        )
+        if count > 0:
+            logger.warning(f"AVITO_HOLD: hold of chat {chat_id} expired, {count} parked message(s) released.")
+            released += count
+    return released
+
+
+def chat_action_dedupe_key(account_id, chat_id: str, action: str) -> str:
+    return CHAT_ACTION_DEDUPE_KEY_TPL.format(account_id=account_id, chat_id=chat_id, action=action)
+
+
+async def enqueue_chat_action(
+    redis_client: redis.Redis,
+    account_id,
+    chat_id: str,
+    action: str = "mark_read",
+    requested_by: Optional[int] = None
+):
+    """
+    Ставит действие с чатом в avito:chat:actions, если такое же еще не ждет обработки.
+    Работает и с клиентом, и с пайплайном RedisUnitOfWork.
+    requested_by - Telegram ID, которому воркер сообщит, если действие так и не удалось выполнить.
+    """
+    fields = {"account_id": str(account_id), "chat_id": chat_id, "action": action}
+    if requested_by:
+        fields["requested_by"] = str(requested_by)
+    return await enqueue_once(
+        redis_client,
+        chat_action_dedupe_key(account_id, chat_id, action),
+        CHAT_ACTION_DEDUPE_TTL_MS,
+        CHAT_ACTIONS_STREAM,
+        fields,
+    )
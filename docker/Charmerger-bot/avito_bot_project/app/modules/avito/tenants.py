@@ -0,0 +1,70 @@
+# /app/modules/avito/tenants.py
+"""
+Арендатор (tenant) входящего сообщения - владелец Avito-аккаунта.
+
+Вебхук один раз определяет владельца и его тариф (с кэшем в Redis) и кладет их
+в сообщение полями owner_id/owner_plan. Дальше поля едут вместе с сообщением через
+autoreply -> forwarder -> event_processor, и эти стадии планируют обработку
+справедливо по владельцам (shared/streams.py, DeficitRoundRobin): 30 аккаунтов
+одного пользователя делят одну долю, а не получают 30.
+"""
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import redis.asyncio as redis
+from sqlalchemy import select
+
+from db_models import AvitoAccount, User
+from shared.database import get_session
+from modules.billing.config import TARIFF_CONFIG
+from modules.billing.enums import TariffPlan
+
+logger = logging.getLogger(__name__)
+
+TENANT_CACHE_KEY_TPL = "avito:tenant:{avito_user_id}"
+# Смена владельца или тарифа подхватывается в течение этого времени
+TENANT_CACHE_TTL = 600
+_UNKNOWN = "-"
+
+OWNER_ID_FIELD = "owner_id"
+OWNER_PLAN_FIELD = "owner_plan"
+
+
+async def resolve_tenant(redis_client: redis.Redis, avito_user_id: str) -> Optional[Tuple[str, str]]:
+    """(id владельца в нашей БД, тариф) для Avito-аккаунта или None, если аккаунт не подключен."""
+    cache_key = TENANT_CACHE_KEY_TPL.format(avito_user_id=avito_user_id)
+    cached = await redis_client.get(cache_key)
+    if cached is None:
+        async with get_session() as session:
+            row = (await session.execute(
+                select(User.id, User.tariff_plan)
+                .join(AvitoAccount, AvitoAccount.user_id == User.id)
+                .where(AvitoAccount.avito_user_id == int(avito_user_id))
+            )).first()
+        cached = f"{row.id}:{row.tariff_plan}" if row else _UNKNOWN
+        await redis_client.set(cache_key, cached, ex=TENANT_CACHE_TTL)
+
+    if cached == _UNKNOWN:
+        return None
+    owner_id, _, plan = cached.partition(":")
+    return owner_id, plan
+
+
+def plan_weight(plan: Optional[str]) -> float:
+    """Вес тарифа в справедливом планировании (limits.pipeline_weight в TARIFF_CONFIG)."""
+    try:
+        return float(TARIFF_CONFIG[TariffPlan(plan)]["limits"].get("pipeline_weight", 1))
+    except ValueError:
+        return 1.0
+
+
+def message_tenant(data: Dict[str, Any]) -> Tuple[str, float]:
+    """
+    tenant_func для run_stream_consumer. Сообщения без owner_id (поставленные
+    до обновления) группируются по аккаунту.
+    """
+    owner_id = data.get(OWNER_ID_FIELD)
+    if not owner_id:
+        account = data.get("account_id") or data.get("avito_user_id") or ""
+        return f"account:{account}", 1.0
+    return f"owner:{owner_id}", plan_weight(data.get(OWNER_PLAN_FIELD))
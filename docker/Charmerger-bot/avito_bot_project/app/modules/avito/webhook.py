@@ -3,13 +3,15 @@
 import logging
 import hmac
 import hashlib
-import json
+from shared.serialization import json_loads
 from typing import Optional
 
 from fastapi import Request, Header, HTTPException
 import redis.asyncio as redis
 
 from shared.config import settings
+from shared.tracing import stamp_trace
+from .tenants import resolve_tenant, OWNER_ID_FIELD, OWNER_PLAN_FIELD
 
 logger = logging.getLogger(__name__)
 
@@ -52,13 +54,13 @@ class AvitoWebhookHandler:
         #     raise HTTPException(status_code=403, detail="Invalid signature.")
 
         # 3. Декодируем JSON
-        payload = json.loads(payload_bytes)
+        payload = json_loads(payload_bytes)
         
         webhook_data = payload.get("payload", {})
         event_type = webhook_data.get("type")
         
         if event_type != "message":
-            logger.info(f"Skipping unsupported webhook event type: {event_type}")
+            logger.info("Skipping unsupported webhook event type: %s", event_type)
             return {"status": "event_skipped"}
 
         # --- НОВАЯ ЛОГИКА: ПРОВЕРКА АВТОРА СООБЩЕНИЯ ---
@@ -72,7 +74,7 @@ class AvitoWebhookHandler:
         # Если автор сообщения - это владелец аккаунта, то это наше собственное сообщение.
         # Мы не должны его обрабатывать как входящее.
         if account_id == author_id:
-            logger.info(f"AVITO_WEBHOOK: Skipping own outgoing message for account {account_id}.")
+            logger.debug("AVITO_WEBHOOK: Skipping own outgoing message for account %s.", account_id)
             return {"status": "own_message_skipped"}
         # --- КОНЕЦ НОВОЙ ЛОГИКИ ---
 
@@ -113,8 +115,16 @@ class AvitoWebhookHandler:
             logger.warning(f"Received Avito message with missing user_id or chat_id. Payload: {payload}")
             return {"status": "event_skipped_missing_data"}
 
+        # Владелец и тариф - для справедливой обработки по пользователям в стадиях конвейера
+        tenant = await resolve_tenant(self.redis, message_data["account_id"])
+        if tenant:
+            message_data[OWNER_ID_FIELD], message_data[OWNER_PLAN_FIELD] = tenant
+
+        # Начало трассы: время приема и trace_id едут с сообщением до карточки в Telegram
+        stamp_trace(message_data)
+
         # 6. Логируем и публикуем событие в Redis
-        logger.info(f"AVITO_WEBHOOK: Queuing message to 'avito:incoming:messages'. Data: {message_data}")
+        logger.debug("AVITO_WEBHOOK: Queuing message to 'avito:incoming:messages'. Data: %s", message_data)
         await self.redis.xadd("avito:incoming:messages", message_data)
         
         return {"status": "ok"}
\ No newline at end of file
@@ -4,10 +4,9 @@ import asyncio
 import logging
 from typing import Optional
 
-import json
 from db_models import MessageLog
 from datetime import datetime, timezone
-from ..telegram.view_provider import VIEW_KEY_TPL 
+from ..telegram.view_provider import VIEW_KEY_TPL, load_view_model, save_view_model, rehydrate_view_model
 from ..telegram.view_renderer import ViewRenderer 
 from ..telegram.bot import bot 
 import redis.asyncio as redis
@@ -15,221 +14,238 @@ from sqlalchemy import select
 
 # Импорты из нашего проекта
 from shared.database import get_session
+from shared.streams import run_stream_consumer, run_priority_stream_consumer
+from shared.redis_uow import RedisUnitOfWork
+from shared.retry import ATTEMPT_FIELD, queue_retry_or_dead_letter
 from db_models import AvitoAccount
 from .client import AvitoAPIClient
 from .messaging import AvitoMessaging
 from .actions import AvitoChatActions 
+from .queues import (
+    outgoing_stream_weights, CHAT_ACTIONS_STREAM, chat_action_dedupe_key,
+    hold_chat, park_if_chat_held, release_chat_hold
+)
+from shared.coalesce import release
 
 logger = logging.getLogger(__name__)
 
-async def process_outgoing_messages(redis_client: redis.Redis):
+# Сообщения и действия, которые не удалось выполнить после всех повторов (или с постоянной ошибкой).
+# Поле dlq_source хранит исходный стрим - туда сообщение вернется при повторной обработке.
+OUTGOING_DLQ_STREAM = "avito:outgoing:dlq"
+
+async def process_outgoing_messages(redis_client: redis.Redis, consumer_name: str = "outgoing_consumer_1", lanes: int = 1):
     """
-    Слушает стрим avito:outgoing:messages, отправляет сообщения в Avito,
+    Слушает приоритетные стримы исходящих сообщений (см. queues.py), отправляет сообщения в Avito,
     ЛОГИРУЕТ ИСХОДЯЩЕЕ СООБЩЕНИЕ, обновляет ChatViewModel и запускает перерисовку.
+    Стримы читаются с весами: ручные ответы не ждут за очередью автоответов.
     """
-    stream_name = "avito:outgoing:messages"
     group_name = "avito_workers"
-    consumer_name = "outgoing_consumer_1"
-
-    try:
-        await redis_client.xgroup_create(stream_name, group_name, id="0", mkstream=True)
-        logger.info(f"Consumer group '{group_name}' created for stream '{stream_name}'.")
-    except redis.ResponseError as e:
-        if "BUSYGROUP" in str(e):
-            logger.info(f"Consumer group '{group_name}' for stream '{stream_name}' already exists.")
-        else:
-            raise
-
-    while True:
+
+    async def handle_message(stream_name: str, message_id: str, data: dict):
+        logger.debug("AVITO_WORKER: Processing outgoing Avito message %s", message_id)
+
+        account_id = int(data['account_id'])
+        chat_id = data['chat_id']
+
+        action_type = data.get("action_type", "manual_reply")
+        is_retry = ATTEMPT_FIELD in data
+
+        # Пока повтор более раннего сообщения этого чата ждет в delay set, новые откладываются:
+        # иначе они ушли бы в Avito раньше него (см. queues.py)
+        if not is_retry and await park_if_chat_held(redis_client, stream_name, group_name, message_id, data):
+            logger.info("AVITO_WORKER: Chat %s waits for a retry, message %s parked.", chat_id, message_id)
+            return
+
+        async with get_session() as session:
+            account = await session.get(AvitoAccount, account_id)
+            if not (account and account.is_active):
+                logger.warning(f"Account {account_id} not found or inactive. Skipping message.")
+                async with RedisUnitOfWork(redis_client) as uow:
+                    if is_retry:
+                        await release_chat_hold(uow.pipeline, account_id, chat_id)
+                    uow.pipeline.xack(stream_name, group_name, message_id)
+                return
+
+        # 1. Отправляем сообщение в Avito. Повторяется только сама отправка:
+        # ошибки в шагах ниже не должны приводить к повторной отправке клиенту.
+        sent_text_for_log = data.get('text', '')
         try:
-            events = await redis_client.xreadgroup(
-                group_name, consumer_name, {stream_name: ">"}, count=1, block=5000
-            )
-            
-            if not events:
-                continue
-
-            for _, messages in events:
-                for message_id, data in messages:
-                    logger.info(f"AVITO_WORKER: Processing outgoing Avito message {message_id}")
-                    
-                    account_id = int(data['account_id'])
-                    chat_id = data['chat_id']
-
-                    action_type = data.get("action_type", "manual_reply")
-                    
-                    async with get_session() as session:
-                        account = await session.get(AvitoAccount, account_id)
-                        if not (account and account.is_active):
-                            logger.warning(f"Account {account_id} not found or inactive. Skipping message.")
-                            await redis_client.xack(stream_name, group_name, message_id)
-                            continue
-
-                    try:
-                        # 1. Отправляем сообщение в Avito
-                        api_client = AvitoAPIClient(account)
-                        messaging = AvitoMessaging(api_client)
-
-                        sent_text_for_log = data.get('text', '')
-                        
-                        if action_type == "image_reply":
-                            image_id = data['image_id']
-                            await messaging.send_image_message(chat_id, image_id, sent_text_for_log)
-                            logger.info(f"AVITO_WORKER: Successfully sent IMAGE to Avito chat {chat_id}")
-                            # Для лога используем подпись или плейсхолдер
-                            if not sent_text_for_log:
-                                sent_text_for_log = "[Изображение]"
-                        else: # text, template, autoreply
-                            await messaging.send_text_message(chat_id, sent_text_for_log)
-                            logger.info(f"AVITO_WORKER: Successfully sent TEXT to Avito chat {chat_id}")
-
-                        # ---!!!  БЛОК: ЛОГИРУЕМ ИСХОДЯЩЕЕ СООБЩЕНИЕ В БД !!!---
-                        is_autoreply = action_type == "auto_reply"
-                        trigger_name = None
-                        if action_type == "template_reply":
-                            trigger_name = data.get("template_name")
-                        elif is_autoreply:
-                            trigger_name = data.get("rule_name")
-                        
-                        async with get_session() as log_session:
-                            log_entry_db = MessageLog(
-                                account_id=account.id,
-                                chat_id=chat_id,
-                                direction='out',
-                                is_autoreply=is_autoreply,
-                                trigger_name=trigger_name
-                            )
-                            log_session.add(log_entry_db)
-                        logger.info(f"AVITO_WORKER: Logged outgoing message for chat {chat_id} to DB.")
-                        # ---!!! КОНЕЦ  БЛОКА !!!---
-
-                        # 2. Обновляем нашу ChatViewModel
-                        view_key = VIEW_KEY_TPL.format(account_id=account.id, chat_id=chat_id)
-                        model_json = await redis_client.get(view_key)
-                        if model_json:
-                            model = json.loads(model_json)
-                            
-                            log_entry = {
-                                "type": action_type,
-                                "author_name": data.get("author_name", "Неизвестно"),
-                                "text": sent_text_for_log,
-                                "timestamp": int(datetime.now(timezone.utc).timestamp())
-                            }
-                            
-                            action_log = model.setdefault("action_log", [])
-                            action_log.insert(0, log_entry)
-                            model["action_log"] = action_log[:5]
-                            model["is_last_message_read"] = True
-                            
-                            await redis_client.set(view_key, json.dumps(model), keepttl=True)
-                            
-                            renderer = ViewRenderer(bot, redis_client)
-                            await renderer.update_all_subscribers(view_key, model)
-
-                    except Exception as e:
-                        logger.error(f"AVITO_WORKER: Failed to send message for account {account_id}: {e}", exc_info=True)
-                    
-                    await redis_client.xack(stream_name, group_name, message_id)
+            api_client = AvitoAPIClient(account)
+            messaging = AvitoMessaging(api_client)
+
+            if action_type == "image_reply":
+                image_id = data['image_id']
+                await messaging.send_image_message(chat_id, image_id, sent_text_for_log)
+                logger.info("AVITO_WORKER: Successfully sent IMAGE to Avito chat %s", chat_id)
+                # Для лога используем подпись или плейсхолдер
+                if not sent_text_for_log:
+                    sent_text_for_log = "[Изображение]"
+            else: # text, template, autoreply
+                await messaging.send_text_message(chat_id, sent_text_for_log)
+                logger.info("AVITO_WORKER: Successfully sent TEXT to Avito chat %s", chat_id)
+        except Exception as e:
+            logger.error(f"AVITO_WORKER: Failed to send message for account {account_id}: {e}", exc_info=True)
+            # Повтор с задержкой (чат удерживается до него) или DLQ + ack - одним пайплайном
+            async with RedisUnitOfWork(redis_client) as uow:
+                if queue_retry_or_dead_letter(uow, stream_name, OUTGOING_DLQ_STREAM, data, e):
+                    hold_chat(uow.pipeline, account_id, chat_id, message_id)
+                elif is_retry:
+                    await release_chat_hold(uow.pipeline, account_id, chat_id)
+                uow.pipeline.xack(stream_name, group_name, message_id)
+            return
+
+        view_key, model = None, None
+        try:
+            # ---!!!  БЛОК: ЛОГИРУЕМ ИСХОДЯЩЕЕ СООБЩЕНИЕ В БД !!!---
+            is_autoreply = action_type == "auto_reply"
+            trigger_name = None
+            if action_type == "template_reply":
+                trigger_name = data.get("template_name")
+            elif is_autoreply:
+                trigger_name = data.get("rule_name")
+
+            async with get_session() as log_session:
+                log_entry_db = MessageLog(
+                    account_id=account.id,
+                    chat_id=chat_id,
+                    direction='out',
+                    is_autoreply=is_autoreply,
+                    trigger_name=trigger_name
+                )
+                log_session.add(log_entry_db)
+            logger.debug("AVITO_WORKER: Logged outgoing message for chat %s to DB.", chat_id)
+            # ---!!! КОНЕЦ  БЛОКА !!!---
+
+            # 2. Обновляем нашу ChatViewModel
+            view_key = VIEW_KEY_TPL.format(account_id=account.id, chat_id=chat_id)
+            model = await load_view_model(redis_client, view_key)
+            if model:
+                log_entry = {
+                    "type": action_type,
+                    "author_name": data.get("author_name", "Неизвестно"),
+                    "text": sent_text_for_log,
+                    "timestamp": int(datetime.now(timezone.utc).timestamp())
+                }
+
+                action_log = model.setdefault("action_log", [])
+                action_log.insert(0, log_entry)
+                model["action_log"] = action_log[:5]
+                model["is_last_message_read"] = True
 
         except Exception as e:
-            logger.error(f"Critical error in 'process_outgoing_messages' worker: {e}", exc_info=True)
-            await asyncio.sleep(5)
+            logger.error(f"AVITO_WORKER: Message sent, but post-processing failed for chat {chat_id}: {e}", exc_info=True)
 
+        # 3. Модель и ack уходят одним пайплайном. Ack до перерисовки безопасен:
+        # сообщение уже доставлено в Avito, а перерисовка - лучшее усилие.
+        # Доставленный повтор отпускает отложенные за ним сообщения чата.
+        async with RedisUnitOfWork(redis_client) as uow:
+            if model:
+                await save_view_model(uow.pipeline, view_key, model)
+            if is_retry:
+                await release_chat_hold(uow.pipeline, account_id, chat_id)
+            uow.pipeline.xack(stream_name, group_name, message_id)
 
-async def process_chat_actions(redis_client: redis.Redis):
+        if model:
+            renderer = ViewRenderer(bot, redis_client)
+            await renderer.update_all_subscribers(view_key, model)
+
+    await run_priority_stream_consumer(
+        redis_client, outgoing_stream_weights(), group_name, consumer_name, handle_message, lanes=lanes
+    )
+
+
+async def process_chat_actions(redis_client: redis.Redis, consumer_name: str = "action_consumer_1", lanes: int = 1):
     """
     Слушает очередь 'avito:chat:actions' и выполняет действия 
     (прочитано, печатаю, стоп печатаю).
+    Повторные действия схлопываются еще при постановке (queues.enqueue_chat_action);
+    карточка перерисовывается, только если ее состояние действительно изменилось.
     """
-    stream_name = "avito:chat:actions"
+    stream_name = CHAT_ACTIONS_STREAM
     group_name = "avito_action_workers"
-    consumer_name = "action_consumer_1"
 
     renderer = ViewRenderer(bot, redis_client)
 
-    try:
-        await redis_client.xgroup_create(stream_name, group_name, id="0", mkstream=True)
-    except redis.ResponseError as e:
-        if "BUSYGROUP" not in str(e): raise
+    async def handle_message(message_id: str, data: dict):
+        logger.debug("AVITO_ACTIONS_WORKER: Processing action %s with data: %s", message_id, data)
 
-    while True:
-        try:
-            events = await redis_client.xreadgroup(
-                group_name, consumer_name, {stream_name: ">"}, count=1, block=5000
-            )
-            if not events: continue
-
-            for _, messages in events:
-                for message_id, data in messages:
-                    logger.info(f"AVITO_ACTIONS_WORKER: Processing action {message_id} with data: {data}")
-                    
-                    account_id = int(data['account_id'])
-                    chat_id = data['chat_id']
-                    action_type = data['action']
-                    
-                    async with get_session() as session:
-                        account = await session.get(AvitoAccount, account_id)
-                        if not (account and account.is_active):
-                            logger.warning(f"Account {account_id} not found/inactive for chat action.")
-                            await redis_client.xack(stream_name, group_name, message_id)
-                            continue
-                    
-                    try:
-                        api_client = AvitoAPIClient(account)
-                        actions = AvitoChatActions(api_client) # AvitoChatActions еще не существует, создадим его
-                        
-                        if action_type == "mark_read":
-                            # 1. Выполняем действие с API Avito
-                            await actions.mark_as_read(chat_id)
-                            
-                            # 2. Обновляем ChatViewModel
-                            view_key = VIEW_KEY_TPL.format(account_id=account.id, chat_id=chat_id)
-                            model_json = await redis_client.get(view_key)
-
-                            if not model_json:
-                                # Если модели еще нет, создаем ее.
-                                # Это защищает от состояния гонки.
-                                # При навигации (не новое сообщение) is_new_message=False.
-                                logger.warning(f"ACTIONS_WORKER: No view model for {view_key}. Rehydrating.")
-                                model = await rehydrate_view_model(redis_client, account, chat_id)
-                                if not model:
-                                    logger.error(f"ACTIONS_WORKER: Failed to rehydrate model for {view_key}.")
-                                    # Выходим, если не удалось создать модель
-                                    await redis_client.xack(stream_name, group_name, message_id)
-                                    continue
-                            else:
-                                model = json.loads(model_json)
-                            
-                            # 3. Взводим флаг
-                            model["is_last_message_read"] = True
-                            await redis_client.set(view_key, json.dumps(model), keepttl=True)
-                            
-                            # 4. Запускаем перерисовку у всех подписчиков
-                            logger.info(f"ACTIONS_WORKER: Triggering rerender for {view_key} after mark_read.")
-                            await renderer.update_all_subscribers(view_key, model)
-                        # ---!!! КОНЕЦ БЛОКА !!!---
-                            
-                        else:
-                            logger.warning(f"AVITO_ACTIONS_WORKER: Received unknown action type '{action_type}'")
-
-                    except Exception as e:
-                        logger.error(f"AVITO_ACTIONS_WORKER: Failed to perform action {action_type}: {e}", exc_info=True)
+        account_id = int(data['account_id'])
+        chat_id = data['chat_id']
+        action_type = data['action']
 
-                    await redis_client.xack(stream_name, group_name, message_id)
+        # Снимаем признак "в очереди" до вызова API: нажатия до этого момента покрывает
+        # текущий вызов, а нажатие во время него поставит новое действие
+        await release(redis_client, chat_action_dedupe_key(account_id, chat_id, action_type))
 
-        except Exception as e:
-            logger.error(f"Critical error in 'process_chat_actions' worker: {e}", exc_info=True)
-            await asyncio.sleep(5)
+        async with get_session() as session:
+            account = await session.get(AvitoAccount, account_id)
+            if not (account and account.is_active):
+                logger.warning(f"Account {account_id} not found/inactive for chat action.")
+                await redis_client.xack(stream_name, group_name, message_id)
+                return
 
-# --- Главная функция-запускатор для всех воркеров Avito ---
-async def start_avito_outgoing_worker(redis_client: redis.Redis):
-    """
-    Запускает все асинхронные задачи, связанные с исходящими действиями Avito.
-    """
-    logger.info("Starting Avito workers (messages and actions)...")
-    
-    # Запускаем оба воркера параллельно
-    await asyncio.gather(
-        process_outgoing_messages(redis_client),
-        process_chat_actions(redis_client)
-    )
\ No newline at end of file
+        if action_type != "mark_read":
+            logger.warning(f"AVITO_ACTIONS_WORKER: Received unknown action type '{action_type}'")
+            await redis_client.xack(stream_name, group_name, message_id)
+            return
+
+        # 1. Выполняем действие с API Avito (при временной ошибке - повтор с задержкой)
+        try:
+            actions = AvitoChatActions(AvitoAPIClient(account))
+            await actions.mark_as_read(chat_id)
+        except Exception as e:
+            logger.error(f"AVITO_ACTIONS_WORKER: Failed to perform action {action_type}: {e}")
+            async with RedisUnitOfWork(redis_client) as uow:
+                if not queue_retry_or_dead_letter(uow, stream_name, OUTGOING_DLQ_STREAM, data, e) \
+                        and data.get("requested_by"):
+                    # Повторов больше не будет - сообщаем нажавшему "Прочитано"
+                    uow.pipeline.xadd("telegram:outgoing:messages", {
+                        "user_id": data["requested_by"],
+                        "text": f"❌ Avito не отметил чат прочитанным (аккаунт «{account.alias or account.id}»). "
+                                f"Попробуйте еще раз позже.",
+                    })
+                uow.pipeline.xack(stream_name, group_name, message_id)
+            return
+
+        view_key, model = None, None
+        try:
+            # 2. Обновляем ChatViewModel
+            view_key = VIEW_KEY_TPL.format(account_id=account.id, chat_id=chat_id)
+            model = await load_view_model(redis_client, view_key)
+
+            if not model:
+                # Если модели еще нет, создаем ее.
+                # Это защищает от состояния гонки.
+                # При навигации (не новое сообщение) is_new_message=False.
+                logger.warning(f"ACTIONS_WORKER: No view model for {view_key}. Rehydrating.")
+                model = await rehydrate_view_model(redis_client, account, chat_id)
+                if not model:
+                    logger.error(f"ACTIONS_WORKER: Failed to rehydrate model for {view_key}.")
+                    # Выходим, если не удалось создать модель
+                    await redis_client.xack(stream_name, group_name, message_id)
+                    return
+            elif model.get("is_last_message_read"):
+                # Карточка уже показана прочитанной - сохранять и перерисовывать нечего
+                logger.debug("ACTIONS_WORKER: %s is already read, skipping rerender.", view_key)
+                model = None
+
+            # 3. Взводим флаг
+            if model:
+                model["is_last_message_read"] = True
+        except Exception as e:
+            logger.error(f"AVITO_ACTIONS_WORKER: Action {action_type} done, but view update failed: {e}", exc_info=True)
+
+        # Модель и ack - одним пайплайном
+        async with RedisUnitOfWork(redis_client) as uow:
+            if model:
+                await save_view_model(uow.pipeline, view_key, model)
+            uow.pipeline.xack(stream_name, group_name, message_id)
+
+        # 4. Запускаем перерисовку у всех подписчиков
+        if model:
+            logger.debug("ACTIONS_WORKER: Triggering rerender for %s after mark_read.", view_key)
+            await renderer.update_all_subscribers(view_key, model)
+
+    await run_stream_consumer(
+        redis_client, stream_name, group_name, consumer_name, handle_message, lanes=lanes
+    )
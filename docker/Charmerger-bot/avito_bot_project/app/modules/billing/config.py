@@ -32,6 +32,8 @@ TARIFF_CONFIG: Dict[TariffPlan, Dict[str, Any]] = {
             "forwarding_rules": 0,
             "chat_notes": 1,
             "analytics_access": "none",
+            # Доля в справедливой обработке входящих сообщений (shared/streams.py)
+            "pipeline_weight": 1,
             "can_reply_from_tg": True,
         }
     },
@@ -60,6 +62,8 @@ TARIFF_CONFIG: Dict[TariffPlan, Dict[str, Any]] = {
             "forwarding_can_reply": False,
             "chat_notes": 10,
             "analytics_access": "basic",
+            # Доля в справедливой обработке входящих сообщений (shared/streams.py)
+            "pipeline_weight": 2,
             "can_reply_from_tg": True,
         }
     },
@@ -89,6 +93,8 @@ TARIFF_CONFIG: Dict[TariffPlan, Dict[str, Any]] = {
             "forwarding_can_reply": True,
             "chat_notes": float('inf'),
             "analytics_access": "full",
+            # Доля в справедливой обработке входящих сообщений (shared/streams.py)
+            "pipeline_weight": 4,
             "can_reply_from_tg": True,
             "priority_support": True,
         }
@@ -10,7 +10,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.attributes import flag_modified
 # Импорты из нашего проекта
 from db_models import User, Transaction, Template, AutoReplyRule, AvitoAccount, MessageLog, ChatNote, ForwardingRule
-from shared.database import get_session
+from shared.database import get_session, get_read_session
 from shared.security import encrypt_token
 from modules.billing.enums import TariffPlan
 import uuid
@@ -233,8 +233,8 @@ async def delete_note_for_chat(account_id: int, chat_id: str, author_id: int) ->
 # ===================================================================
 
 async def get_account_stats(account_id: int) -> dict:
-    """Считает статистику по сообщениям для аккаунта за сегодня и за неделю."""
-    async with get_session() as session:
+    """Считает статистику по сообщениям для аккаунта за сегодня и за неделю (с реплики)."""
+    async with get_read_session() as session:
         now = datetime.now(timezone.utc)
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         week_start = today_start - timedelta(days=now.weekday())
@@ -325,8 +325,9 @@ async def create_transaction_and_update_balance(
     """
     # 1. Получаем пользователя с блокировкой для обновления (FOR UPDATE)
     # Это предотвращает "гонки состояний", когда два процесса одновременно меняют баланс
+    # populate_existing: если пользователь уже загружен в этой сессии, берем баланс из заблокированной строки
     result = await session.execute(
-        select(User).where(User.id == user_id).with_for_update()
+        select(User).where(User.id == user_id).with_for_update().execution_options(populate_existing=True)
     )
     user = result.scalar_one_or_none()
 
@@ -372,7 +373,7 @@ async def schedule_user_downgrade(
     return user
 
 async def get_user_transactions(session: AsyncSession, user_id: int, limit: int = 20) -> List[Transaction]:
-    """Возвращает последние транзакции пользователя."""
+    """Возвращает последние транзакции пользователя. Только чтение - можно передать сессию get_read_session()."""
     result = await session.execute(
         select(Transaction)
         .where(Transaction.user_id == user_id)
@@ -596,7 +597,7 @@ async def update_forwarding_permissions(
 # === CRUD ДЛЯ АДМИН-ПАНЕЛИ ===
 
 async def get_all_users_for_admin(session: AsyncSession, limit: int = 100, offset: int = 0) -> List[User]:
-    """Возвращает список всех пользователей с пагинацией."""
+    """Возвращает список всех пользователей с пагинацией. Только чтение - можно передать сессию get_read_session()."""
     result = await session.execute(
         select(User).order_by(desc(User.created_at)).limit(limit).offset(offset)
     )
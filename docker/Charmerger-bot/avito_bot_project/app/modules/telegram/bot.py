@@ -8,20 +8,34 @@ from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, Teleg
 from aiogram.types import WebAppInfo, ReplyKeyboardRemove, Message, User, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
 
 from .handlers import register_all_handlers
 from .payment_handlers import payment_router
+from .middlewares import DbSessionMiddleware, TelegramApiMetricsMiddleware
 import shared.config as sh
+from shared.serialization import json_dumps_str, json_loads
 
 logger = logging.getLogger(__name__)
 
 # --- Инициализация ---
 # Сначала создаем бота, потом диспетчер
+# TELEGRAM_API_BASE_URL - свой сервер Bot API (локальный или заглушка для нагрузочных тестов)
+_session = (
+    AiohttpSession(api=TelegramAPIServer.from_base(sh.settings.telegram_api_base_url))
+    if sh.settings.telegram_api_base_url else None
+)
 bot = Bot(
     token=sh.settings.telegram_bot_token, 
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    session=_session
 )
 
+# Метрики всех вызовов Bot API (и из хендлеров, и из воркеров)
+bot.session.middleware(TelegramApiMetricsMiddleware())
+
 dp = Dispatcher()
 
 # Регистрируем все наши обработчики (команды, ответы, кнопки)
@@ -48,6 +62,42 @@ async def remove_telegram_webhook():
     logger.info("Removing Telegram webhook...")
     await bot.delete_webhook()
 
+_dispatcher_ready = False
+
+def setup_dispatcher(redis_client):
+    """
+    Регистрирует middleware диспетчера (клиент Redis для хендлеров) и подключает
+    хранилище FSM в Redis. Вызывается и веб-процессом, и стадией telegram_updates - повторный вызов ничего не делает.
+    """
+    global _dispatcher_ready
+    if _dispatcher_ready:
+        return
+    # dp.update.outer_middleware - срабатывает на все типы апдейтов
+    dp.update.outer_middleware(DbSessionMiddleware(redis_client))
+    logger.info("Aiogram DbSessionMiddleware зарегистрирован.")
+
+    if sh.settings.fsm_storage == "redis":
+        dp.fsm.storage = create_fsm_storage(redis_client)
+        logger.info(f"FSM-состояния хранятся в Redis (TTL {sh.settings.fsm_ttl_seconds} с).")
+    _dispatcher_ready = True
+
+def create_fsm_storage(redis_client) -> RedisStorage:
+    """
+    Хранилище FSM в Redis на общем пуле соединений: состояние пользователя видно
+    любому процессу (веб-реплике или стадии telegram_updates) и переживает рестарт.
+    Ключи fsm:{bot_id}:{chat}:{user}:state|data живут FSM_TTL_SECONDS - брошенные
+    на полпути диалоги (переименование, заметка, инвайт) не копятся в Redis.
+    Данные кодируются orjson без пробелов.
+    """
+    return RedisStorage(
+        redis_client,
+        key_builder=DefaultKeyBuilder(prefix="fsm", with_bot_id=True),
+        state_ttl=sh.settings.fsm_ttl_seconds,
+        data_ttl=sh.settings.fsm_ttl_seconds,
+        json_dumps=json_dumps_str,
+        json_loads=json_loads,
+    )
+
 async def process_telegram_update(update: dict):
     """
     Принимает обновление от FastAPI и передает его в aiogram для обработки.
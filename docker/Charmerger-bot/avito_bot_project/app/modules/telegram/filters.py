@@ -1,12 +1,13 @@
 # /app/modules/telegram/filters.py
 import logging
-import json
 from typing import Union, Dict
 
 from aiogram.filters import BaseFilter
 from aiogram.types import Message
 import redis.asyncio as redis
 
+from .view_provider import load_reply_context
+
 logger = logging.getLogger(__name__)
 
 class HasAvitoContextFilter(BaseFilter):
@@ -14,11 +15,11 @@ class HasAvitoContextFilter(BaseFilter):
         if not message.reply_to_message:
             return False
 
-        context_key = f"tg_context:{message.reply_to_message.message_id}"
-        context_data_json = await redis_client.get(context_key)
+        context_data = await load_reply_context(
+            redis_client, message.chat.id, message.reply_to_message.message_id
+        )
 
-        if context_data_json:
-            context_data = json.loads(context_data_json)
+        if context_data:
             logger.info(f"AVITO_CONTEXT_FILTER: Checking context for reply: {context_data}")
             # Проверяем флаг can_reply, который мы передаем из forwarder'a
             if context_data.get("can_reply") != 'true':
@@ -7,7 +7,6 @@ from html import escape as html_escape
 from datetime import datetime, timezone
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-import json
 from .view_renderer import ViewRenderer
 from db_models import User, Template
 from aiogram import Bot, Router, types, F, Dispatcher
@@ -19,7 +18,6 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 import redis.asyncio as redis
 from .keyboards import get_single_account_menu, get_avito_accounts_menu
 from .filters import HasAvitoContextFilter
-from shared.config import REPLY_MAPPING_TTL
 from shared.config import settings
 from modules.database.crud import (
     get_or_create_user,
@@ -33,11 +31,15 @@ from modules.database.crud import (
     set_avito_account_alias
 )
 from modules.avito.client import AvitoAPIClient
+from modules.avito.queues import outgoing_stream_for, enqueue_chat_action
 from .keyboards import get_main_menu_keyboard, get_avito_accounts_menu, get_single_account_menu, build_chats_list_keyboard, get_wallet_menu_keyboard, get_tariffs_list_keyboard, get_deposit_options_keyboard,get_templates_for_chat_keyboard
 from .states import RenameAvitoAccount, EditChatNote, AcceptInvite 
 from .view_provider import (
     rehydrate_view_model,
     subscribe_user_to_view,
+    load_view_model,
+    save_view_model,
+    save_reply_context,
     VIEW_KEY_TPL
 )
 from aiogram.enums import ParseMode 
@@ -51,6 +53,7 @@ from .keyboards import get_deposit_options_keyboard
 from .payment_handlers import send_deposit_invoice 
 from .navigation import handle_navigation_by_action
 from shared.database import get_session
+from shared.redis_uow import RedisUnitOfWork
 from modules.database import crud
 from aiogram.fsm.context import FSMContext
 from shared.config import SUPPORT_GREETING_MESSAGE, SUPPORT_FAQ
@@ -107,8 +110,7 @@ async def show_chat_card_by_context(avito_context: dict, user_tg: types.User, re
         sent_message = await renderer.render_new_card(model, user_db)
         if sent_message:
             await subscribe_user_to_view(redis_client, view_key, user_db.telegram_id, sent_message.message_id)
-            context_key = f"tg_context:{sent_message.message_id}"
-            await redis_client.set(context_key, json.dumps(avito_context), ex=REPLY_MAPPING_TTL)
+            await save_reply_context(redis_client, user_db.telegram_id, sent_message.message_id, avito_context)
     except Exception as e:
         logger.error(f"Failed to redraw chat card after error: {e}")
 # ===================================================================
@@ -183,10 +185,6 @@ async def handle_reply_message(message: types.Message, redis_client: redis.Redis
         await billing_service.check_and_increment_daily_messages(user, redis_client)
 
         # --- Существующая логика ---
-        await redis_client.xadd(
-            "avito:chat:actions",
-            {"account_id": str(avito_context['avito_account_id']), "chat_id": avito_context['avito_chat_id'], "action": "mark_read"}
-        )
         outgoing_message = {
             "account_id": str(avito_context['avito_account_id']),
             "chat_id": avito_context['avito_chat_id'],
@@ -194,7 +192,10 @@ async def handle_reply_message(message: types.Message, redis_client: redis.Redis
             "action_type": "manual_reply",
             "author_name": message.from_user.first_name or message.from_user.username or f"ID {message.from_user.id}"
         }
-        await redis_client.xadd("avito:outgoing:messages", outgoing_message)
+        # Обе команды уходят в Redis одним пайплайном
+        async with RedisUnitOfWork(redis_client) as uow:
+            await enqueue_chat_action(uow.pipeline, avito_context['avito_account_id'], avito_context['avito_chat_id'])
+            uow.pipeline.xadd(outgoing_stream_for("manual_reply"), outgoing_message)
         await message.delete()
 
     except TariffLimitReachedError as e:
@@ -265,13 +266,12 @@ async def handle_photo_reply(message: types.Message, redis_client: redis.Redis,
                 "image_id": image_id, "text": caption,
                 "author_name": message.from_user.first_name or message.from_user.username or f"ID {message.from_user.id}",
             }
-            await redis_client.xadd("avito:outgoing:messages", outgoing_message)
+            await redis_client.xadd(outgoing_stream_for("image_reply"), outgoing_message)
 
             view_key = f"chat_view:{account_id}:{chat_id}"
             await subscribe_user_to_view(redis_client, view_key, message.from_user.id, new_card_message.message_id)
-            context_key = f"tg_context:{new_card_message.message_id}"
             avito_context['can_reply'] = 'true'
-            await redis_client.set(context_key, json.dumps(avito_context), ex=REPLY_MAPPING_TTL)
+            await save_reply_context(redis_client, message.chat.id, new_card_message.message_id, avito_context)
         except Exception as e_inner:
             logger.error(f"Error during Avito processing for chat {chat_id}: {e_inner}", exc_info=True)
             if new_card_message:
@@ -313,14 +313,9 @@ async def handle_deep_link(message: types.Message, command: CommandObject, state
             if rule.invite_password:
                 await state.update_data(invite_code=invite_code)
                 
-                # ---!!! ОТЛАДОЧНЫЙ ЛОГ №1: УСТАНОВКА СОСТОЯНИЯ !!!---
                 target_state = AcceptInvite.waiting_for_password
-                logger.critical(
-                    f"[DEBUG-FSM] DEEP_LINK for user {user_id}: "
-                    f"Attempting to set state to '{target_state.state}'"
-                )
+                logger.debug("[FSM] DEEP_LINK for user %s: setting state to '%s'", user_id, target_state.state)
                 await state.set_state(target_state)
-                # --------------------------------------------------
 
                 await message.answer("Для принятия приглашения, пожалуйста, введите пароль:")
             else:
@@ -340,13 +335,9 @@ async def handle_deep_link(message: types.Message, command: CommandObject, state
 async def process_invite_password(message: types.Message, state: FSMContext, redis_client):
     user_id = message.from_user.id # Сохраняем для лога
     
-    # ---!!! ОТЛАДОЧНЫЙ ЛОГ №2: ПРОВЕРКА СОСТОЯНИЯ !!!---
-    current_state = await state.get_state()
-    logger.critical(
-        f"[DEBUG-FSM] PROCESS_PASSWORD for user {user_id}: "
-        f"Handler triggered. Current FSM state is: '{current_state}'"
-    )
-    # ----------------------------------------------------
+    # Чтение состояния - лишний запрос к хранилищу FSM, только при включенном DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[FSM] PROCESS_PASSWORD for user %s: current state '%s'", user_id, await state.get_state())
 
     user_password = message.text.strip()
     state_data = await state.get_data()
@@ -466,11 +457,6 @@ async def show_chat_card(callback: types.CallbackQuery, redis_client: redis.Redi
 # ==========================================================
 @router.callback_query(F.data.startswith("chat:mark_read:"))
 async def mark_read_handler(callback: types.CallbackQuery, redis_client: redis.Redis, bot: Bot):
-    try:
-        await callback.answer("Помечаю как прочитанное...")
-    except TelegramBadRequest:
-        return
-
     try:
         _, _, account_id_str, chat_id = callback.data.split(":")[:4]
         account_id = int(account_id_str)
@@ -478,43 +464,17 @@ async def mark_read_handler(callback: types.CallbackQuery, redis_client: redis.R
         logger.error(f"Invalid callback_data format for mark_read: {callback.data}")
         return
 
-    account = await crud.get_avito_account_by_id(account_id)
-    if not account:
-        logger.warning(f"Account {account_id} not found for mark_read action.")
-        return
-
+    # API Avito, обновление карточки и перерисовку выполняет воркер avito_actions: сейчас
+    # известно только, что действие в очереди. Карточка станет прочитанной после вызова API,
+    # а если он так и не удастся, воркер пришлет нажавшему сообщение об ошибке.
+    # Повторные нажатия, пока действие в очереди, схлопываются в один вызов API.
+    queued = await enqueue_chat_action(redis_client, account_id, chat_id, requested_by=callback.from_user.id)
     try:
-        api_client = AvitoAPIClient(account)
-        await api_client.mark_chat_as_read(chat_id)
-        logger.info(f"Chat {chat_id} marked as read in Avito API by user {callback.from_user.id}")
-    except AvitoAPIError as e:
-        logger.error(f"Failed to mark chat as read in Avito API for chat {chat_id}: {e}")
-        try:
-            await callback.answer("❌ Ошибка при обращении к API Avito.", show_alert=True)
-        except TelegramBadRequest: pass
-        return
-
-    view_key = VIEW_KEY_TPL.format(account_id=account.id, chat_id=chat_id)
-    model_json = await redis_client.get(view_key)
-    if not model_json:
-        logger.warning(f"View model not found for key: {view_key}. Cannot update Telegram messages.")
-        return
-        
-    model: dict = json.loads(model_json)
-    
-    # Меняем флаг
-    model['is_last_message_read'] = True
-    
-    # ---!!! ОТЛАДОЧНЫЙ ЛОГ №4 !!!---
-    logger.critical(
-        f"[DEBUG-READ-STATUS] MARK_READ for chat {chat_id}: "
-        f"SETTING is_last_message_read = True. Saving to Redis and updating subscribers."
-    )
-    
-    await redis_client.set(view_key, json.dumps(model), keepttl=True)
-    
-    renderer = ViewRenderer(bot, redis_client)
-    await renderer.update_all_subscribers(view_key, model)
+        await callback.answer("⏳ Отметка «Прочитано» поставлена в очередь.")
+    except TelegramBadRequest:
+        pass
+    if not queued:
+        logger.info(f"mark_read for chat {chat_id} is already queued, press by user {callback.from_user.id} coalesced.")
 
 
 @router.callback_query(F.data.startswith("chat:block:") | F.data.startswith("chat:unblock:"))
@@ -539,12 +499,11 @@ async def block_unblock_chat_handler(callback: types.CallbackQuery, redis_client
             await api_client.unblock_user(int(user_id_str))
 
         view_key = f"chat_view:{account.id}:{chat_id}"
-        model_json = await redis_client.get(view_key)
-        if model_json:
-            model = json.loads(model_json)
+        model = await load_view_model(redis_client, view_key)
+        if model:
             model['is_blocked'] = new_status
             model['telegram_message_id'] = callback.message.message_id
-            await redis_client.set(view_key, json.dumps(model), keepttl=True)
+            await save_view_model(redis_client, view_key, model)
 
             renderer = ViewRenderer(bot, redis_client)
             await renderer.render(view_key=view_key, model=model)
@@ -643,8 +602,7 @@ async def edit_chat_note_start(callback: types.CallbackQuery, state: FSMContext,
     )
     
     view_key = VIEW_KEY_TPL.format(account_id=account_id, chat_id=chat_id)
-    model_json = await redis_client.get(view_key)
-    model = json.loads(model_json) if model_json else {}
+    model = await load_view_model(redis_client, view_key) or {}
 
     prompt_text = "✍️ Отправьте ответным сообщением новый текст вашей заметки.\n\n"
     
@@ -709,10 +667,9 @@ async def process_chat_note_text(message: types.Message, state: FSMContext, redi
 
     # Обновляем ChatViewModel и перерисовываем
     view_key = VIEW_KEY_TPL.format(account_id=account_id, chat_id=chat_id)
-    model_json = await redis_client.get(view_key)
+    model = await load_view_model(redis_client, view_key)
     
-    if model_json:
-        model = json.loads(model_json)
+    if model:
         user_tg_id_str = str(user.telegram_id)
         
         # Получаем словарь заметок, если его нет - создаем
@@ -731,7 +688,7 @@ async def process_chat_note_text(message: types.Message, state: FSMContext, redi
             }
         
         # Сохраняем обновленную модель
-        await redis_client.set(view_key, json.dumps(model), keepttl=True)
+        await save_view_model(redis_client, view_key, model)
         
         # Запускаем перерисовку у всех подписчиков
         renderer = ViewRenderer(bot, redis_client)
@@ -779,9 +736,8 @@ async def delete_chat_note_handler(callback: types.CallbackQuery, redis_client:
     
     # Обновляем view_model
     view_key = f"chat_view:{account_id}:{chat_id}"
-    model_json = await redis_client.get(view_key)
-    if model_json:
-        model = json.loads(model_json)
+    model = await load_view_model(redis_client, view_key)
+    if model:
         model.update({
             "note_text": None,
             "note_author_name": None,
@@ -789,7 +745,7 @@ async def delete_chat_note_handler(callback: types.CallbackQuery, redis_client:
             # ВАЖНО: Указываем, какую карточку редактировать
             "telegram_message_id": target_message_id 
         })
-        await redis_client.set(view_key, json.dumps(model), keepttl=True)
+        await save_view_model(redis_client, view_key, model)
         
         # Публикуем событие на перерисовку
         await _publish_view_update(redis_client, account_id, chat_id)
@@ -987,10 +943,7 @@ async def send_template_to_chat(callback: types.CallbackQuery, redis_client: red
         pass # Игнорируем, если не получилось
 
     # 3. Отправляем команду "прочитано"
-    await redis_client.xadd(
-        "avito:chat:actions",
-        {"account_id": str(account_id), "chat_id": chat_id, "action": "mark_read"}
-    )
+    await enqueue_chat_action(redis_client, account_id, chat_id)
 
     # 4. Отправляем сообщение в очередь, как и раньше
     outgoing_message = {
@@ -1001,7 +954,7 @@ async def send_template_to_chat(callback: types.CallbackQuery, redis_client: red
         "template_name": template.name,
         "author_name": callback.from_user.first_name or callback.from_user.username or f"ID {callback.from_user.id}"
     }
-    await redis_client.xadd("avito:outgoing:messages", outgoing_message)
+    await redis_client.xadd(outgoing_stream_for("template_reply"), outgoing_message)
 
 @router.callback_query(F.data.startswith("chat:show:"))
 async def show_chat_card_handler(callback: types.CallbackQuery, redis_client: redis.Redis, bot: Bot):
@@ -1027,24 +980,21 @@ async def show_chat_card_handler(callback: types.CallbackQuery, redis_client: re
 
     view_key = VIEW_KEY_TPL.format(account_id=account.id, chat_id=chat_id)
     
-    model_json = await redis_client.get(view_key)
+    model = await load_view_model(redis_client, view_key)
     
-    if model_json:
-        model = json.loads(model_json)
-        # ---!!! ОТЛАДОЧНЫЙ ЛОГ №3 !!!---
-        logger.critical(
-            f"[DEBUG-READ-STATUS] SHOW_CARD (from cache) for chat {chat_id}: "
-            f"Read from Redis is_last_message_read = {model.get('is_last_message_read')}"
+    if model:
+        logger.debug(
+            "[READ-STATUS] SHOW_CARD (from cache) for chat %s: is_last_message_read = %s",
+            chat_id, model.get('is_last_message_read')
         )
     else:
         logger.warning(f"No model for {view_key} in cache. Rehydrating from API...")
         # Этот вызов уже залогирует данные из API через лог №1
         model = await rehydrate_view_model(redis_client, account, chat_id)
-        # ---!!! ОТЛАДОЧНЫЙ ЛОГ №3.1 !!!---
         if model:
-            logger.critical(
-                f"[DEBUG-READ-STATUS] SHOW_CARD (rehydrated) for chat {chat_id}: "
-                f"Value is is_last_message_read = {model.get('is_last_message_read')}"
+            logger.debug(
+                "[READ-STATUS] SHOW_CARD (rehydrated) for chat %s: is_last_message_read = %s",
+                chat_id, model.get('is_last_message_read')
             )
 
     if not model:
@@ -1060,11 +1010,10 @@ async def show_chat_card_handler(callback: types.CallbackQuery, redis_client: re
         callback.message.message_id
     )
 
-    model_json = await redis_client.get(view_key)
-    if not model_json:
+    model = await load_view_model(redis_client, view_key)
+    if not model:
         logger.error(f"Model for {view_key} disappeared after subscription. Aborting render.")
         return
-    model = json.loads(model_json)
     
     renderer = ViewRenderer(bot, redis_client)
     try:
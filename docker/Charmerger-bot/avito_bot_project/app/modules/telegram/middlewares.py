@@ -1,12 +1,19 @@
 # /app/modules/telegram/middlewares.py
+import time
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.types import TelegramObject
 import redis.asyncio as redis
+from shared.database import unit_of_work
+from shared.db_stats import query_scope
+from shared.metrics import TELEGRAM_API_LATENCY, TELEGRAM_API_REQUESTS
 
 class DbSessionMiddleware(BaseMiddleware):
     """
-    Этот middleware будет передавать в хендлеры клиент Redis.
+    Этот middleware будет передавать в хендлеры клиент Redis и открывать единицу работы с БД
+    на весь апдейт: CRUD-функции внутри хендлера используют одну сессию (см. shared/database.py).
+    Хендлер может получить ее явно через аргумент `uow` (`session = await uow.session()`).
     """
     # Возвращаем конструктор
     def __init__(self, redis_client: redis.Redis):
@@ -21,4 +28,27 @@ class DbSessionMiddleware(BaseMiddleware):
     ) -> Any:
         # Просто кладем наш клиент в data
         data["redis_client"] = self.redis_client
-        return await handler(event, data)
\ No newline at end of file
+        # Учет SQL-запросов апдейта: имя - тип апдейта (message, callback_query, ...)
+        with query_scope("telegram", getattr(event, "event_type", type(event).__name__)):
+            async with unit_of_work() as uow:
+                data["uow"] = uow
+                return await handler(event, data)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: время и результат каждого вызова Bot API
+    (telegram_api_request_seconds, telegram_api_requests_total).
+    """
+    async def __call__(self, make_request, bot, method):
+        api_method = type(method).__name__
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_API_REQUESTS.labels(method=api_method, outcome=type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_API_LATENCY.labels(method=api_method).observe(time.perf_counter() - started)
+        TELEGRAM_API_REQUESTS.labels(method=api_method, outcome="ok").inc()
+        return response
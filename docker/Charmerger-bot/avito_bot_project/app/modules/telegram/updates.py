@@ -0,0 +1,83 @@
+# /app/modules/telegram/updates.py
+"""
+Асинхронный прием обновлений Telegram через стрим (TELEGRAM_UPDATES_MODE=stream).
+
+Вебхук только проверяет JSON, отбрасывает повторы (Telegram повторяет доставку,
+если не дождался ответа) и кладет сырое обновление в стрим telegram:updates -
+ответ 200 уходит сразу, не дожидаясь хендлеров. Стадия telegram_updates читает стрим
+и передает обновления в диспетчер aiogram; полосы разбиты по пользователю/чату,
+поэтому обновления одного пользователя обрабатываются строго по порядку.
+"""
+import logging
+from typing import Any, Dict
+
+import redis.asyncio as redis
+
+from shared.coalesce import enqueue_once
+from shared.config import TELEGRAM_UPDATE_DEDUPE_TTL_MS
+from shared.serialization import json_loads
+from shared.streams import run_stream_consumer
+from .bot import bot, dp, setup_dispatcher
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_UPDATES_STREAM = "telegram:updates"
+UPDATE_DEDUPE_KEY_TPL = "tg:update:{update_id}"
+
+
+def update_partition_key(update: Dict[str, Any]) -> str:
+    """
+    Ключ порядка обновления: пользователь (from.id), а если его нет - чат.
+    Берется из единственного объекта обновления (message, callback_query, pre_checkout_query...).
+    """
+    for field, payload in update.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user") or {}
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat") or {}
+        return str(user.get("id") or chat.get("id") or "")
+    return ""
+
+
+async def enqueue_telegram_update(redis_client: redis.Redis, raw_update: bytes) -> bool:
+    """
+    Проверяет обновление и ставит его в стрим. False - повтор уже принятого обновления.
+    ValueError - тело не является обновлением Telegram.
+    """
+    update = json_loads(raw_update)
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        raise ValueError("Telegram update without update_id")
+
+    message_id = await enqueue_once(
+        redis_client,
+        UPDATE_DEDUPE_KEY_TPL.format(update_id=update["update_id"]),
+        TELEGRAM_UPDATE_DEDUPE_TTL_MS,
+        TELEGRAM_UPDATES_STREAM,
+        {"chat_id": update_partition_key(update), "update": raw_update},
+    )
+    if not message_id:
+        logger.info(f"TG_UPDATES: Duplicate update {update['update_id']} skipped.")
+    return bool(message_id)
+
+
+async def start_telegram_update_worker(redis_client: redis.Redis, consumer_name: str = "tg_updates_1", lanes: int = 1):
+    """Читает telegram:updates и передает обновления в диспетчер aiogram."""
+    logger.info("Telegram Update Worker started.")
+    stream_name = TELEGRAM_UPDATES_STREAM
+    group_name = "telegram_update_workers"
+
+    # В отдельном процессе воркеров middleware диспетчера еще не зарегистрированы
+    setup_dispatcher(redis_client)
+
+    async def handle_message(message_id: str, data: dict):
+        try:
+            await dp.feed_webhook_update(bot, json_loads(data["update"]))
+        except Exception as e:
+            # Повтор хендлера может повторить побочные эффекты (списания, отправки) - не повторяем
+            logger.error(f"TG_UPDATES: Failed to process update from stream message {message_id}: {e}", exc_info=True)
+        finally:
+            await redis_client.xack(stream_name, group_name, message_id)
+
+    await run_stream_consumer(
+        redis_client, stream_name, group_name, consumer_name, handle_message, lanes=lanes
+    )
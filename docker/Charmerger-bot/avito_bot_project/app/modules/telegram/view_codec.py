@@ -0,0 +1,83 @@
+# /app/modules/telegram/view_codec.py
+"""
+Компактное версионированное кодирование ChatViewModel для хранения в Redis.
+
+Формат значения ключа chat_view:*:
+    b"{..."                      - старый формат (JSON), читается для обратной совместимости
+    b"\\x01" + msgpack            - CODEC_MSGPACK
+    b"\\x02" + zstd(msgpack)      - CODEC_MSGPACK_ZSTD
+
+Первый байт однозначно определяет формат, поэтому старые и новые ключи
+могут жить в Redis одновременно, пока идет миграция.
+"""
+import logging
+from typing import Any, Optional, Union
+
+import msgpack
+
+from shared.config import settings
+from shared.serialization import json_dumps, json_loads
+from .view_models import ChatViewModel
+
+try:
+    import zstandard
+except ImportError:  # сжатие опционально
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Актуальная версия схемы модели. Увеличивается при изменении набора полей.
+VIEW_VERSION = 14
+
+CODEC_MSGPACK = 1
+CODEC_MSGPACK_ZSTD = 2
+
+_JSON_MARKER = ord("{")
+
+_zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+if settings.view_codec == "msgpack_zstd" and zstandard is None:
+    logger.warning("VIEW_CODEC=msgpack_zstd, но пакет zstandard не установлен. Модели будут храниться без сжатия.")
+
+
+def encode_view(model: ChatViewModel) -> bytes:
+    """Кодирует модель в формат, заданный настройкой VIEW_CODEC."""
+    if settings.view_codec == "json":
+        return json_dumps(model)
+
+    model["view_version"] = VIEW_VERSION
+    packed = msgpack.packb(model, use_bin_type=True)
+
+    if (
+        settings.view_codec == "msgpack_zstd"
+        and _zstd_compressor is not None
+        and len(packed) >= settings.view_compression_min_bytes
+    ):
+        return bytes((CODEC_MSGPACK_ZSTD,)) + _zstd_compressor.compress(packed)
+    return bytes((CODEC_MSGPACK,)) + packed
+
+
+def decode_view(raw: Optional[Union[bytes, str]]) -> Optional[ChatViewModel]:
+    """Декодирует значение из Redis любого поддерживаемого формата. None -> None."""
+    if not raw:
+        return None
+    if isinstance(raw, str):
+        # Клиент с decode_responses=True может вернуть только старый JSON-формат
+        return json_loads(raw)
+
+    marker = raw[0]
+    if marker == _JSON_MARKER:
+        return json_loads(raw)
+    if marker == CODEC_MSGPACK:
+        return _unpack(raw[1:])
+    if marker == CODEC_MSGPACK_ZSTD:
+        if _zstd_decompressor is None:
+            raise RuntimeError("Модель сжата zstd, но пакет zstandard не установлен.")
+        return _unpack(_zstd_decompressor.decompress(raw[1:]))
+    raise ValueError(f"Неизвестный формат chat_view (маркер {marker:#x}).")
+
+
+def _unpack(data: bytes) -> Any:
+    # strict_map_key=False: ключи subscribers/notes - строки, но не ломаемся на старых данных
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
@@ -1,18 +1,137 @@
 import logging
-import json
+from shared.serialization import json_dumps, json_loads
 from typing import Optional, Dict, Any
 import asyncio
 import redis.asyncio as redis
+from redis.client import NEVER_DECODE
 from db_models import User, AvitoAccount
 from modules.database.crud import get_all_notes_for_chat
 from modules.avito.client import AvitoAPIClient
 from .view_models import ChatViewModel
+from .view_codec import encode_view, decode_view, VIEW_VERSION
 from shared.database import get_session
+from shared.config import settings, REPLY_MAPPING_TTL, REPLY_CONTEXT_MAX_ENTRIES
+from shared.redis_uow import RedisUnitOfWork
+from shared.metrics import timed, VIEW_LOADS
+from .view_snapshots import load_snapshot, mark_dirty
 
 logger = logging.getLogger(__name__)
-VIEW_TTL_SECONDS = 60 * 60 * 24 * 3  # 3 дня
+VIEW_TTL_SECONDS = settings.view_ttl_seconds  # по умолчанию 3 дня
 VIEW_KEY_TPL = "chat_view:{account_id}:{chat_id}"
+# Контексты ответов (карточка -> Avito-чат) хранятся в одном хеше на пользователя:
+# tg_ctx:{telegram_id} -> { message_id: json }
+REPLY_CONTEXT_KEY_TPL = "tg_ctx:{telegram_id}"
+# Старый формат: отдельный строковый ключ на каждую карточку. Читается, пока не истечет TTL.
+LEGACY_REPLY_CONTEXT_KEY_TPL = "tg_context:{message_id}"
 
+
+# ===================================================================
+# === Хранение ChatViewModel ========================================
+# ===================================================================
+
+async def load_view_model(redis_client: redis.Redis, view_key: str) -> Optional[ChatViewModel]:
+    """
+    Читает модель из Redis в любом поддерживаемом формате (JSON или бинарный).
+    Если ключа нет (истек или вытеснен) - из копии в PostgreSQL, и возвращает ее в Redis.
+    """
+    # NEVER_DECODE: значение может быть бинарным, а общий клиент работает с decode_responses=True
+    raw = await redis_client.execute_command("GET", view_key, **{NEVER_DECODE: True})
+    if raw:
+        VIEW_LOADS.labels(source="redis").inc()
+        return decode_view(raw)
+    if not settings.view_snapshots_enabled:
+        VIEW_LOADS.labels(source="miss").inc()
+        return None
+
+    raw = await load_snapshot(view_key)
+    if not raw:
+        VIEW_LOADS.labels(source="miss").inc()
+        return None
+    VIEW_LOADS.labels(source="snapshot").inc()
+    # NX: если карточку успели записать заново, пока шел запрос к БД, свежая версия важнее
+    await redis_client.set(view_key, raw, ex=VIEW_TTL_SECONDS, nx=True)
+    logger.debug("View %s restored from PostgreSQL snapshot.", view_key)
+    return decode_view(raw)
+
+
+async def save_view_model(
+    redis_client: redis.Redis,
+    view_key: str,
+    model: ChatViewModel,
+    refresh_ttl: bool = False
+):
+    """
+    Сохраняет модель в компактном формате.
+    redis_client может быть пайплайном (uow.pipeline) - тогда запись уйдет вместе с ним.
+    - refresh_ttl=True: продлевает жизнь карточки на VIEW_TTL_SECONDS (новая активность в чате).
+    - иначе сохраняет текущий TTL ключа.
+    Ключ отмечается для сохранения копии в PostgreSQL (см. view_snapshots.py).
+    """
+    if refresh_ttl:
+        await redis_client.set(view_key, encode_view(model), ex=VIEW_TTL_SECONDS)
+    else:
+        await redis_client.set(view_key, encode_view(model), keepttl=True)
+    if settings.view_snapshots_enabled:
+        await mark_dirty(redis_client, view_key)
+
+
+# ===================================================================
+# === Контекст ответа для карточек (tg_ctx) =========================
+# ===================================================================
+
+def queue_reply_context(
+    uow: RedisUnitOfWork,
+    telegram_id: int,
+    message_id: int,
+    context: Dict[str, Any]
+):
+    """Добавляет запись контекста карточки в UoW. Хеш подрезается после commit(), если переполнен."""
+    key = REPLY_CONTEXT_KEY_TPL.format(telegram_id=telegram_id)
+    uow.pipeline.hset(key, str(message_id), json_dumps(context))
+    uow.pipeline.expire(key, REPLY_MAPPING_TTL)
+    uow.pipeline.hlen(key)
+
+    async def _trim_if_needed(entries_count: int):
+        if entries_count > REPLY_CONTEXT_MAX_ENTRIES:
+            await _trim_reply_contexts(uow.redis, key, entries_count)
+
+    uow.on_result(_trim_if_needed)
+
+
+async def save_reply_context(
+    redis_client: redis.Redis,
+    telegram_id: int,
+    message_id: int,
+    context: Dict[str, Any]
+):
+    """Запоминает, к какому Avito-чату относится карточка message_id у пользователя telegram_id."""
+    async with RedisUnitOfWork(redis_client, transaction=False) as uow:
+        queue_reply_context(uow, telegram_id, message_id, context)
+
+
+async def _trim_reply_contexts(redis_client: redis.Redis, key: str, entries_count: int):
+    """Удаляет самые старые карточки (message_id в чате Telegram растут монотонно)."""
+    message_ids = sorted(int(field) for field in await redis_client.hkeys(key))
+    # Удаляем с запасом 10%, чтобы не чистить хеш на каждой новой карточке
+    to_delete = message_ids[:entries_count - int(REPLY_CONTEXT_MAX_ENTRIES * 0.9)]
+    if to_delete:
+        await redis_client.hdel(key, *map(str, to_delete))
+
+
+async def load_reply_context(
+    redis_client: redis.Redis,
+    telegram_id: int,
+    message_id: int
+) -> Optional[Dict[str, Any]]:
+    """Возвращает контекст карточки. Учитывает ключи старого формата tg_context:{message_id}."""
+    key = REPLY_CONTEXT_KEY_TPL.format(telegram_id=telegram_id)
+    context_json = await redis_client.hget(key, str(message_id))
+    if context_json is None:
+        context_json = await redis_client.get(LEGACY_REPLY_CONTEXT_KEY_TPL.format(message_id=message_id))
+    return json_loads(context_json) if context_json else None
+
+
+@timed("view_provider.rehydrate_view_model")
 async def rehydrate_view_model(
     redis_client: redis.Redis,
     account: AvitoAccount,
@@ -49,7 +168,7 @@ async def rehydrate_view_model(
 
         # Формируем базовую модель БЕЗ информации о последнем сообщении
         base_model: ChatViewModel = {
-            "view_version": 13,
+            "view_version": VIEW_VERSION,
             "account_id": account.id, "account_alias": account.alias, "chat_id": chat_id,
             "interlocutor_name": interlocutor.get("name", "Собеседник"),
             "interlocutor_id": interlocutor.get("id"),
@@ -63,9 +182,8 @@ async def rehydrate_view_model(
         }
 
         # Сливаем со старой моделью, чтобы не потерять подписчиков и лог ответов
-        current_model_json = await redis_client.get(view_key)
-        if current_model_json:
-            current_model = json.loads(current_model_json)
+        current_model = await load_view_model(redis_client, view_key)
+        if current_model:
             base_model["subscribers"] = current_model.get("subscribers", {})
             base_model["action_log"] = current_model.get("action_log", [])
         
@@ -75,6 +193,12 @@ async def rehydrate_view_model(
         logger.error(f"Failed to rehydrate view model for {view_key}: {e}", exc_info=True)
         return None
 
+def add_subscriber(model: ChatViewModel, telegram_id: int, message_id: int):
+    """Добавляет (или перезаписывает) подписку пользователя в модели, не обращаясь к Redis."""
+    # Если пользователь уже подписан с другим сообщением, старая подписка просто перезаписывается
+    model.setdefault("subscribers", {})[str(telegram_id)] = message_id
+
+
 async def subscribe_user_to_view(
     redis_client: redis.Redis,
     view_key: str,
@@ -82,41 +206,25 @@ async def subscribe_user_to_view(
     message_id: int
 ):
     """Добавляет пользователя и ID его сообщения в подписчики общей модели."""
-    model_json = await redis_client.get(view_key)
-    if not model_json:
+    model = await load_view_model(redis_client, view_key)
+    if not model:
         # Если модели нет, то подписываться не на что.
         # Этого не должно происходить, если мы всегда сначала создаем модель.
         logger.warning(f"Cannot subscribe to non-existent view: {view_key}")
         return
 
-    model: ChatViewModel = json.loads(model_json)
-    
-    # Получаем словарь подписчиков, если его нет - создаем
-    subscribers = model.setdefault("subscribers", {})
-    
-    # Если пользователь уже подписан с другим сообщением, нужно найти и удалить старую подписку
-    # Этого сценария нужно избегать, но на всякий случай обработаем
-    for sub_tg_id, sub_msg_id in list(subscribers.items()):
-        if int(sub_tg_id) == telegram_id and sub_msg_id != message_id:
-            # Нашли старую подписку этого же юзера, но с другим message_id
-            # Это значит, что он открыл карточку в новом сообщении, не закрыв старую.
-            # Для простоты можно просто перезаписать.
-            pass # В данном случае просто перезапись ниже решит проблему
-
-    # Добавляем или перезаписываем подписку
-    subscribers[str(telegram_id)] = message_id
-    
+    add_subscriber(model, telegram_id, message_id)
+
     # Сохраняем обновленную модель
-    await redis_client.set(view_key, json.dumps(model), keepttl=True)
+    await save_view_model(redis_client, view_key, model)
     logger.info(f"User {telegram_id} subscribed to {view_key} with message {message_id}")
 
 async def unsubscribe_user_from_view(redis_client: redis.Redis, view_key: str, telegram_id: int):
     """Удаляет пользователя из подписчиков."""
-    model_json = await redis_client.get(view_key)
-    if model_json:
-        model: ChatViewModel = json.loads(model_json)
+    model = await load_view_model(redis_client, view_key)
+    if model:
         # Безопасно удаляем подписчика, если он есть
         if str(telegram_id) in model.get("subscribers", {}):
             del model["subscribers"][str(telegram_id)]
-            await redis_client.set(view_key, json.dumps(model), keepttl=True)
+            await save_view_model(redis_client, view_key, model)
             logger.info(f"User {telegram_id} unsubscribed from {view_key}")
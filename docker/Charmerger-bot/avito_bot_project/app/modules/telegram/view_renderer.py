@@ -2,7 +2,7 @@ import logging
 import json
 import html
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Iterable, Optional
 
 # --- ИЗМЕНЕНИЕ: Добавляем pytz и select из sqlalchemy ---
 import pytz
@@ -20,6 +20,9 @@ from db_models import User
 from .view_provider import unsubscribe_user_from_view
 # --- ИЗМЕНЕНИЕ: Импортируем get_session для запроса к БД ---
 from shared.database import get_session
+from shared.config import settings
+from shared.metrics import timed
+from shared.offload import offload_when_slow
 
 logger = logging.getLogger(__name__)
 
@@ -36,11 +39,9 @@ class ViewRenderer:
         chat_id = model['chat_id']
         
         is_read_flag = model.get('is_last_message_read', True) # Получаем флаг, по умолчанию True
-        
-        # ---!!! ОТЛАДОЧНЫЙ ЛОГ №5 !!!---
-        logger.critical(
-            f"[DEBUG-READ-STATUS] BUILD_KEYBOARD for chat {chat_id} (user: {for_telegram_id}): "
-            f"Building button based on is_last_message_read = {is_read_flag}"
+        logger.debug(
+            "[READ-STATUS] BUILD_KEYBOARD for chat %s (user: %s): is_last_message_read = %s",
+            chat_id, for_telegram_id, is_read_flag
         )
 
         # Логика генерации кнопки на основе флага
@@ -168,6 +169,12 @@ class ViewRenderer:
         if notes_block: final_parts.append(notes_block)
         return "\n\n".join(final_parts)
 
+    @offload_when_slow("view_renderer.build_texts", settings.render_offload_budget_ms)
+    def _build_texts(self, model: ChatViewModel, timezones: Iterable[str]) -> Dict[str, str]:
+        """Тексты карточки для набора часовых поясов (у подписчиков они обычно совпадают)."""
+        return {tz: self._build_text(model, tz) for tz in timezones}
+
+    @timed("view_renderer.render_new_card")
     async def render_new_card(self, model: ChatViewModel, user: User) -> Optional[types.Message]:
         """Отправляет новую карточку конкретному пользователю."""
         telegram_chat_id = user.telegram_id
@@ -185,6 +192,7 @@ class ViewRenderer:
             logger.error(f"RENDERER: Error sending new card to {telegram_chat_id}: {e}", exc_info=True)
             return None
 
+    @timed("view_renderer.update_all_subscribers")
     async def update_all_subscribers(self, view_key: str, model: ChatViewModel):
         """Обновляет сообщения у всех подписчиков, загружая их таймзоны."""
         subscribers = model.get("subscribers", {})
@@ -205,7 +213,12 @@ class ViewRenderer:
             )
             users_map = {user.telegram_id: user for user in result.scalars().all()}
         
-        # 3. Проходимся по подписчикам и рендерим для каждого
+        # 3. Рендерим текст один раз на часовой пояс (при многих подписчиках - вне цикла событий)
+        # и клавиатуру один раз: она не зависит от подписчика
+        texts = await self._build_texts(model, {user.timezone for user in users_map.values()})
+        keyboard = self._build_keyboard(model, subscriber_ids[0]).as_markup()
+
+        # 4. Проходимся по подписчикам и обновляем карточку каждого
         for tg_id_str, msg_id in list(subscribers.items()):
             tg_id = int(tg_id_str)
             user = users_map.get(tg_id)
@@ -213,9 +226,7 @@ class ViewRenderer:
                 logger.warning(f"RENDERER: User {tg_id} not found in DB, skipping update.")
                 continue
 
-            # Передаем часовой пояс конкретного пользователя в _build_text
-            text = self._build_text(model, user.timezone)
-            keyboard = self._build_keyboard(model, tg_id).as_markup()
+            text = texts[user.timezone]
             
             try:
                 await self.bot.edit_message_text(
@@ -0,0 +1,144 @@
+# /app/modules/telegram/view_snapshots.py
+"""
+Копии ChatViewModel в PostgreSQL (таблица chat_view_snapshots).
+
+Redis остается основным хранилищем карточек, таблица - отложенная копия (write-behind):
+- save_view_model отмечает ключ в ZSET VIEW_DIRTY_KEY (в том же пайплайне, что и запись);
+- стадия view_checkpointer раз в VIEW_CHECKPOINT_INTERVAL секунд забирает отмеченные ключи
+  (ZPOPMIN), читает их значения и одной вставкой пишет в таблицу. Изменение после ZPOPMIN
+  снова отмечает ключ - он уйдет следующим проходом; при ошибке ключи возвращаются в ZSET;
+- load_view_model при промахе в Redis (TTL, вытеснение) читает копию одним запросом по
+  первичному ключу и возвращает ее в Redis на VIEW_TTL_SECONDS. Подписчики, action_log и
+  заметки сохраняются, запрос к API Avito (rehydrate_view_model) не нужен.
+
+Значение хранится как есть (формат view_codec), поэтому копия не декодируется при записи.
+Отмеченные ключи живут в Redis, так что после перезапуска стадия продолжает с того же места.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import redis.asyncio as redis
+from redis.client import NEVER_DECODE
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from db_models import AvitoAccount, ChatViewSnapshot
+from shared.config import (
+    settings, VIEW_CHECKPOINT_BATCH, VIEW_CHECKPOINT_INTERVAL, VIEW_DIRTY_KEY, VIEW_SNAPSHOT_CLEANUP_INTERVAL
+)
+from shared.database import get_session
+from shared.metrics import (
+    VIEW_CHECKPOINT_LAG_SECONDS, VIEW_CHECKPOINT_ROWS, VIEW_DIRTY_BACKLOG, timed
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_view_key(view_key: str) -> Optional[Tuple[int, str]]:
+    """chat_view:{account_id}:{chat_id} -> (account_id, chat_id)."""
+    _, account_id, chat_id = (view_key.split(":", 2) + ["", ""])[:3]
+    if not account_id.isdigit() or not chat_id:
+        return None
+    return int(account_id), chat_id
+
+
+async def mark_dirty(redis_client: redis.Redis, view_key: str):
+    """Отмечает карточку для сохранения. redis_client может быть пайплайном."""
+    # NX: время первого несохраненного изменения - по нему считается отставание копии
+    await redis_client.zadd(VIEW_DIRTY_KEY, {view_key: time.time()}, nx=True)
+
+
+@timed("view_snapshots.load_snapshot")
+async def load_snapshot(view_key: str) -> Optional[bytes]:
+    """Сохраненное значение карточки или None."""
+    parsed = parse_view_key(view_key)
+    if parsed is None:
+        return None
+    async with get_session() as session:
+        return (await session.execute(
+            select(ChatViewSnapshot.data)
+            .where(ChatViewSnapshot.account_id == parsed[0], ChatViewSnapshot.chat_id == parsed[1])
+        )).scalar_one_or_none()
+
+
+async def checkpoint_dirty_views(redis_client: redis.Redis, batch_size: int = VIEW_CHECKPOINT_BATCH) -> int:
+    """Сохраняет одну пачку измененных карточек. Возвращает число записанных строк."""
+    popped = await redis_client.zpopmin(VIEW_DIRTY_KEY, batch_size)
+    if not popped:
+        return 0
+    keys = [key for key, _ in popped]
+    try:
+        values = await redis_client.execute_command("MGET", *keys, **{NEVER_DECODE: True})
+        now = datetime.now(timezone.utc)
+        rows = {}
+        for key, raw in zip(keys, values):
+            parsed = parse_view_key(key)
+            # Ключ уже истек - сохранять нечего, в таблице остается последняя копия
+            if raw and parsed:
+                rows[parsed] = {"account_id": parsed[0], "chat_id": parsed[1], "data": raw, "updated_at": now}
+        if rows:
+            async with get_session() as session:
+                # Карточки удаленных аккаунтов не сохраняем (внешний ключ)
+                existing = set((await session.execute(
+                    select(AvitoAccount.id).where(AvitoAccount.id.in_({account_id for account_id, _ in rows}))
+                )).scalars())
+                values_to_write = [row for (account_id, _), row in rows.items() if account_id in existing]
+                if values_to_write:
+                    statement = insert(ChatViewSnapshot).values(values_to_write)
+                    await session.execute(statement.on_conflict_do_update(
+                        index_elements=[ChatViewSnapshot.account_id, ChatViewSnapshot.chat_id],
+                        set_={"data": statement.excluded.data, "updated_at": statement.excluded.updated_at},
+                    ))
+            written = len(values_to_write)
+        else:
+            written = 0
+    except Exception:
+        # Возвращаем ключи с прежним временем: следующий проход попробует снова
+        await redis_client.zadd(VIEW_DIRTY_KEY, dict(popped), nx=True)
+        raise
+
+    now_ts = time.time()
+    for _, dirty_since in popped:
+        VIEW_CHECKPOINT_LAG_SECONDS.observe(max(0.0, now_ts - dirty_since))
+    VIEW_CHECKPOINT_ROWS.inc(written)
+    return written
+
+
+async def delete_stale_snapshots() -> int:
+    """Удаляет копии без изменений дольше VIEW_SNAPSHOT_RETENTION_DAYS."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.view_snapshot_retention_days)
+    async with get_session() as session:
+        result = await session.execute(delete(ChatViewSnapshot).where(ChatViewSnapshot.updated_at < cutoff))
+    return result.rowcount or 0
+
+
+async def run_view_checkpointer(redis_client: redis.Redis, interval: float = VIEW_CHECKPOINT_INTERVAL):
+    """Стадия: сохраняет измененные карточки в chat_view_snapshots и чистит устаревшие копии."""
+    if not settings.view_snapshots_enabled:
+        logger.info("VIEW_SNAPSHOTS_ENABLED=false: стадия view_checkpointer ничего не делает.")
+        await asyncio.Event().wait()
+    logger.info("View checkpointer started.")
+    last_cleanup = 0.0
+    while True:
+        try:
+            written = await checkpoint_dirty_views(redis_client)
+            backlog = await redis_client.zcard(VIEW_DIRTY_KEY)
+            VIEW_DIRTY_BACKLOG.set(backlog)
+            if written:
+                logger.debug("VIEW_CHECKPOINT: %s card(s) saved to PostgreSQL.", written)
+            if time.monotonic() - last_cleanup >= VIEW_SNAPSHOT_CLEANUP_INTERVAL:
+                last_cleanup = time.monotonic()
+                deleted = await delete_stale_snapshots()
+                if deleted:
+                    logger.info(f"VIEW_CHECKPOINT: удалено устаревших копий карточек: {deleted}.")
+            if backlog >= VIEW_CHECKPOINT_BATCH:
+                # Очередь не разобрана - не ждем следующего тика
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Critical error in view checkpointer: {e}", exc_info=True)
+        await asyncio.sleep(interval)
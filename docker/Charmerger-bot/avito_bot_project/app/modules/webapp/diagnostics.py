@@ -0,0 +1,115 @@
+# /app/modules/webapp/diagnostics.py
+"""
+Админские эндпоинты диагностики работающих процессов (см. shared/diagnostics.py).
+
+Параметр process - id процесса из /panel/api/admin/diagnostics/processes (хост:pid);
+не задан - операция выполняется в процессе, принявшем запрос. Роутер без общей сессии БД
+(в отличие от modules/webapp/routers.py): профилирование длится секунды и не должно
+держать соединение из пула.
+
+Пример: профиль воркера на 30 секунд в файл
+    curl -X POST -H "X-Telegram-Init-Data: ..." -o worker.prof \\
+        ".../panel/api/admin/diagnostics/profile?process=worker-1:7&seconds=30"
+    python -m pstats worker.prof   # или snakeviz worker.prof
+"""
+import base64
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response
+
+from db_models import User
+from shared.diagnostics import (
+    DIAG_PROFILE_MAX_SECONDS, PROCESS_ID, list_processes, profile_summary, request_diagnostic
+)
+from shared.exceptions import DiagnosticsError
+from .security import get_admin_user
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/panel/api/admin/diagnostics", tags=["Diagnostics"])
+
+# Запас времени на доставку команды процессу и ответа сверх длительности операции, сек
+_REPLY_MARGIN = 15
+
+
+async def _run(request: Request, process: Optional[str], operation: str, params: dict, timeout: float) -> dict:
+    try:
+        return await request_diagnostic(request.app.state.redis, process, operation, params, timeout)
+    except DiagnosticsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/processes", response_model=dict)
+async def api_admin_diagnostics_processes(request: Request, admin: User = Depends(get_admin_user)):
+    """Процессы приложения (веб и воркеры), доступные для диагностики."""
+    return {"current": PROCESS_ID, "processes": await list_processes(request.app.state.redis)}
+
+
+@router.post("/profile")
+async def api_admin_diagnostics_profile(
+    request: Request,
+    process: Optional[str] = None,
+    seconds: float = Query(10, gt=0, le=DIAG_PROFILE_MAX_SECONDS),
+    engine: str = Query("auto", pattern="^(auto|yappi|cprofile)$"),
+    clock: str = Query("wall", pattern="^(wall|cpu)$"),
+    format: str = Query("pstats", pattern="^(pstats|text)$"),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|ncalls)$"),
+    limit: int = Query(40, ge=1, le=500),
+    admin: User = Depends(get_admin_user),
+):
+    """Профилирует процесс seconds секунд: файл pstats или текстовый топ функций."""
+    logger.info(f"ADMIN_PANEL: Admin {admin.telegram_id} запустил профилирование {process or PROCESS_ID} на {seconds} сек.")
+    result = await _run(request, process, "profile", {"seconds": seconds, "engine": engine, "clock": clock},
+                        timeout=seconds + _REPLY_MARGIN)
+    data = base64.b64decode(result["pstats_b64"])
+    if format == "text":
+        header = f"# {process or PROCESS_ID}: {result['engine']}, clock={result['clock']}, {seconds} сек\n"
+        return PlainTextResponse(header + profile_summary(data, limit=limit, sort=sort))
+    filename = f"profile-{(process or PROCESS_ID).replace(':', '-')}-{result['engine']}.prof"
+    return Response(content=data, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.get("/tasks", response_model=dict)
+async def api_admin_diagnostics_tasks(request: Request, process: Optional[str] = None,
+                                      admin: User = Depends(get_admin_user)):
+    """Задачи asyncio процесса и где каждая сейчас ждет."""
+    return await _run(request, process, "tasks", {}, timeout=_REPLY_MARGIN)
+
+
+@router.get("/loop-lag", response_model=dict)
+async def api_admin_diagnostics_loop_lag(request: Request, process: Optional[str] = None,
+                                         seconds: float = Query(5, gt=0, le=60),
+                                         admin: User = Depends(get_admin_user)):
+    """Задержка цикла событий процесса за seconds секунд (p50/p99/max)."""
+    return await _run(request, process, "loop_lag", {"seconds": seconds}, timeout=seconds + _REPLY_MARGIN)
+
+
+@router.post("/tracemalloc/start", response_model=dict)
+async def api_admin_diagnostics_tracemalloc_start(request: Request, process: Optional[str] = None,
+                                                  frames: int = Query(10, ge=1, le=50),
+                                                  admin: User = Depends(get_admin_user)):
+    """Включает tracemalloc в процессе."""
+    logger.info(f"ADMIN_PANEL: Admin {admin.telegram_id} включил tracemalloc в {process or PROCESS_ID}.")
+    return await _run(request, process, "tracemalloc_start", {"frames": frames}, timeout=_REPLY_MARGIN)
+
+
+@router.get("/tracemalloc/snapshot", response_model=dict)
+async def api_admin_diagnostics_tracemalloc_snapshot(
+    request: Request, process: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=200),
+    key_type: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    admin: User = Depends(get_admin_user),
+):
+    """Снимок памяти: топ мест выделения и разница с предыдущим снимком (рост между вызовами)."""
+    return await _run(request, process, "tracemalloc_snapshot", {"limit": limit, "key_type": key_type},
+                      timeout=60 + _REPLY_MARGIN)
+
+
+@router.post("/tracemalloc/stop", response_model=dict)
+async def api_admin_diagnostics_tracemalloc_stop(request: Request, process: Optional[str] = None,
+                                                 admin: User = Depends(get_admin_user)):
+    """Выключает tracemalloc и освобождает его память."""
+    return await _run(request, process, "tracemalloc_stop", {}, timeout=_REPLY_MARGIN)
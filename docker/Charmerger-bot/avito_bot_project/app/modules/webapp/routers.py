@@ -15,7 +15,7 @@ from shared.config import settings
 from modules.billing.service import billing_service
 from modules.billing.config import TARIFF_CONFIG
 from modules.billing.enums import TariffPlan
-from shared.database import get_session
+from shared.database import get_session, get_read_session, db_unit_of_work
 from modules.wallet.service import wallet_service
 from shared.config import POPULAR_TIMEZONES_PYTZ
 from modules.billing.exceptions import TariffLimitReachedError
@@ -28,13 +28,17 @@ from shared.config import (
 )
 
 from modules.avito.client import AvitoAPIClient
+from modules.avito.worker import OUTGOING_DLQ_STREAM
+from shared.retry import list_dead_letters, redrive_dead_letters
+from shared.logs import get_log_levels, set_log_level
 import uuid
 
 logger = logging.getLogger(__name__)
 
 templates = Jinja2Templates(directory="modules/webapp/templates")
 # --- Настройка ---
-router = APIRouter( tags=["WebApp"])
+# Одна сессия БД на запрос: get_current_webapp_user и CRUD-вызовы эндпоинта делят соединение
+router = APIRouter(tags=["WebApp"], dependencies=[Depends(db_unit_of_work)])
 
 class AdminUserDataUpdate(BaseModel):
     tariff_plan: TariffPlan
@@ -69,10 +73,20 @@ class PermissionsData(BaseModel):
     can_reply: bool
     allowed_accounts: Optional[List[int]] = None
 
+class LogLevelData(BaseModel):
+    logger: str = "root"
+    # None - сбросить к уровню по умолчанию
+    level: Optional[str] = None
+
+class DeadLetterRedriveData(BaseModel):
+    # Конкретные сообщения DLQ; если не заданы - самые старые `limit` сообщений
+    ids: Optional[List[str]] = None
+    limit: int = Field(100, ge=1, le=1000)
+
 # Добавляем обработчик главной страницы
 @router.get("/panel", response_class=HTMLResponse, include_in_schema=False)
 async def get_webapp_index(request: Request):
-    logger.critical("!!!!!! WEBAPP INDEX HANDLER TRIGGERED !!!!!!")
+    logger.debug("WEBAPP: index handler triggered.")
     return templates.TemplateResponse(
         "index.html", 
         {
@@ -158,7 +172,7 @@ async def api_delete_avito_account(account_id: int, current_user: User = Depends
 
 @router.get("/panel/api/templates", response_model=List[dict])
 async def api_get_user_templates(current_user: User = Depends(get_current_webapp_user)):
-    async with get_session() as session:
+    async with get_read_session() as session:
         templates = await crud.get_user_templates(session, current_user.id)
         return [{"id": t.id, "name": t.name, "text": t.text} for t in templates]
 
@@ -202,7 +216,7 @@ async def api_get_user_autoreplies(current_user: User = Depends(get_current_weba
 
 @router.get("/panel/api/forwarding-rules", response_model=List[dict])
 async def api_get_forwarding_rules(current_user: User = Depends(get_current_webapp_user)):
-    async with get_session() as session:
+    async with get_read_session() as session:
         rules = await crud.get_forwarding_rules_for_owner(session, current_user.id)
     
     response = []
@@ -339,7 +353,7 @@ async def api_get_wallet_info(request: Request, current_user: User = Depends(get
     
     # 2. Получаем историю транзакций через CRUD-функцию
     transactions_list = []
-    async with get_session() as session:
+    async with get_read_session() as session:
         db_transactions = await crud.get_user_transactions(session, user_id=current_user.id, limit=30)
         for tx in db_transactions:
             
@@ -527,7 +541,7 @@ async def api_admin_get_users(admin: User = Depends(get_admin_user)):
     """Возвращает список всех пользователей (только для админа)."""
     logger.info(f"ADMIN_PANEL: Администратор {admin.telegram_id} запросил список пользователей.")
     
-    async with get_session() as session:
+    async with get_read_session() as session:
         users = await crud.get_all_users_for_admin(session)
     
     logger.info(f"ADMIN_PANEL: Найдено Найдено {len(users)} пользователей в БД.")
@@ -562,7 +576,7 @@ async def api_admin_get_user_transactions(user_id: int, admin: User = Depends(ge
     """Возвращает историю транзакций конкретного пользователя (только для админа)."""
     logger.info(f"ADMIN_PANEL: Администратор запросил транзакции для user_id: {user_id}")
     
-    async with get_session() as session:
+    async with get_read_session() as session:
         transactions = await crud.get_user_transactions(session, user_id=user_id, limit=50)
     
     logger.info(f"ADMIN_PANEL: crud.get_user_transactions возвращен {len(transactions)} транзакции из БД.")
@@ -604,7 +618,7 @@ async def api_admin_update_user_tariff(data: AdminTariffUpdateData, admin: User
 @router.get("/panel/api/admin/users/{user_id}/transactions", response_model=List[dict])
 async def api_admin_get_user_transactions(user_id: int, admin: User = Depends(get_admin_user)):
     """Возвращает историю транзакций конкретного пользователя (только для админа)."""
-    async with get_session() as session:
+    async with get_read_session() as session:
         transactions = await crud.get_user_transactions(session, user_id=user_id, limit=50)
     
     response = []
@@ -673,4 +687,38 @@ async def api_admin_update_user(user_id: int, data: AdminUserDataUpdate, admin:
         await session.commit()
     
     logger.info(f"ADMIN_PANEL: Admin {admin.telegram_id} обновленные данные для пользователя {user_id}.")
-    return {"success": True, "message": "Данные пользователя успешно обновлены."}
\ No newline at end of file
+    return {"success": True, "message": "Данные пользователя успешно обновлены."}
+
+# --- DLQ исходящих сообщений Avito ---
+@router.get("/panel/api/admin/dlq/avito", response_model=dict)
+async def api_admin_get_avito_dlq(request: Request, count: int = 50, admin: User = Depends(get_admin_user)):
+    """Показывает сообщения и действия Avito, которые не удалось выполнить (только для админа)."""
+    redis_client = request.app.state.redis
+    return {
+        "total": await redis_client.xlen(OUTGOING_DLQ_STREAM),
+        "items": await list_dead_letters(redis_client, OUTGOING_DLQ_STREAM, count=min(count, 500)),
+    }
+
+@router.post("/panel/api/admin/dlq/avito/redrive", response_model=dict)
+async def api_admin_redrive_avito_dlq(request: Request, data: DeadLetterRedriveData, admin: User = Depends(get_admin_user)):
+    """Возвращает сообщения из DLQ в исходные очереди для повторной отправки (только для админа)."""
+    redriven = await redrive_dead_letters(request.app.state.redis, OUTGOING_DLQ_STREAM, ids=data.ids, limit=data.limit)
+    logger.info(f"ADMIN_PANEL: Admin {admin.telegram_id} вернул {redriven} сообщений из {OUTGOING_DLQ_STREAM}.")
+    return {"success": True, "redriven": redriven}
+
+# --- Уровни логирования (без перезапуска, для всех процессов) ---
+@router.get("/panel/api/admin/logging", response_model=dict)
+async def api_admin_get_log_levels(admin: User = Depends(get_admin_user)):
+    """Уровни логгеров в этом процессе (только для админа)."""
+    return {"levels": get_log_levels()}
+
+@router.put("/panel/api/admin/logging", response_model=dict)
+async def api_admin_set_log_level(request: Request, data: LogLevelData, admin: User = Depends(get_admin_user)):
+    """Задает уровень логгера; остальные процессы подхватят его в течение LOG_LEVELS_SYNC_INTERVAL (только для админа)."""
+    level = data.level.upper() if data.level else None
+    try:
+        await set_log_level(request.app.state.redis, data.logger, level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"ADMIN_PANEL: Admin {admin.telegram_id} установил уровень логгера {data.logger}: {level or 'по умолчанию'}.")
+    return {"success": True, "levels": get_log_levels()}
@@ -2,7 +2,7 @@
 import hmac
 import hashlib
 from urllib.parse import unquote
-import json
+from shared.serialization import json_loads
 from typing import Optional
 from fastapi import Depends, HTTPException, status, Request
 from shared.config import settings
@@ -27,7 +27,7 @@ def _validate_telegram_data(init_data: str) -> Optional[dict]:
 
         if calculated_hash == received_hash:
             # Если хэши совпадают, данные подлинные. Возвращаем данные пользователя.
-            return json.loads(unquote(params['user']))
+            return json_loads(unquote(params['user']))
         return None
     except Exception:
         return None
@@ -10,11 +10,13 @@ from modules.avito.auth import AvitoOAuth
 from modules.avito.webhook import AvitoWebhookHandler
 from modules.avito.client import AvitoAPIClient
 from modules.telegram.bot import process_telegram_update, WEBHOOK_PATH, bot
+from modules.telegram.updates import enqueue_telegram_update
 from modules.database import crud
 from shared.database import get_session
 from db_models import User, AvitoAccount
 from shared.security import encrypt_token
 from shared.config import settings
+from shared.serialization import json_loads
 from modules.user_actions.onboarding import check_and_send_terms_agreement
 
 logger = logging.getLogger(__name__)
@@ -142,6 +144,16 @@ async def avito_webhook_endpoint(request: Request, x_signature: Optional[str] =
 
 # --- Эндпоинт для вебхуков Telegram ---
 @api_router.post(WEBHOOK_PATH, include_in_schema=False)
-async def telegram_webhook_endpoint(update: dict):
-    await process_telegram_update(update)
+async def telegram_webhook_endpoint(request: Request):
+    raw_update = await request.body()
+    if settings.telegram_updates_mode == "stream":
+        # Только в очередь: хендлеры выполнит стадия telegram_updates, Telegram не ждет их
+        try:
+            accepted = await enqueue_telegram_update(request.app.state.redis, raw_update)
+        except ValueError as e:
+            logger.warning(f"Некорректное обновление Telegram: {e}")
+            raise HTTPException(status_code=400, detail="Invalid update.")
+        return {"status": "ok" if accepted else "duplicate"}
+
+    await process_telegram_update(json_loads(raw_update))
     return {"status": "ok"}
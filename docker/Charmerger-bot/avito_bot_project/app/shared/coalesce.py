@@ -0,0 +1,55 @@
+# /app/shared/coalesce.py
+"""
+Схлопывание повторяющихся действий (coalescing).
+
+- enqueue_once(): кладет сообщение в стрим, только если такое же действие еще не ждет
+  в очереди. Признак "ждет" - ключ SET NX PX; SET и XADD выполняются одним Lua-скриптом,
+  поэтому работают и с клиентом, и внутри пайплайна (RedisUnitOfWork). Скрипт загружается
+  один раз и вызывается через EVALSHA.
+  Воркер снимает ключ (release()) в начале обработки: все нажатия до этого момента
+  покрываются одним вызовом API, а нажатие после - ставит новое действие.
+- acquire_window(): простой троттлинг - не чаще одного раза за окно (для "печатает...").
+"""
+from typing import Any, Dict
+
+import redis.asyncio as redis
+
+from shared.redis_client import get_script
+
+# KEYS[1] - ключ дедупликации, KEYS[2] - стрим; ARGV[1] - TTL (мс), дальше - пары поле/значение
+_ENQUEUE_ONCE_SCRIPT = """
+if not redis.call('SET', KEYS[1], '1', 'NX', 'PX', ARGV[1]) then
+    return false
+end
+return redis.call('XADD', KEYS[2], '*', unpack(ARGV, 2))
+"""
+
+
+async def enqueue_once(
+    redis_client: redis.Redis,
+    dedupe_key: str,
+    ttl_ms: int,
+    stream_name: str,
+    fields: Dict[str, Any]
+):
+    """
+    XADD, если действие с этим ключом еще не в очереди. redis_client может быть и пайплайном.
+    С клиентом возвращает id сообщения
+    или None (схлопнуто); в пайплайне результат будет в pipeline.execute().
+    """
+    args = [ttl_ms]
+    for field, value in fields.items():
+        args.extend((field, value))
+    return await get_script(redis_client, _ENQUEUE_ONCE_SCRIPT)(
+        keys=[dedupe_key, stream_name], args=args, client=redis_client
+    )
+
+
+async def release(redis_client: redis.Redis, dedupe_key: str):
+    """Снимает признак "действие в очереди" - следующее действие снова будет поставлено."""
+    await redis_client.delete(dedupe_key)
+
+
+async def acquire_window(redis_client: redis.Redis, key: str, window_ms: int) -> bool:
+    """True - можно выполнять (первый вызов в окне), False - в окне уже был вызов."""
+    return bool(await redis_client.set(key, "1", nx=True, px=window_ms))
@@ -31,11 +31,15 @@ class Settings(BaseSettings):
     telegram_bot_username: str = Field(..., alias="TELEGRAM_BOT_USERNAME") 
     telegram_admin_id: Optional[int] = Field(None, alias="TELEGRAM_ADMIN_ID")
     support_bot_username: str = Field("ChatMerger_SupportBot", alias="SUPPORT_BOT_USERNAME")
+    # Адрес Bot API (по умолчанию api.telegram.org). Для нагрузочных тестов - tools/loadtest/fake_telegram.py
+    telegram_api_base_url: Optional[str] = Field(None, alias="TELEGRAM_API_BASE_URL")
 
     # --- Avito ---
     avito_client_id: str = Field(..., alias="AVITO_CLIENT_ID")
     avito_client_secret: str = Field(..., alias="AVITO_CLIENT_SECRET")
     avito_webhook_secret: str = Field(..., alias="AVITO_WEBHOOK_SECRET")
+    # Адрес API Avito. Для нагрузочных тестов - tools/loadtest/fake_avito.py
+    avito_api_base_url: str = Field("https://api.avito.ru", alias="AVITO_API_BASE_URL")
 
     # --- База данных (PostgreSQL) ---
     db_user: str = Field(..., alias="POSTGRES_USER")
@@ -43,11 +47,134 @@ class Settings(BaseSettings):
     db_host: str = Field("postgres", alias="POSTGRES_HOST")
     db_port: int = Field(5432, alias="POSTGRES_PORT")
     db_name: str = Field(..., alias="POSTGRES_DB")
+    # Пул соединений SQLAlchemy на процесс: постоянные + временные сверх них, ожидание свободного, сек
+    db_pool_size: int = Field(10, alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(20, alias="DB_MAX_OVERFLOW")
+    db_pool_timeout: float = Field(30.0, alias="DB_POOL_TIMEOUT")
+    # Пересоздавать соединения старше N секунд (-1 - никогда) и проверять соединение перед выдачей
+    db_pool_recycle: int = Field(1800, alias="DB_POOL_RECYCLE")
+    db_pool_pre_ping: bool = Field(True, alias="DB_POOL_PRE_PING")
+    # Кэш подготовленных выражений asyncpg на соединение
+    db_statement_cache_size: int = Field(100, alias="DB_STATEMENT_CACHE_SIZE")
+    # true - подключение через PgBouncer в режиме transaction: подготовленные выражения отключаются
+    db_pgbouncer: bool = Field(False, alias="DB_PGBOUNCER")
+    # Реплика для чтения (история, статистика, списки). Не задана - все читается с основной БД
+    db_replica_host: Optional[str] = Field(None, alias="POSTGRES_REPLICA_HOST")
+    db_replica_port: Optional[int] = Field(None, alias="POSTGRES_REPLICA_PORT")
+
+    # inline - вебхук Telegram обрабатывает обновление сразу (ответ Telegram ждет хендлер);
+    # stream - вебхук кладет обновление в стрим telegram:updates и сразу отвечает 200,
+    # обрабатывает стадия telegram_updates (см. modules/telegram/updates.py)
+    telegram_updates_mode: str = Field("inline", alias="TELEGRAM_UPDATES_MODE")
+    # Хранилище состояний FSM aiogram: redis - общее для всех процессов, memory - в памяти процесса (как раньше)
+    fsm_storage: str = Field("redis", alias="FSM_STORAGE")
+    # Сколько живет незавершенное состояние диалога (переименование, заметка и т.п.)
+    fsm_ttl_seconds: int = Field(86400, alias="FSM_TTL_SECONDS")
 
     # --- Redis ---
     redis_host: str = Field("redis", alias="REDIS_HOST")
     redis_port: int = Field(6379, alias="REDIS_PORT")
     redis_db: int = Field(0, alias="REDIS_DB")
+    # Пул команд (вебхуки, хендлеры, WebApp): размер и сколько ждать свободное соединение, сек
+    redis_max_connections: int = Field(50, alias="REDIS_MAX_CONNECTIONS")
+    redis_pool_timeout: float = Field(5.0, alias="REDIS_POOL_TIMEOUT")
+    redis_socket_timeout: float = Field(5.0, alias="REDIS_SOCKET_TIMEOUT")
+    redis_socket_connect_timeout: float = Field(5.0, alias="REDIS_SOCKET_CONNECT_TIMEOUT")
+    # Пул блокирующего чтения стримов: по соединению на потребителя, таймаут больше BLOCK (5 с)
+    redis_blocking_max_connections: int = Field(20, alias="REDIS_BLOCKING_MAX_CONNECTIONS")
+    redis_blocking_socket_timeout: float = Field(15.0, alias="REDIS_BLOCKING_SOCKET_TIMEOUT")
+
+    # --- Фоновые стадии конвейера (см. stages.py и worker.py) ---
+    # true - веб-процесс сам запускает стадии (режим "все в одном", как раньше).
+    # false - веб-процесс обслуживает только HTTP, стадии запускаются отдельно: python -m worker
+    run_workers_in_web: bool = Field(True, alias="RUN_WORKERS_IN_WEB")
+    # Список стадий через запятую ("all" - все), для стадии можно задать свою конкурентность: "autoreply=4,forwarder"
+    worker_stages: str = Field("all", alias="WORKER_STAGES")
+    # Число упорядоченных полос на стадию: чаты обрабатываются параллельно, сообщения одного чата - по порядку
+    worker_concurrency: int = Field(1, alias="WORKER_CONCURRENCY")
+    # Префикс имен потребителей в consumer group: {имя}-{стадия}. Должен быть постоянным между
+    # перезапусками (свой PEL забирается при старте) и уникальным для каждого работающего процесса.
+    # Не задан - имя хоста (в Docker это id контейнера, он меняется при каждом пересоздании)
+    worker_consumer_name: Optional[str] = Field(None, alias="WORKER_CONSUMER_NAME")
+    # Окно справедливого планирования по владельцам для входящих стадий (autoreply, forwarder,
+    # event_processor): сколько сообщений читать вперед, чтобы раскладывать их по пользователям.
+    # Все прочитанные вперед сообщения висят в PEL потребителя до обработки
+    stream_fair_read_ahead: int = Field(50, alias="STREAM_FAIR_READ_AHEAD")
+    # Через сколько секунд неподтвержденное сообщение (упавший обработчик, остановленный
+    # потребитель) возвращается в обработку (см. PendingReclaimer в shared/streams.py)
+    stream_claim_idle_seconds: int = Field(300, alias="STREAM_CLAIM_IDLE_SECONDS")
+    # После стольких выдач без подтверждения сообщение уходит в STREAM_DEAD_LETTER_STREAM
+    stream_max_deliveries: int = Field(5, alias="STREAM_MAX_DELIVERIES")
+    # Порт HTTP-сервера метрик Prometheus в процессе python -m worker (не задан - метрики не отдаются)
+    worker_metrics_port: Optional[int] = Field(None, alias="WORKER_METRICS_PORT")
+    # Экспорт span'ов OpenTelemetry (см. shared/tracing.py): none, otlp (OTEL_EXPORTER_OTLP_ENDPOINT) или console
+    tracing_exporter: str = Field("none", alias="TRACING_EXPORTER")
+    # Для console: файл, в который дописываются span'ы (по умолчанию stdout)
+    tracing_file: Optional[str] = Field(None, alias="TRACING_FILE")
+
+    # --- Логирование (см. shared/logs.py) ---
+    log_level: str = Field("INFO", alias="LOG_LEVEL")
+    # text - строки как раньше, json - одна JSON-строка на запись (для сборщиков логов)
+    log_format: str = Field("text", alias="LOG_FORMAT")
+    # Файл для логов (по умолчанию stderr)
+    log_file: Optional[str] = Field(None, alias="LOG_FILE")
+    # Доля сохраняемых записей ниже WARNING: "логгер=доля", ключ - имя логгера или префикс
+    log_sampling: str = Field("", alias="LOG_SAMPLING")
+    # Не больше N записей ниже WARNING в секунду: "логгер=записей_в_секунду"
+    log_rate_limits: str = Field(
+        "modules.avito.webhook=20,modules.autoreplies=20,modules.avito.worker=20,modules.telegram.worker=20",
+        alias="LOG_RATE_LIMITS",
+    )
+
+    # --- Учет SQL-запросов (см. shared/db_stats.py) ---
+    # Запросы дольше этого (мс) пишутся в лог с формой параметров
+    db_slow_query_ms: float = Field(200.0, alias="DB_SLOW_QUERY_MS")
+    # Апдейт/HTTP-запрос/сообщение стрима с большим числом запросов - WARNING (признак N+1)
+    db_scope_query_warn: int = Field(30, alias="DB_SCOPE_QUERY_WARN")
+
+    # --- Цикл событий (см. shared/loop_monitor.py и shared/offload.py) ---
+    loop_monitor_enabled: bool = Field(True, alias="LOOP_MONITOR_ENABLED")
+    # Блокировка цикла дольше этого (сек) считается медленным колбэком: метрика и лог со стеком
+    loop_slow_callback_threshold: float = Field(0.1, alias="LOOP_SLOW_CALLBACK_THRESHOLD")
+    # Пулы для CPU-тяжелой работы, вынесенной из цикла событий
+    offload_threads: int = Field(4, alias="OFFLOAD_THREADS")
+    offload_processes: int = Field(2, alias="OFFLOAD_PROCESSES")
+    # Бюджет на рендер карточек всех подписчиков чата, мс: дольше - рендер уходит в пул потоков
+    render_offload_budget_ms: float = Field(20.0, alias="RENDER_OFFLOAD_BUDGET_MS")
+
+    # --- Хранение карточек чатов (chat_view:*) в Redis ---
+    # json - старый формат (для отката), msgpack - компактный бинарный,
+    # msgpack_zstd - msgpack + сжатие zstd (если установлен пакет zstandard)
+    view_codec: str = Field("msgpack_zstd", alias="VIEW_CODEC")
+    # Модели меньше этого размера не сжимаются: на коротких данных zstd не дает выигрыша
+    view_compression_min_bytes: int = Field(512, alias="VIEW_COMPRESSION_MIN_BYTES")
+    # Сколько карточка живет в Redis без активности в чате, сек (3 дня). С копиями в PostgreSQL
+    # (VIEW_SNAPSHOTS_ENABLED) можно ставить меньше: остывшая карточка читается из таблицы
+    view_ttl_seconds: int = Field(60 * 60 * 24 * 3, alias="VIEW_TTL_SECONDS")
+    # Копии карточек в таблице chat_view_snapshots (стадия view_checkpointer, см. modules/telegram/view_snapshots.py)
+    view_snapshots_enabled: bool = Field(True, alias="VIEW_SNAPSHOTS_ENABLED")
+    # Копии карточек без изменений дольше этого удаляются, дней
+    view_snapshot_retention_days: int = Field(180, alias="VIEW_SNAPSHOT_RETENTION_DAYS")
+
+    # --- Повторные попытки запросов к Avito (см. shared/retry.py) ---
+    avito_retry_max_attempts: int = Field(6, alias="AVITO_RETRY_MAX_ATTEMPTS")
+    # Задержка перед первым повтором, далее удваивается (с джиттером) до avito_retry_max_delay
+    avito_retry_base_delay: float = Field(2.0, alias="AVITO_RETRY_BASE_DELAY")
+    avito_retry_max_delay: float = Field(300.0, alias="AVITO_RETRY_MAX_DELAY")
+
+    # Веса приоритетных стримов исходящих сообщений (см. modules/avito/queues.py):
+    # при очереди во всех стримах ручные ответы, шаблоны и автоответы отправляются в пропорции 8:3:1
+    avito_outgoing_weights: str = Field("high=8,normal=3,low=1", alias="AVITO_OUTGOING_WEIGHTS")
+
+    # --- Лимиты и автомат для API Avito (см. modules/avito/policy.py) ---
+    # Токен-бакет на (аккаунт, группа эндпоинтов): "группа=запросов_в_секунду/пачка".
+    # Группы: read (GET), write (POST/DELETE), upload (загрузка изображений).
+    avito_rate_limits: str = Field("read=5/10,write=2/5,upload=0.5/2", alias="AVITO_RATE_LIMITS")
+    # Сколько максимум ждать свободный токен, дальше - AvitoRateLimitError (воркеры отложат повтор)
+    avito_rate_limit_max_wait: float = Field(10.0, alias="AVITO_RATE_LIMIT_MAX_WAIT")
+    # Автомат размыкается после стольких подряд сетевых ошибок/5xx и ждет avito_circuit_recovery_timeout
+    avito_circuit_failure_threshold: int = Field(5, alias="AVITO_CIRCUIT_FAILURE_THRESHOLD")
+    avito_circuit_recovery_timeout: float = Field(30.0, alias="AVITO_CIRCUIT_RECOVERY_TIMEOUT")
 
     # --- Шифрование и безопасность ---
     encryption_key: str = Field(..., alias="ENCRYPTION_KEY")
@@ -72,6 +199,15 @@ class Settings(BaseSettings):
         """Собирает URL для подключения к PostgreSQL."""
         return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
 
+    @computed_field
+    @property
+    def database_replica_url(self) -> Optional[str]:
+        """URL реплики для чтения или None, если реплика не настроена."""
+        if not self.db_replica_host:
+            return None
+        port = self.db_replica_port or self.db_port
+        return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_replica_host}:{port}/{self.db_name}"
+
     @computed_field
     @property
     def redis_url(self) -> str:
@@ -113,9 +249,54 @@ except Exception as e:
 # --- Настройки времени жизни кэша (TTL в секундах) ---
 PROCESSED_ID_TTL: int = 86400         # Идемпотентность Avito вебхуков (1 день)
 REPLY_MAPPING_TTL: int = 86400 * 3    # Связь TG сообщения с Avito чатом (3 дня)
+REPLY_CONTEXT_MAX_ENTRIES: int = 1000 # Максимум карточек в хеше tg_ctx:{telegram_id} одного пользователя
 USER_DATA_CACHE_TTL: int = 3600       # Кэш данных пользователя (1 час)
 TERMS_AGREEMENT_CACHE_TTL: int = 86400 * 30 # Кэш согласия (30 дней)
 INIT_DATA_MAX_AGE_SECONDS: int = 3600 # Максимальный возраст initData для WebApp (1 час)
+CHAT_ACTION_DEDUPE_TTL_MS: int = 30_000      # Страховочный TTL ключа "действие уже в очереди" (см. shared/coalesce.py)
+TELEGRAM_CHAT_ACTION_THROTTLE_MS: int = 4500 # "Печатает..." в Telegram держится ~5 с - чаще слать незачем
+TELEGRAM_UPDATE_DEDUPE_TTL_MS: int = 3600_000 # Повторная доставка того же update_id отбрасывается (1 час)
+
+# --- Уровни логгеров, заданные через админ-эндпоинт (см. shared/logs.py) ---
+LOG_LEVELS_KEY: str = "logging:levels" # Хеш Redis {логгер: уровень}, общий для всех процессов
+LOG_LEVELS_SYNC_INTERVAL: int = 10     # Как часто процессы перечитывают его, сек
+
+# --- Контроль цикла событий (см. shared/loop_monitor.py) ---
+LOOP_LAG_SAMPLE_INTERVAL: float = 0.1 # Как часто задача монитора засыпает и меряет опоздание, сек
+
+# --- Копии карточек в PostgreSQL (стадия view_checkpointer, см. modules/telegram/view_snapshots.py) ---
+VIEW_DIRTY_KEY: str = "chat_view_dirty"     # ZSET {ключ карточки: время первого несохраненного изменения}
+VIEW_CHECKPOINT_INTERVAL: float = 2.0       # Как часто сохранять измененные карточки, сек
+VIEW_CHECKPOINT_BATCH: int = 500            # Карточек за один проход (одна вставка в БД)
+VIEW_SNAPSHOT_CLEANUP_INTERVAL: int = 3600  # Как часто удалять устаревшие копии, сек
+
+# --- Возврат неподтвержденных сообщений стримов (PendingReclaimer, см. shared/streams.py) ---
+STREAM_RECLAIM_INTERVAL: int = 30   # Как часто проверять PEL группы (и отмечаться живым потребителем), сек
+STREAM_RECLAIM_BATCH: int = 100     # Сообщений за один XPENDING/XCLAIM
+# Сообщения, которые ни один потребитель так и не подтвердил (STREAM_MAX_DELIVERIES выдач).
+# Поле dlq_source - исходный стрим, вернуть: shared/retry.redrive_dead_letters
+STREAM_DEAD_LETTER_STREAM: str = "streams:dlq"
+
+# --- Планировщик повторов (стадия retry_scheduler, см. shared/retry.py) ---
+RETRY_SWEEP_INTERVAL: int = 30     # Как часто возвращать сообщения, отложенные за истекшим удержанием чата, сек
+
+# --- Метрики стримов (стадия stream_metrics, см. shared/stream_stats.py) ---
+STREAM_METRICS_INTERVAL: int = 15 # Как часто опрашивать XINFO/XPENDING, сек
+MONITORED_STREAMS: List[str] = [
+    "avito:incoming:messages",
+    "avito:processed:messages",
+    "events:new_avito_message",
+    "avito:outgoing:messages:high",
+    "avito:outgoing:messages",
+    "avito:outgoing:messages:low",
+    "avito:outgoing:dlq",
+    "avito:chat:actions",
+    "telegram:outgoing:messages",
+    "telegram:outgoing:dlq",
+    "streams:dlq",
+    "telegram:chat_actions",
+    "telegram:updates",
+]
 
 # --- Часовые пояса для выбора в WebApp и боте ---
 POPULAR_TIMEZONES_PYTZ: Dict[str, str] = {
@@ -1,15 +1,195 @@
 # /app/shared/database.py
+"""
+Подключение к PostgreSQL.
+
+- engine - основная БД: все записи и чтения, которым нужна свежесть (баланс перед списанием,
+  проверка владельца, только что созданные объекты). Размер пула и проверки соединений
+  настраиваются через DB_POOL_* (см. shared/config.py).
+- read_engine - реплика для чтения (POSTGRES_REPLICA_HOST). Через get_read_session() идут
+  списки и отчеты, где отставание реплики на доли секунды допустимо: история транзакций,
+  статистика аккаунта, списки шаблонов и правил, пользователи в админ-панели.
+  Если реплика не настроена, read_engine - это тот же engine.
+
+Единица работы (unit_of_work): одна сессия и одно соединение из пула на апдейт Telegram
+(middleware aiogram) или HTTP-запрос WebApp (зависимость FastAPI). Пока она открыта,
+get_session() в той же задаче возвращает ее сессию вместо новой: CRUD-функции не берут
+по соединению на вызов, ORM-объекты не отсоединяются между вызовами, а функции, принимающие
+session, могут работать в одной транзакции. Соединение берется лениво - при первом обращении к БД.
+Сессия единицы работы (UnitOfWorkSession) при каждом SELECT и session.get() перечитывает строку
+в уже загруженный объект (populate_existing): карта идентичности общая на весь апдейт, и без
+этого SELECT ... FOR UPDATE и повторное чтение баланса вернули бы значения, загруженные раньше.
+Объекты при коммите не истекают (expire_on_commit=False) - к атрибутам можно обращаться после
+выхода из get_session() без ленивой загрузки.
+
+DB_PGBOUNCER=true отключает кэши подготовленных выражений asyncpg: в режиме transaction
+PgBouncer отдает соединения разным клиентам, и именованные выражения на них конфликтуют.
+
+Число и время запросов на апдейт/HTTP-запрос/сообщение стрима и медленные запросы - см. shared/db_stats.py.
+"""
+import asyncio
+import uuid
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import ORMExecuteState, Session, sessionmaker
 from .config import settings
+from .metrics import DB_POOL_CONNECTIONS
+from .db_stats import install_query_hooks
+
+
+def _connect_args() -> dict:
+    """Параметры соединения asyncpg."""
+    if settings.db_pgbouncer:
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            # Уникальные имена, чтобы выражения разных клиентов не пересекались на одном соединении
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return {
+        "statement_cache_size": settings.db_statement_cache_size,
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+    }
+
 
-engine = create_async_engine(settings.database_url)
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args=_connect_args(),
+    )
+
+
+def _export_pool_metrics(name: str, async_engine):
+    """Занятость пула считается в момент опроса /metrics."""
+    pool = async_engine.sync_engine.pool
+    for state, getter in (("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow")):
+        DB_POOL_CONNECTIONS.labels(engine=name, state=state).set_function(
+            lambda method=getattr(pool, getter, None): max(0, method()) if method else 0
+        )
+
+
+engine = _create_engine(settings.database_url)
+read_engine = _create_engine(settings.database_replica_url) if settings.database_replica_url else engine
+_export_pool_metrics("primary", engine)
+install_query_hooks(engine, "primary")
+if read_engine is not engine:
+    _export_pool_metrics("replica", read_engine)
+    install_query_hooks(read_engine, "replica")
 
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+read_session_maker = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+class UnitOfWorkSession(Session):
+    """Синхронная сессия единицы работы: чтения не возвращают устаревшие объекты из карты идентичности."""
+
+    def get(self, entity, ident, **kwargs):
+        # Без populate_existing get() не идет в БД, если объект уже загружен в этом апдейте
+        kwargs["populate_existing"] = True
+        return super().get(entity, ident, **kwargs)
+
+
+@event.listens_for(UnitOfWorkSession, "do_orm_execute")
+def _populate_existing(state: ORMExecuteState):
+    # Ленивые загрузки связей и отложенных колонок не трогаем: они и так читают свежие данные
+    if state.is_select and not state.is_column_load and not state.is_relationship_load:
+        state.update_execution_options(populate_existing=True)
+
+
+class UnitOfWork:
+    """Сессия запроса. Принадлежит задаче, которая ее открыла: фоновые задачи, запущенные
+    из хендлера, наследуют contextvar, но получают собственные сессии."""
+
+    def __init__(self):
+        self.task = asyncio.current_task()
+        self.closed = False
+        self._connection = None
+        self._session: Optional[AsyncSession] = None
+
+    def is_current(self) -> bool:
+        return not self.closed and self.task is asyncio.current_task()
+
+    async def session(self) -> AsyncSession:
+        if self._session is None:
+            # Сессия привязана к соединению: commit() завершает транзакцию, но не возвращает соединение в пул
+            self._connection = await engine.connect()
+            self._session = AsyncSession(
+                bind=self._connection, expire_on_commit=False, sync_session_class=UnitOfWorkSession
+            )
+        return self._session
+
+    async def close(self, commit: bool):
+        self.closed = True
+        if self._session is None:
+            return
+        try:
+            if commit:
+                await self._session.commit()
+            else:
+                await self._session.rollback()
+        finally:
+            await self._session.close()
+            await self._connection.close()
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("db_unit_of_work", default=None)
+
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[UnitOfWork]:
+    """Открывает единицу работы (или присоединяется к уже открытой в этой задаче).
+    В конце коммитит, при исключении - откатывает."""
+    current = _current_uow.get()
+    if current is not None and current.is_current():
+        yield current
+        return
+
+    uow = UnitOfWork()
+    token = _current_uow.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        await uow.close(commit=False)
+        raise
+    else:
+        await uow.close(commit=True)
+    finally:
+        _current_uow.reset(token)
+
+
+async def db_unit_of_work() -> AsyncIterator[UnitOfWork]:
+    """Зависимость FastAPI: единица работы на HTTP-запрос."""
+    async with unit_of_work() as uow:
+        yield uow
+
+
+async def db_session() -> AsyncIterator[AsyncSession]:
+    """Зависимость FastAPI: сессия единицы работы запроса (для CRUD-функций с параметром session)."""
+    async with unit_of_work() as uow:
+        yield await uow.session()
+
 
 @asynccontextmanager
 async def get_session() -> AsyncSession:
+    uow = _current_uow.get()
+    if uow is not None and uow.is_current():
+        # Внутри единицы работы: та же сессия, но коммит/откат на выходе, как и раньше
+        session = await uow.session()
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        return
+
     async with async_session_maker() as session:
         try:
             yield session
@@ -18,4 +198,25 @@ async def get_session() -> AsyncSession:
             await session.rollback()
             raise
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+
+@asynccontextmanager
+async def get_read_session() -> AsyncSession:
+    """
+    Сессия только для чтения (реплика, если настроена). Ничего не коммитит:
+    изменения, сделанные через нее, будут отброшены. Закрытие без rollback(),
+    чтобы загруженные объекты не истекали и были доступны после выхода из блока.
+    """
+    async with read_session_maker() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+async def dispose_engines():
+    """Закрывает пулы соединений основной БД и реплики (при остановке процесса)."""
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
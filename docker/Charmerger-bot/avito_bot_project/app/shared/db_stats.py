@@ -0,0 +1,186 @@
+# /app/shared/db_stats.py
+"""
+Учет SQL-запросов по единицам обработки.
+
+Хуки движка SQLAlchemy (install_query_hooks) считают каждый запрос и его время в
+текущей области (query_scope): апдейт Telegram (DbSessionMiddleware), HTTP-запрос
+(QueryStatsMiddleware) или сообщение стрима (shared/streams.instrument_handler).
+Область живет в contextvar: хуки выполняются в greenlet SQLAlchemy, который
+наследует контекст задачи.
+
+- Запросы дольше DB_SLOW_QUERY_MS пишутся в лог WARNING: текст выражения и "форма"
+  параметров (типы и длины списков, без значений - в параметрах токены и переписка).
+- По закрытию области: db_scope_queries / db_scope_seconds {kind, name}. Если запросов
+  больше DB_SCOPE_QUERY_WARN - WARNING с самыми повторяющимися выражениями (признак N+1).
+- assert_query_budget(n) - для проверок и скриптов: AssertionError, если внутри блока
+  выполнено больше n запросов (см. tests/test_query_budget.py).
+
+    with assert_query_budget(3):
+        await load_forwarding_owner(avito_user_id)
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import event
+
+from shared.config import settings
+from shared.metrics import DB_SCOPE_QUERIES, DB_SCOPE_SECONDS, DB_SLOW_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов выражения писать в лог
+_STATEMENT_LOG_LIMIT = 1000
+# Сколько самых частых выражений показывать при превышении DB_SCOPE_QUERY_WARN
+_TOP_STATEMENTS = 3
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryScope:
+    """Счетчики запросов одной единицы обработки."""
+
+    def __init__(self, kind: str, name: str, parent: Optional["QueryScope"] = None):
+        self.kind = kind
+        self.name = name
+        self.parent = parent
+        self.queries = 0
+        self.seconds = 0.0
+        # Выражение -> число выполнений: повторяющиеся в цикле запросы видны сразу
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.seconds += elapsed
+        self.statements[statement] += 1
+
+    def merge_into_parent(self):
+        if self.parent is not None:
+            self.parent.queries += self.queries
+            self.parent.seconds += self.seconds
+            self.parent.statements.update(self.statements)
+
+    def top_statements(self, limit: int = _TOP_STATEMENTS) -> str:
+        return "\n".join(
+            f"  {count} x {_compact(statement)}" for statement, count in self.statements.most_common(limit)
+        )
+
+
+_current_scope: ContextVar[Optional[QueryScope]] = ContextVar("db_query_scope", default=None)
+
+
+def current_scope() -> Optional[QueryScope]:
+    return _current_scope.get()
+
+
+def _compact(statement: str) -> str:
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return statement if len(statement) <= _STATEMENT_LOG_LIMIT else statement[:_STATEMENT_LOG_LIMIT] + "..."
+
+
+def _shape(value: Any) -> Any:
+    """Форма параметра без значения: тип, для коллекций - длина и форма элементов."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, tuple) and value and not isinstance(value[0], (list, tuple, dict)):
+        return tuple(_shape(item) for item in value) if len(value) <= 20 else f"tuple[{len(value)}]"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+@contextmanager
+def query_scope(kind: str, name: str) -> Iterator[QueryScope]:
+    """Область учета запросов. Вложенная область добавляет свои счетчики к внешней."""
+    parent = _current_scope.get()
+    scope = QueryScope(kind, name, parent)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        scope.merge_into_parent()
+        if parent is None:
+            _finish(scope)
+
+
+def _finish(scope: QueryScope):
+    if scope.queries == 0 or scope.kind == "budget":
+        return
+    DB_SCOPE_QUERIES.labels(kind=scope.kind, name=scope.name).observe(scope.queries)
+    DB_SCOPE_SECONDS.labels(kind=scope.kind, name=scope.name).observe(scope.seconds)
+    if scope.queries > settings.db_scope_query_warn:
+        logger.warning(
+            "%s %s: %d SQL-запросов за %.0f мс. Чаще всего:\n%s",
+            scope.kind, scope.name, scope.queries, scope.seconds * 1000, scope.top_statements(),
+        )
+
+
+@contextmanager
+def assert_query_budget(max_queries: int, max_seconds: Optional[float] = None) -> Iterator[QueryScope]:
+    """Падает с AssertionError, если внутри блока выполнено больше max_queries запросов
+    (или они заняли больше max_seconds)."""
+    with query_scope("budget", "assert_query_budget") as scope:
+        yield scope
+    if scope.queries > max_queries:
+        raise AssertionError(
+            f"Выполнено {scope.queries} SQL-запросов при бюджете {max_queries}:\n{scope.top_statements(10)}"
+        )
+    if max_seconds is not None and scope.seconds > max_seconds:
+        raise AssertionError(
+            f"SQL-запросы заняли {scope.seconds:.3f} сек при бюджете {max_seconds} сек:\n{scope.top_statements(10)}"
+        )
+
+
+def install_query_hooks(async_engine, engine_name: str):
+    """Подключает учет запросов к движку (AsyncEngine)."""
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.record(statement, elapsed)
+        if elapsed * 1000 >= settings.db_slow_query_ms:
+            kind = scope.kind if scope is not None else "none"
+            DB_SLOW_QUERIES.labels(engine=engine_name, kind=kind).inc()
+            logger.warning(
+                "Медленный SQL-запрос %.0f мс (%s, %s %s): %s | параметры: %s",
+                elapsed * 1000, engine_name, kind, scope.name if scope is not None else "-",
+                _compact(statement),
+                # executemany: число строк и одна строка как образец
+                [f"{len(parameters)} rows", _shape(parameters[0])] if executemany and parameters else _shape(parameters),
+            )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(exception_context):
+        # after_cursor_execute не вызывается при ошибке - снимаем отметку времени
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware: область учета запросов на HTTP-запрос (name - шаблон маршрута)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with query_scope("http", "unmatched") as stats:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Маршрут известен только после роутинга: FastAPI кладет его в scope["route"]
+                route = scope.get("route")
+                stats.name = getattr(route, "path", None) or "unmatched"
@@ -0,0 +1,329 @@
+# /app/shared/diagnostics.py
+"""
+Диагностика работающего процесса без перезапуска (эндпоинты - modules/webapp/diagnostics.py).
+
+Операции:
+- profile     - профилировщик на N секунд: yappi (учитывает корутины, часы wall или cpu),
+                если установлен, иначе cProfile. Результат - файл pstats (snakeviz,
+                python -m pstats, gprof2dot) или текстовый топ функций;
+- tasks       - все задачи asyncio процесса с цепочкой await (где сейчас ждет каждая);
+- loop_lag    - задержка цикла событий: насколько позже назначенного просыпается sleep;
+- tracemalloc_start / tracemalloc_snapshot / tracemalloc_stop - учет выделений памяти:
+                снимок отдает топ мест выделения и разницу с предыдущим снимком.
+
+Стадии часто работают в отдельном процессе (python -m worker), поэтому каждый процесс
+запускает run_diagnostics_listener: раз в DIAG_HEARTBEAT_INTERVAL секунд отмечается в хеше
+DIAG_PROCESSES_KEY и забирает адресованные ему команды из Redis. request_diagnostic
+выполняет операцию сразу, если она для текущего процесса, иначе кладет команду в очередь
+нужного процесса и ждет ответ.
+"""
+import asyncio
+import base64
+import cProfile
+import io
+import logging
+import os
+import pstats
+import socket
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+import redis.asyncio as redis
+
+from shared.exceptions import DiagnosticsError
+from shared.serialization import json_dumps, json_loads
+
+try:
+    import yappi
+    YAPPI_AVAILABLE = True
+except ImportError:  # pragma: no cover - зависит от окружения
+    YAPPI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+DIAG_PROCESSES_KEY = "diag:processes"
+DIAG_COMMANDS_KEY_TPL = "diag:commands:{process_id}"
+DIAG_RESULT_KEY_TPL = "diag:result:{request_id}"
+DIAG_RESULT_TTL = 600          # Сколько хранятся команды и ответы, сек
+DIAG_POLL_INTERVAL = 1.0       # Как часто процесс проверяет свою очередь команд, сек
+DIAG_HEARTBEAT_INTERVAL = 15   # Как часто процесс отмечается в DIAG_PROCESSES_KEY, сек
+DIAG_PROFILE_MAX_SECONDS = 300
+
+_profiling = False
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+# Команды из Redis выполняются задачами, чтобы долгий профиль не задерживал следующие
+_running: Set[asyncio.Task] = set()
+
+
+# --- Профилирование ---
+
+async def profile(seconds: float, engine: str = "auto", clock: str = "wall") -> Dict[str, Any]:
+    """Профилирует весь процесс seconds секунд. Возвращает pstats в base64."""
+    global _profiling
+    if not 0 < seconds <= DIAG_PROFILE_MAX_SECONDS:
+        raise DiagnosticsError(f"Длительность профилирования: от 0 до {DIAG_PROFILE_MAX_SECONDS} сек.")
+    if engine == "auto":
+        engine = "yappi" if YAPPI_AVAILABLE else "cprofile"
+    if engine == "yappi" and not YAPPI_AVAILABLE:
+        raise DiagnosticsError("yappi не установлен, доступен только engine=cprofile.")
+    if engine not in ("yappi", "cprofile"):
+        raise DiagnosticsError(f"Неизвестный профилировщик '{engine}': auto, yappi или cprofile.")
+    if _profiling:
+        raise DiagnosticsError("В процессе уже идет профилирование.")
+
+    _profiling = True
+    logger.warning(f"DIAGNOSTICS: профилирование {engine} на {seconds} сек.")
+    fd, path = tempfile.mkstemp(suffix=".prof")
+    os.close(fd)
+    try:
+        if engine == "yappi":
+            yappi.clear_stats()
+            yappi.set_clock_type(clock)
+            yappi.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                yappi.stop()
+            yappi.get_func_stats().save(path, type="pstat")
+            yappi.clear_stats()
+        else:
+            # cProfile включается для потока цикла событий: в него попадает все, что там выполнялось
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            profiler.dump_stats(path)
+        with open(path, "rb") as f:
+            data = f.read()
+    finally:
+        _profiling = False
+        os.unlink(path)
+    return {"engine": engine, "clock": clock if engine == "yappi" else "wall", "seconds": seconds,
+            "pstats_b64": base64.b64encode(data).decode("ascii")}
+
+
+def profile_summary(pstats_data: bytes, limit: int = 40, sort: str = "cumulative") -> str:
+    """Текстовый топ функций из файла pstats."""
+    fd, path = tempfile.mkstemp(suffix=".prof")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pstats_data)
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+    finally:
+        os.unlink(path)
+
+
+# --- Задачи asyncio и задержка цикла ---
+
+def _await_chain(coro) -> List[str]:
+    """Цепочка await корутины от внешней к самой внутренней (task.get_stack дает только внешний кадр)."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            frames.append(f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def dump_tasks() -> Dict[str, Any]:
+    tasks = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "stack": _await_chain(coro),
+        })
+    tasks.sort(key=lambda item: item["name"])
+    return {"count": len(tasks), "tasks": tasks}
+
+
+async def measure_loop_lag(seconds: float = 5.0, interval: float = 0.05) -> Dict[str, Any]:
+    """Насколько позже назначенного просыпается asyncio.sleep(interval) в течение seconds секунд."""
+    loop = asyncio.get_running_loop()
+    lags = []
+    deadline = loop.time() + min(seconds, 60)
+    while loop.time() < deadline:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - started - interval))
+    lags.sort()
+    return {
+        "samples": len(lags),
+        "mean_ms": round(statistics.fmean(lags) * 1000, 2),
+        "p50_ms": round(lags[len(lags) // 2] * 1000, 2),
+        "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+        "max_ms": round(lags[-1] * 1000, 2),
+    }
+
+
+# --- tracemalloc ---
+
+def _memory_status() -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": tracemalloc.is_tracing(), "traced_current_mb": round(current / 2**20, 2),
+            "traced_peak_mb": round(peak / 2**20, 2)}
+
+
+def tracemalloc_start(frames: int = 10) -> Dict[str, Any]:
+    """Включает учет выделений (замедляет процесс, не оставляйте включенным надолго)."""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _last_snapshot = None
+        logger.warning(f"DIAGNOSTICS: tracemalloc включен, кадров: {frames}.")
+    return _memory_status()
+
+
+def tracemalloc_stop() -> Dict[str, Any]:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    logger.warning("DIAGNOSTICS: tracemalloc выключен.")
+    return _memory_status()
+
+
+def _take_snapshot(limit: int, key_type: str) -> Dict[str, Any]:
+    global _last_snapshot
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    top = [{
+        "where": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count,
+    } for stat in snapshot.statistics(key_type)[:limit]]
+    diff = []
+    if _last_snapshot is not None:
+        diff = [{
+            "where": str(stat.traceback), "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff, "size_kb": round(stat.size / 1024, 1),
+        } for stat in snapshot.compare_to(_last_snapshot, key_type)[:limit]]
+    _last_snapshot = snapshot
+    return {**_memory_status(), "top": top, "diff_with_previous": diff}
+
+
+async def tracemalloc_snapshot(limit: int = 25, key_type: str = "lineno") -> Dict[str, Any]:
+    """Снимок памяти: топ мест выделения и разница с предыдущим снимком."""
+    if not tracemalloc.is_tracing():
+        raise DiagnosticsError("tracemalloc не включен: сначала tracemalloc_start.")
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise DiagnosticsError("key_type: lineno, filename или traceback.")
+    # Снимок и сравнение - долгие синхронные операции, пусть идут вне цикла событий
+    return await asyncio.to_thread(_take_snapshot, limit, key_type)
+
+
+# --- Выполнение и доставка команд ---
+
+async def run_diagnostic(operation: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Выполняет операцию в текущем процессе."""
+    if operation == "profile":
+        return await profile(float(params.get("seconds", 10)), params.get("engine", "auto"), params.get("clock", "wall"))
+    if operation == "tasks":
+        return dump_tasks()
+    if operation == "loop_lag":
+        return await measure_loop_lag(float(params.get("seconds", 5)))
+    if operation == "tracemalloc_start":
+        return tracemalloc_start(int(params.get("frames", 10)))
+    if operation == "tracemalloc_snapshot":
+        return await tracemalloc_snapshot(int(params.get("limit", 25)), params.get("key_type", "lineno"))
+    if operation == "tracemalloc_stop":
+        return tracemalloc_stop()
+    raise DiagnosticsError(f"Неизвестная операция '{operation}'.")
+
+
+async def list_processes(redis_client: redis.Redis) -> List[Dict[str, Any]]:
+    """Процессы, которые отмечались недавно (веб и воркеры)."""
+    now = time.time()
+    processes = []
+    for process_id, raw in (await redis_client.hgetall(DIAG_PROCESSES_KEY)).items():
+        info = json_loads(raw)
+        if now - info.get("heartbeat", 0) <= DIAG_HEARTBEAT_INTERVAL * 3:
+            processes.append({"process_id": process_id, "current": process_id == PROCESS_ID, **info})
+    return sorted(processes, key=lambda item: item["process_id"])
+
+
+async def request_diagnostic(
+    redis_client: redis.Redis, process_id: Optional[str], operation: str, params: Dict[str, Any], timeout: float
+) -> Dict[str, Any]:
+    """Выполняет операцию в процессе process_id (None - в текущем) и возвращает результат."""
+    if not process_id or process_id == PROCESS_ID:
+        return await run_diagnostic(operation, params)
+    if not await redis_client.hexists(DIAG_PROCESSES_KEY, process_id):
+        raise DiagnosticsError(f"Процесс {process_id} не найден.")
+
+    request_id = uuid.uuid4().hex
+    commands_key = DIAG_COMMANDS_KEY_TPL.format(process_id=process_id)
+    result_key = DIAG_RESULT_KEY_TPL.format(request_id=request_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.rpush(commands_key, json_dumps({"id": request_id, "operation": operation, "params": params}))
+        pipe.expire(commands_key, DIAG_RESULT_TTL)
+        await pipe.execute()
+
+    deadline = time.monotonic() + timeout + DIAG_POLL_INTERVAL * 2
+    while time.monotonic() < deadline:
+        raw = await redis_client.get(result_key)
+        if raw is not None:
+            await redis_client.delete(result_key)
+            reply = json_loads(raw)
+            if not reply["ok"]:
+                raise DiagnosticsError(reply["error"])
+            return reply["result"]
+        await asyncio.sleep(0.5)
+    raise DiagnosticsError(f"Процесс {process_id} не ответил за {timeout:.0f} сек.")
+
+
+async def _execute_command(redis_client: redis.Redis, command: Dict[str, Any]):
+    try:
+        reply = {"ok": True, "result": await run_diagnostic(command["operation"], command.get("params") or {})}
+    except DiagnosticsError as e:
+        reply = {"ok": False, "error": str(e)}
+    except Exception as e:
+        logger.error(f"DIAGNOSTICS: ошибка операции {command.get('operation')}: {e}", exc_info=True)
+        reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    await redis_client.set(DIAG_RESULT_KEY_TPL.format(request_id=command["id"]), json_dumps(reply), ex=DIAG_RESULT_TTL)
+
+
+async def run_diagnostics_listener(redis_client: redis.Redis, service: str):
+    """Фоновая задача процесса: регистрация в DIAG_PROCESSES_KEY и выполнение команд диагностики."""
+    commands_key = DIAG_COMMANDS_KEY_TPL.format(process_id=PROCESS_ID)
+    started = time.time()
+    last_heartbeat = 0.0
+    try:
+        while True:
+            try:
+                now = time.time()
+                if now - last_heartbeat >= DIAG_HEARTBEAT_INTERVAL:
+                    await redis_client.hset(DIAG_PROCESSES_KEY, PROCESS_ID, json_dumps({
+                        "service": service, "pid": os.getpid(), "started": started, "heartbeat": now,
+                    }))
+                    last_heartbeat = now
+                raw = await redis_client.lpop(commands_key)
+                if raw is None:
+                    await asyncio.sleep(DIAG_POLL_INTERVAL)
+                    continue
+                task = asyncio.create_task(_execute_command(redis_client, json_loads(raw)), name="diagnostics-command")
+                _running.add(task)
+                task.add_done_callback(_running.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"DIAGNOSTICS: ошибка обработки команд: {e}")
+                await asyncio.sleep(DIAG_POLL_INTERVAL)
+    finally:
+        try:
+            await redis_client.hdel(DIAG_PROCESSES_KEY, PROCESS_ID)
+        except Exception:
+            pass
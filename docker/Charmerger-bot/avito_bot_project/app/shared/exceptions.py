@@ -23,3 +23,31 @@ class DatabaseError(ApplicationError):
     если стандартных исключений SQLAlchemy недостаточно.
     """
     pass
+
+
+class AvitoRateLimitError(AvitoAPIError):
+    """
+    Локальный лимит запросов к API Avito исчерпан, и ждать токена дольше
+    допустимого нельзя. retry_after - через сколько секунд имеет смысл повторить.
+    """
+    def __init__(self, message="Avito API rate limit exceeded", retry_after: float = 1.0):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class AvitoCircuitOpenError(AvitoAPIError):
+    """
+    Автомат (circuit breaker) для API Avito разомкнут: Avito недавно отвечал ошибками,
+    запрос не отправляется. Воркеры откладывают такие сообщения на повтор.
+    """
+    def __init__(self, message="Avito API circuit is open", retry_after: float = 1.0):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class DiagnosticsError(ApplicationError):
+    """
+    Операцию диагностики процесса нельзя выполнить: профилирование уже идет,
+    tracemalloc не включен, процесс не найден или не ответил вовремя.
+    """
+    pass
@@ -0,0 +1,240 @@
+# /app/shared/logs.py
+"""
+Логирование процессов (веб и python -m worker).
+
+- Вывод вынесен из цикла событий: корневой логгер пишет в очередь (QueueHandler),
+  форматирует и пишет в stderr/LOG_FILE отдельный поток (QueueListener). Сообщение
+  собирается из аргументов (logger.info("... %s", x)) тоже в этом потоке.
+- LOG_FORMAT=json - одна JSON-строка на запись: ts, level, logger, message, service,
+  trace_id входящего сообщения (см. shared/tracing.py) и поля из extra.
+- Шумные логгеры (записи на каждое сообщение) прореживаются: LOG_SAMPLING - доля
+  сохраняемых записей, LOG_RATE_LIMITS - не больше N записей в секунду. Ключ - имя
+  логгера или его префикс. WARNING и выше не отбрасываются никогда; отброшенные
+  считаются в log_records_dropped_total.
+- Уровни логгеров меняются без перезапуска: админ-эндпоинт пишет их в Redis
+  (LOG_LEVELS_KEY), каждый процесс применяет изменения за LOG_LEVELS_SYNC_INTERVAL секунд.
+"""
+import asyncio
+import atexit
+import logging
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+import redis.asyncio as redis
+
+from shared.config import settings, LOG_LEVELS_KEY, LOG_LEVELS_SYNC_INTERVAL
+from shared.metrics import LOG_RECORDS_DROPPED
+from shared.serialization import json_dumps_str
+from shared.tracing import current_trace_id
+
+logger = logging.getLogger(__name__)
+
+TEXT_FORMAT = "%(asctime)s - [%(levelname)s] - %(name)s: %(message)s"
+LEVEL_NAMES = ("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG")
+ROOT_LOGGER = "root"
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Атрибуты LogRecord, которые не считаются полями extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id", "service"}
+# Аргументы этих типов можно форматировать позже в другом потоке: они не изменятся
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None), bytes)
+
+_listener: Optional[QueueListener] = None
+_service = ""
+# Уровни, примененные из Redis: при удалении ключа логгер возвращается к уровню по умолчанию
+_applied_levels: Dict[str, str] = {}
+
+
+def parse_logger_mapping(spec: str) -> Dict[str, float]:
+    """'modules.avito.webhook=0.1,modules.telegram.worker=0.5' -> {логгер: число}."""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        try:
+            mapping[name.strip()] = float(value)
+        except ValueError:
+            raise ValueError(f"Некорректный элемент '{item}': ожидается логгер=число.")
+    return mapping
+
+
+def _match(mapping: Dict[str, float], name: str) -> Optional[Tuple[str, float]]:
+    """Самый длинный ключ, совпадающий с именем логгера или его префиксом."""
+    best = None
+    for key, value in mapping.items():
+        if (name == key or name.startswith(key + ".")) and (best is None or len(key) > len(best[0])):
+            best = (key, value)
+    return best
+
+
+class SamplingFilter(logging.Filter):
+    """Доля и лимит в секунду для записей ниже WARNING по логгерам."""
+
+    def __init__(self, sampling: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sampling = sampling
+        self.rate_limits = rate_limits
+        self._resolved: Dict[str, Tuple[Optional[Tuple[str, float]], Optional[Tuple[str, float]]]] = {}
+        # Токен-бакет на ключ LOG_RATE_LIMITS: (токены, время последнего пополнения)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        resolved = self._resolved.get(record.name)
+        if resolved is None:
+            resolved = self._resolved[record.name] = (_match(self.sampling, record.name), _match(self.rate_limits, record.name))
+        sample, limit = resolved
+
+        if sample is not None and random.random() >= sample[1]:
+            LOG_RECORDS_DROPPED.labels(logger=sample[0], reason="sampled").inc()
+            return False
+        if limit is not None:
+            key, rate = limit
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (rate, now))
+            tokens = min(rate, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                LOG_RECORDS_DROPPED.labels(logger=key, reason="rate_limited").inc()
+                return False
+            self._buckets[key] = (tokens - 1, now)
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в потоке цикла событий.
+
+    Стандартный prepare() сразу собирает сообщение и traceback. Здесь это откладывается
+    до потока QueueListener, если аргументы неизменяемые; изменяемые (dict, list, объекты)
+    подставляются сразу, иначе в лог попало бы их состояние на момент записи, а не вызова.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.trace_id = current_trace_id()
+        record.service = _service
+        args = record.args
+        # Единственный аргумент-словарь logging хранит как сам словарь (формат "%(key)s")
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "service": getattr(record, "service", _service),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json_dumps_str(entry)
+
+
+def setup_logging(service: str):
+    """Настраивает корневой логгер процесса (один раз; повторный вызов ничего не делает)."""
+    global _listener, _service
+    if _listener is not None:
+        return
+    _service = service
+
+    if settings.log_file:
+        output: logging.Handler = logging.FileHandler(settings.log_file, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if settings.log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(
+        parse_logger_mapping(settings.log_sampling), parse_logger_mapping(settings.log_rate_limits)
+    ))
+
+    root = logging.getLogger()
+    # Заменяем обработчики basicConfig (shared/config.py вызывает его при импорте)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(settings.log_level.upper())
+    # uvicorn пишет в свои обработчики синхронно - направляем его логгеры в ту же очередь
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при выходе, чтобы не потерять последние записи
+    atexit.register(_listener.stop)
+    logger.info(f"Логирование: формат {settings.log_format}, уровень {settings.log_level.upper()}, сервис {service}.")
+
+
+def get_log_levels() -> Dict[str, str]:
+    """Уровни корневого логгера и логгеров, заданных явно (в этом процессе)."""
+    levels = {ROOT_LOGGER: logging.getLevelName(logging.getLogger().level)}
+    for name, item in sorted(logging.Logger.manager.loggerDict.items()):
+        if isinstance(item, logging.Logger) and item.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(item.level)
+    return levels
+
+
+def apply_log_levels(levels: Dict[str, str]):
+    """Применяет уровни из Redis; логгеры, пропавшие из набора, возвращаются к уровню по умолчанию."""
+    for name in set(_applied_levels) - set(levels):
+        if name == ROOT_LOGGER:
+            logging.getLogger().setLevel(settings.log_level.upper())
+        else:
+            logging.getLogger(name).setLevel(logging.NOTSET)
+        logger.info(f"Уровень логгера {name} сброшен к значению по умолчанию.")
+    for name, level in levels.items():
+        if level not in LEVEL_NAMES or _applied_levels.get(name) == level:
+            continue
+        logging.getLogger(None if name == ROOT_LOGGER else name).setLevel(level)
+        logger.info(f"Уровень логгера {name}: {level}.")
+    _applied_levels.clear()
+    _applied_levels.update({name: level for name, level in levels.items() if level in LEVEL_NAMES})
+
+
+async def set_log_level(redis_client: redis.Redis, name: str, level: Optional[str]):
+    """
+    Задает уровень логгера для всех процессов (level=None - сброс к значению по умолчанию).
+    В текущем процессе применяется сразу, в остальных - при следующей синхронизации.
+    """
+    if level is None:
+        await redis_client.hdel(LOG_LEVELS_KEY, name)
+    else:
+        if level not in LEVEL_NAMES:
+            raise ValueError(f"Неизвестный уровень '{level}': {', '.join(LEVEL_NAMES)}.")
+        await redis_client.hset(LOG_LEVELS_KEY, name, level)
+    apply_log_levels(await redis_client.hgetall(LOG_LEVELS_KEY))
+
+
+async def run_log_level_sync(redis_client: redis.Redis):
+    """Фоновая задача процесса: подхватывает уровни логгеров, заданные через админ-эндпоинт."""
+    while True:
+        try:
+            apply_log_levels(await redis_client.hgetall(LOG_LEVELS_KEY))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Не удалось синхронизировать уровни логгеров: {e}")
+        await asyncio.sleep(LOG_LEVELS_SYNC_INTERVAL)
@@ -0,0 +1,114 @@
+# /app/shared/loop_monitor.py
+"""
+Контроль цикла событий процесса: задержка и "виновники" блокировок.
+
+Вебхуки, хендлеры aiogram и стадии конвейера делят один цикл событий, и любая
+синхронная работа (шифрование, сериализация больших моделей, рендер карточек для
+многих подписчиков) задерживает всех остальных.
+
+- run_loop_monitor - задача, которая раз в LOOP_LAG_SAMPLE_INTERVAL секунд засыпает и
+  меряет, насколько позже назначенного проснулась: event_loop_lag_seconds.
+- Сторожевой поток: если цикл не просыпается дольше LOOP_SLOW_CALLBACK_THRESHOLD, он
+  снимает стек потока цикла (sys._current_frames) и запоминает, какая корутина и какое
+  место в коде проекта выполнялись. Когда цикл освобождается, блокировка попадает в
+  event_loop_slow_callbacks_total / event_loop_slow_callback_seconds {coroutine} и в лог
+  со стеком. Работает и со стандартным циклом, и с uvloop (внутрь цикла не встраивается).
+
+Что делать с найденными местами - см. shared/offload.py.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Tuple
+
+from shared.config import settings, LOOP_LAG_SAMPLE_INTERVAL
+from shared.metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_SLOW_CALLBACK_SECONDS, EVENT_LOOP_SLOW_CALLBACKS
+
+logger = logging.getLogger(__name__)
+
+# Каталог /app: кадры из него считаются кодом проекта (а не asyncio, aiogram, site-packages)
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+_CO_COROUTINE = 0x80 | 0x200  # CO_COROUTINE | CO_ASYNC_GENERATOR
+_STACK_LIMIT = 15
+
+
+def _is_app_frame(filename: str) -> bool:
+    return filename.startswith(_APP_ROOT) and "site-packages" not in filename
+
+
+def describe_stack(frame) -> Tuple[str, str, str]:
+    """
+    (корутина, место, стек) по кадру потока цикла:
+    корутина - самая внешняя выполняющаяся корутина (обработчик задачи),
+    место - самый внутренний кадр кода проекта.
+    """
+    coroutine, site = "unknown", "unknown"
+    stack = traceback.extract_stack(frame, limit=None)
+    for summary, (f, _) in zip(reversed(stack), traceback.walk_stack(frame)):
+        if site == "unknown" and _is_app_frame(summary.filename):
+            site = f"{os.path.relpath(summary.filename, _APP_ROOT)}:{summary.lineno} in {summary.name}"
+        if f.f_code.co_flags & _CO_COROUTINE:
+            coroutine = getattr(f.f_code, "co_qualname", f.f_code.co_name)
+    return coroutine, site, "".join(traceback.format_list(stack[-_STACK_LIMIT:]))
+
+
+class _Watchdog(threading.Thread):
+    """Поток, который замечает, что цикл событий не просыпается, и снимает его стек."""
+
+    def __init__(self, loop_thread_id: int, threshold: float):
+        super().__init__(name="loop-watchdog", daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        # (корутина, место, стек) текущей блокировки; забирает задача монитора
+        self.stall: Optional[Tuple[str, str, str]] = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.threshold / 2):
+            if self.stall is not None:
+                continue
+            if time.monotonic() - self.heartbeat < LOOP_LAG_SAMPLE_INTERVAL + self.threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                self.stall = describe_stack(frame)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+async def run_loop_monitor():
+    """Фоновая задача процесса: задержка цикла событий и отчеты о блокировках."""
+    if not settings.loop_monitor_enabled:
+        return
+    threshold = settings.loop_slow_callback_threshold
+    watchdog = _Watchdog(threading.get_ident(), threshold)
+    watchdog.start()
+    loop = asyncio.get_running_loop()
+    logger.info(f"Контроль цикла событий: замер каждые {LOOP_LAG_SAMPLE_INTERVAL} сек, порог блокировки {threshold * 1000:.0f} мс.")
+    try:
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, loop.time() - started - LOOP_LAG_SAMPLE_INTERVAL)
+            watchdog.heartbeat = time.monotonic()
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if lag < threshold:
+                watchdog.stall = None
+                continue
+
+            coroutine, site, stack = watchdog.stall or ("unknown", "unknown", "")
+            watchdog.stall = None
+            EVENT_LOOP_SLOW_CALLBACKS.labels(coroutine=coroutine).inc()
+            EVENT_LOOP_SLOW_CALLBACK_SECONDS.labels(coroutine=coroutine).observe(lag)
+            logger.warning(
+                "Цикл событий был заблокирован на %.0f мс: корутина %s, место %s\n%s",
+                lag * 1000, coroutine, site, stack,
+            )
+    finally:
+        watchdog.stop()
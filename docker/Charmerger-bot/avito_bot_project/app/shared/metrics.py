@@ -0,0 +1,311 @@
+# /app/shared/metrics.py
+"""
+Метрики Prometheus приложения.
+
+Все метрики объявляются здесь, модули только импортируют нужные объекты.
+Если пакет prometheus_client не установлен, метрики превращаются в заглушки,
+а /metrics отдает пустой ответ - приложение работает как раньше.
+
+Веб-процесс отдает метрики на /metrics, процесс воркеров - на отдельном порту
+(WORKER_METRICS_PORT, см. start_metrics_server). Для замера произвольной операции
+есть декоратор timed("имя") - время попадает в app_operation_seconds{operation}.
+"""
+import functools
+import logging
+import time
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # pragma: no cover - зависит от окружения
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _NoopMetric:
+    """Заглушка метрики: принимает любые вызовы и ничего не делает."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def set_function(self, *args, **kwargs):
+        pass
+
+
+if not PROMETHEUS_AVAILABLE:
+    Counter = Gauge = Histogram = _NoopMetric  # noqa: F811
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Текущие значения метрик в текстовом формате Prometheus и их Content-Type."""
+    if not PROMETHEUS_AVAILABLE:
+        return b"", CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int):
+    """HTTP-сервер метрик для процессов без FastAPI (python -m worker)."""
+    if not PROMETHEUS_AVAILABLE:
+        logger.warning("prometheus_client не установлен - сервер метрик не запущен.")
+        return
+    from prometheus_client import start_http_server
+    start_http_server(port)
+    logger.info(f"Метрики Prometheus доступны на порту {port} (/metrics).")
+
+
+def timed(operation: str):
+    """Декоратор корутины: время выполнения в app_operation_seconds{operation}, ошибки - в app_operation_errors_total."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                OPERATION_ERRORS.labels(operation=operation).inc()
+                raise
+            finally:
+                OPERATION_SECONDS.labels(operation=operation).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# --- API Avito (modules/avito/policy.py) ---
+AVITO_API_REQUESTS = Counter(
+    "avito_api_requests_total",
+    "Запросы к API Avito по эндпоинтам и результату (HTTP-статус, error, rate_limited, circuit_open).",
+    ["family", "endpoint", "outcome"],
+)
+AVITO_API_LATENCY = Histogram(
+    "avito_api_request_seconds",
+    "Время ответа API Avito.",
+    ["family", "endpoint"],
+)
+AVITO_RATE_LIMIT_WAIT = Histogram(
+    "avito_rate_limit_wait_seconds",
+    "Сколько запрос ждал свободный токен в лимитере.",
+    ["family"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+AVITO_CIRCUIT_STATE = Gauge(
+    "avito_circuit_state",
+    "Состояние автомата API Avito: 0 - замкнут, 1 - пробный запрос, 2 - разомкнут.",
+    ["family"],
+)
+
+# --- Справедливое планирование стримов по арендаторам (shared/streams.py) ---
+STREAM_TENANT_BACKLOG = Gauge(
+    "stream_tenant_backlog",
+    "Сообщения арендатора, прочитанные из стрима и ожидающие обработки в этом процессе.",
+    ["stream", "tenant"],
+)
+STREAM_TENANT_DISPATCHED = Counter(
+    "stream_tenant_dispatched_total",
+    "Сообщения, отданные в обработку, по арендаторам.",
+    ["stream", "tenant"],
+)
+
+# --- Пулы соединений Redis (shared/redis_client.py) ---
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections",
+    "Соединения пула Redis: in_use - заняты командой, idle - открыты и свободны.",
+    ["pool", "state"],
+)
+REDIS_POOL_MAX_CONNECTIONS = Gauge(
+    "redis_pool_max_connections",
+    "Предельный размер пула Redis.",
+    ["pool"],
+)
+
+# --- Пулы соединений PostgreSQL (shared/database.py) ---
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Соединения пула SQLAlchemy: checked_out - выданы сессиям, idle - свободны, overflow - сверх DB_POOL_SIZE.",
+    ["engine", "state"],
+)
+
+# --- Стадии конвейера (shared/streams.py) ---
+STREAM_HANDLER_SECONDS = Histogram(
+    "stream_handler_seconds",
+    "Время обработки одного сообщения стрима потребителем.",
+    ["stream", "group"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STREAM_MESSAGES = Counter(
+    "stream_messages_total",
+    "Обработанные сообщения стримов: ok - обработчик завершился, error - выбросил исключение.",
+    ["stream", "group", "outcome"],
+)
+STREAM_RECLAIMED = Counter(
+    "stream_reclaimed_total",
+    "Сообщения из PEL, возвращенные в обработку: own - свои после перезапуска или падения обработчика, "
+    "dead - перехваченные у мертвых потребителей.",
+    ["stream", "group", "source"],
+)
+
+# --- Состояние стримов и consumer groups (shared/stream_stats.py) ---
+STREAM_LENGTH = Gauge(
+    "stream_length",
+    "Число записей в стриме (XLEN).",
+    ["stream"],
+)
+STREAM_GROUP_LAG = Gauge(
+    "stream_group_lag",
+    "Записи стрима, еще не выданные группе (XINFO GROUPS lag).",
+    ["stream", "group"],
+)
+STREAM_GROUP_PENDING = Gauge(
+    "stream_group_pending",
+    "Выданные, но не подтвержденные записи группы (PEL).",
+    ["stream", "group"],
+)
+STREAM_GROUP_OLDEST_PENDING_SECONDS = Gauge(
+    "stream_group_oldest_pending_seconds",
+    "Возраст самой старой неподтвержденной записи группы.",
+    ["stream", "group"],
+)
+STREAM_GROUP_CONSUMERS = Gauge(
+    "stream_group_consumers",
+    "Потребители группы.",
+    ["stream", "group"],
+)
+RETRY_SCHEDULED = Gauge(
+    "retry_scheduled",
+    "Сообщения, ожидающие повтора в retry:schedule.",
+)
+
+# --- Сквозная задержка входящих сообщений (shared/tracing.py) ---
+_PIPELINE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120)
+PIPELINE_QUEUE_WAIT_SECONDS = Histogram(
+    "pipeline_queue_wait_seconds",
+    "Сколько входящее сообщение ждало в стриме перед стадией.",
+    ["stage"],
+    buckets=_PIPELINE_BUCKETS,
+)
+PIPELINE_INGEST_TO_DELIVERY_SECONDS = Histogram(
+    "pipeline_ingest_to_delivery_seconds",
+    "От приема вебхука Avito до отправки карточки в Telegram.",
+    buckets=_PIPELINE_BUCKETS,
+)
+PIPELINE_CLIENT_TO_DELIVERY_SECONDS = Histogram(
+    "pipeline_client_to_delivery_seconds",
+    "От отправки сообщения клиентом (created в Avito) до отправки карточки в Telegram.",
+    buckets=_PIPELINE_BUCKETS,
+)
+
+# --- API Telegram (modules/telegram/bot.py) ---
+TELEGRAM_API_REQUESTS = Counter(
+    "telegram_api_requests_total",
+    "Запросы к Bot API по методу и результату (ok или класс исключения).",
+    ["method", "outcome"],
+)
+TELEGRAM_API_LATENCY = Histogram(
+    "telegram_api_request_seconds",
+    "Время ответа Bot API.",
+    ["method"],
+)
+
+# --- Карточки чатов: Redis и копии в PostgreSQL (modules/telegram/view_snapshots.py) ---
+VIEW_LOADS = Counter(
+    "chat_view_loads_total",
+    "Чтения ChatViewModel по источнику: redis, snapshot (копия из PostgreSQL) или miss.",
+    ["source"],
+)
+VIEW_CHECKPOINT_ROWS = Counter(
+    "chat_view_checkpoint_rows_total",
+    "Карточки, сохраненные в chat_view_snapshots.",
+)
+VIEW_CHECKPOINT_LAG_SECONDS = Histogram(
+    "chat_view_checkpoint_lag_seconds",
+    "От первого несохраненного изменения карточки до записи ее копии в PostgreSQL.",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+VIEW_DIRTY_BACKLOG = Gauge(
+    "chat_view_dirty_backlog",
+    "Карточки, измененные в Redis и еще не сохраненные в PostgreSQL.",
+)
+
+# --- SQL-запросы по единицам обработки (shared/db_stats.py) ---
+DB_SCOPE_QUERIES = Histogram(
+    "db_scope_queries",
+    "Число SQL-запросов на апдейт Telegram (kind=telegram), HTTP-запрос (http) или сообщение стрима (stream).",
+    ["kind", "name"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+DB_SCOPE_SECONDS = Histogram(
+    "db_scope_seconds",
+    "Суммарное время SQL-запросов на единицу обработки.",
+    ["kind", "name"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries_total",
+    "SQL-запросы дольше DB_SLOW_QUERY_MS.",
+    ["engine", "kind"],
+)
+
+# --- Произвольные операции (декоратор timed) ---
+OPERATION_SECONDS = Histogram(
+    "app_operation_seconds",
+    "Время выполнения отмеченных операций.",
+    ["operation"],
+)
+OPERATION_ERRORS = Counter(
+    "app_operation_errors_total",
+    "Операции, завершившиеся исключением.",
+    ["operation"],
+)
+
+# --- Логирование (shared/logs.py) ---
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Записи лога ниже WARNING, отброшенные выборкой (LOG_SAMPLING) или лимитом (LOG_RATE_LIMITS).",
+    ["logger", "reason"],
+)
+
+# --- Цикл событий (shared/loop_monitor.py, shared/offload.py) ---
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "Насколько позже назначенного просыпается задача в цикле событий процесса.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_SLOW_CALLBACKS = Counter(
+    "event_loop_slow_callbacks_total",
+    "Блокировки цикла событий дольше LOOP_SLOW_CALLBACK_THRESHOLD по корутине-виновнику.",
+    ["coroutine"],
+)
+EVENT_LOOP_SLOW_CALLBACK_SECONDS = Histogram(
+    "event_loop_slow_callback_seconds",
+    "Длительность блокировок цикла событий по корутине-виновнику.",
+    ["coroutine"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+OFFLOAD_CALLS = Counter(
+    "offload_calls_total",
+    "Вызовы CPU-тяжелых функций: в цикле (inline) или в пуле потоков (thread).",
+    ["operation", "mode"],
+)
+OFFLOAD_SECONDS = Histogram(
+    "offload_call_seconds",
+    "Время выполнения CPU-тяжелых функций (см. offload_when_slow).",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
@@ -0,0 +1,81 @@
+# /app/shared/offload.py
+"""
+Вынос CPU-тяжелой синхронной работы из цикла событий.
+
+- run_in_thread(func, ...) - в пул потоков процесса (OFFLOAD_THREADS). Помогает, когда
+  функция отпускает GIL (cryptography, zstandard, orjson на больших данных) или просто
+  выполняется долго: цикл событий получает управление хотя бы каждые 5 мс (switch interval).
+- run_in_process(func, ...) - в пул процессов (OFFLOAD_PROCESSES, создается при первом
+  вызове). Для чистого Python, который держит GIL; func и аргументы должны сериализоваться pickle.
+- offload_when_slow(name, budget_ms) - декоратор: синхронная функция становится корутиной,
+  которая выполняется прямо в цикле, пока в среднем укладывается в бюджет, и уходит в пул
+  потоков, когда перестает укладываться. Переход в пул и обратно - по скользящему среднему
+  длительности, так что короткие вызовы не платят за переключение потоков.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from shared.config import settings
+from shared.metrics import OFFLOAD_CALLS, OFFLOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_thread_pool = ThreadPoolExecutor(max_workers=settings.offload_threads, thread_name_prefix="offload")
+_process_pool: Optional[ProcessPoolExecutor] = None
+# Вес нового замера в скользящем среднем длительности (offload_when_slow)
+_EWMA_ALPHA = 0.2
+
+
+async def run_in_thread(func: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_thread_pool, functools.partial(func, *args, **kwargs))
+
+
+async def run_in_process(func: Callable[..., Any], *args, **kwargs) -> Any:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.offload_processes)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_process_pool, functools.partial(func, *args, **kwargs))
+
+
+def offload_when_slow(name: str, budget_ms: float):
+    """Выполняет функцию в цикле, пока она в среднем быстрее budget_ms, иначе - в пуле потоков."""
+    budget = budget_ms / 1000
+
+    def decorator(func):
+        average = 0.0
+        inline_calls = OFFLOAD_CALLS.labels(operation=name, mode="inline")
+        thread_calls = OFFLOAD_CALLS.labels(operation=name, mode="thread")
+        duration = OFFLOAD_SECONDS.labels(operation=name)
+
+        def measured(*args, **kwargs):
+            nonlocal average
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                average += _EWMA_ALPHA * (elapsed - average)
+                duration.observe(elapsed)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if average <= budget:
+                inline_calls.inc()
+                return measured(*args, **kwargs)
+            thread_calls.inc()
+            return await run_in_thread(measured, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def shutdown_offload_pools():
+    """Останавливает пулы при завершении процесса."""
+    _thread_pool.shutdown(wait=False, cancel_futures=True)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
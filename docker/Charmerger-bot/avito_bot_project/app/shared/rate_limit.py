@@ -0,0 +1,163 @@
+# /app/shared/rate_limit.py
+"""
+Распределенный токен-бакет в Redis и автомат (circuit breaker).
+
+- RedisTokenBucket: общий для всех процессов лимит запросов по ключу. Состояние
+  бакета (токены и время последнего пополнения) хранится в хеше Redis и меняется
+  Lua-скриптом атомарно. Бакет можно "поставить на паузу" (например, по Retry-After) -
+  пока пауза не истекла, токены не выдаются никому.
+- CircuitBreaker: локальный для процесса автомат. После N подряд ошибок размыкается
+  и сразу отказывает вызовам; по истечении recovery_timeout пропускает один пробный
+  вызов, успех замыкает автомат, ошибка снова размыкает.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+# Возвращает 0, если токен выдан, иначе - сколько миллисекунд ждать.
+# KEYS[1] - хеш бакета, KEYS[2] - ключ паузы. ARGV: скорость (токенов/с), емкость, now (мс), TTL хеша (мс).
+_TOKEN_BUCKET_SCRIPT = """
+local pause = redis.call('PTTL', KEYS[2])
+if pause > 0 then
+    return pause
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return wait
+"""
+
+
+class RedisTokenBucket:
+    """Токен-бакет с пополнением rate токенов в секунду и емкостью capacity."""
+
+    def __init__(self, key: str, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError(f"Некорректные параметры бакета {key}: rate={rate}, capacity={capacity}")
+        self.key = key
+        self.pause_key = f"{key}:pause"
+        self.rate = rate
+        self.capacity = capacity
+        # Хеш бакета живет, пока он нужен для пополнения до полной емкости (+ запас)
+        self._ttl_ms = int(capacity / rate * 1000) + 60_000
+
+    async def try_acquire(self, redis_client: redis.Redis) -> float:
+        """Пробует взять токен. Возвращает 0.0 при успехе, иначе - сколько секунд ждать."""
+        wait_ms = await _script_for(redis_client)(
+            keys=[self.key, self.pause_key],
+            args=[self.rate, self.capacity, int(time.time() * 1000), self._ttl_ms],
+        )
+        return int(wait_ms) / 1000
+
+    async def acquire(self, redis_client: redis.Redis, max_wait: float) -> Optional[float]:
+        """
+        Ждет токен не дольше max_wait секунд. Возвращает общее время ожидания
+        или None, если токен за это время получить нельзя (тогда ожидание не начинается).
+        """
+        waited = 0.0
+        while True:
+            wait = await self.try_acquire(redis_client)
+            if wait <= 0:
+                return waited
+            if waited + wait > max_wait:
+                return None
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def pause(self, redis_client: redis.Redis, seconds: float):
+        """Останавливает выдачу токенов на seconds секунд (для всех процессов)."""
+        await redis_client.set(self.pause_key, "1", px=max(1, int(seconds * 1000)))
+
+    async def pause_remaining(self, redis_client: redis.Redis) -> float:
+        ttl_ms = await redis_client.pttl(self.pause_key)
+        return max(0, ttl_ms) / 1000
+
+
+# Скрипт регистрируется один раз на клиент Redis: дальше вызывается через EVALSHA
+_scripts = {}
+
+
+def _script_for(redis_client: redis.Redis):
+    entry = _scripts.get(id(redis_client))
+    # Сравниваем сам объект: id мог достаться новому клиенту после переподключения
+    if entry is None or entry[0] is not redis_client:
+        entry = (redis_client, redis_client.register_script(_TOKEN_BUCKET_SCRIPT))
+        _scripts[id(redis_client)] = entry
+    return entry[1]
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, on_state_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._on_state_change = on_state_change
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"CIRCUIT [{self.name}]: {self.state} -> {state}")
+            self.state = state
+            if self._on_state_change:
+                self._on_state_change(self)
+
+    def retry_after(self) -> float:
+        """Через сколько секунд автомат пропустит пробный вызов."""
+        return max(0.0, self._opened_at + self.recovery_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """
+        Можно ли выполнить вызов сейчас. В состоянии half_open пропускается
+        только один пробный вызов; если он не отчитался за recovery_timeout, пропускается следующий.
+        """
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.recovery_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self._probe_started_at is None or now - self._probe_started_at >= self.recovery_timeout:
+            self._probe_started_at = now
+            return True
+        return False
+
+    def release_probe(self):
+        """Пробный вызов так и не был выполнен (например, не дождался лимитера)."""
+        self._probe_started_at = None
+
+    def record_success(self):
+        self._failures = 0
+        self._probe_started_at = None
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_started_at = None
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
@@ -1,60 +1,138 @@
 # /app/shared/redis_client.py
+"""
+Доступ к Redis через два отдельных пула соединений:
 
+- redis_client - команды (вебхуки, хендлеры, WebApp, обработчики сообщений).
+  BlockingConnectionPool: при всплеске запрос ждет свободное соединение
+  (до REDIS_POOL_TIMEOUT), а не падает с "Too many connections";
+- redis_blocking_client - блокирующее чтение стримов (XREADGROUP BLOCK) в потребителях
+  shared/streams.py. Каждый потребитель держит соединение по несколько секунд, поэтому
+  в общем пуле они отнимали бы соединения у коротких команд.
+
+Занятость пулов экспортируется в метрики redis_pool_connections / redis_pool_max_connections.
+"""
 import logging
 from typing import Optional
 import redis.asyncio as redis
 from .config import settings
+from .metrics import REDIS_POOL_CONNECTIONS, REDIS_POOL_MAX_CONNECTIONS
 
 logger = logging.getLogger(__name__)
 
-# --- Глобальная переменная для хранения клиента Redis ---
+# --- Глобальные клиенты Redis ---
 redis_client: Optional[redis.Redis] = None
+redis_blocking_client: Optional[redis.Redis] = None
+# Текст Lua-скрипта -> AsyncScript (get_script)
+_scripts = {}
+
+
+def _export_pool_metrics(name: str, pool: redis.ConnectionPool):
+    """Метрики считаются в момент опроса /metrics - фоновая задача не нужна."""
+    REDIS_POOL_MAX_CONNECTIONS.labels(pool=name).set(pool.max_connections)
+    REDIS_POOL_CONNECTIONS.labels(pool=name, state="in_use").set_function(
+        lambda: len(getattr(pool, "_in_use_connections", ()))
+    )
+    REDIS_POOL_CONNECTIONS.labels(pool=name, state="idle").set_function(
+        lambda: sum(1 for conn in getattr(pool, "_available_connections", ()) if conn is not None)
+    )
+
 
 async def init_redis():
     """
-    Создает и инициализирует глобальный клиент Redis, используя пул соединений.
+    Создает и инициализирует глобальные клиенты Redis (команды и блокирующее чтение стримов).
     Эта функция должна быть вызвана один раз при старте приложения (например, в lifespan FastAPI).
+    Возвращает клиент для команд.
     """
-    # Используем `global`, чтобы изменить переменную, объявленную на уровне модуля
-    global redis_client
-    
+    # Используем `global`, чтобы изменить переменные, объявленные на уровне модуля
+    global redis_client, redis_blocking_client
+
     # Проверяем, не был ли клиент уже инициализирован
     if redis_client is not None:
         logger.warning("Клиент Redis уже инициализирован.")
         return redis_client
 
-    logger.info("Инициализация пула соединений Redis...")
+    logger.info("Инициализация пулов соединений Redis...")
     try:
-        # Создаем клиент, используя URL, который был сгенерирован в config.py
         # settings.redis_url - это вычисляемое поле из Pydantic V2
-        redis_client = redis.from_url(
+        command_pool = redis.BlockingConnectionPool.from_url(
             settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
             encoding="utf-8",
             decode_responses=True,  # Важно: Redis будет возвращать строки, а не байты
             health_check_interval=30 # Периодическая проверка, что соединение живое
-        )   
+        )
+        # Таймаут сокета здесь должен быть больше BLOCK (5 с) в потребителях стримов
+        blocking_pool = redis.ConnectionPool.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_blocking_max_connections,
+            socket_timeout=settings.redis_blocking_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+            encoding="utf-8",
+            decode_responses=True,
+            health_check_interval=30
+        )
+        redis_client = redis.Redis(connection_pool=command_pool)
+        redis_blocking_client = redis.Redis(connection_pool=blocking_pool)
+
         # Делаем тестовый запрос, чтобы убедиться, что соединение установлено
         await redis_client.ping()
-        logger.info("Пул соединений Redis успешно инициализирован.")
-    
+        _export_pool_metrics("commands", command_pool)
+        _export_pool_metrics("blocking", blocking_pool)
+        logger.info(
+            f"Пулы Redis готовы: команды - до {settings.redis_max_connections} соединений, "
+            f"чтение стримов - до {settings.redis_blocking_max_connections}."
+        )
+
     except Exception as e:
         logger.error(f"Не удалось подключиться к Redis. Ошибка.: {e}")
-        # В случае ошибки оставляем клиента как None, чтобы приложение могло это обработать
+        # В случае ошибки оставляем клиентов None, чтобы приложение могло это обработать
         redis_client = None
+        redis_blocking_client = None
         # Пробрасываем ошибку дальше, чтобы приложение не запустилось без Redis
         raise
 
     return redis_client
 
+
+def get_redis() -> redis.Redis:
+    """Клиент для команд. Используйте вместо `from shared.redis_client import redis_client`:
+    при импорте модуля клиент еще не создан (None)."""
+    if redis_client is None:
+        raise RuntimeError("Redis не инициализирован: вызовите init_redis() при старте.")
+    return redis_client
+
+
+def get_script(client: redis.Redis, source: str):
+    """
+    Lua-скрипт, зарегистрированный один раз на процесс: sha не зависит от клиента, поэтому
+    скрипт вызывается через EVALSHA с любым клиентом или пайплайном - script(keys=..., args=..., client=...).
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = client.register_script(source)
+    return script
+
+
+def get_stream_reader(default: redis.Redis) -> redis.Redis:
+    """Клиент для блокирующего чтения стримов; до init_redis() (утилиты, бенчмарки) - default."""
+    return redis_blocking_client or default
+
+
 async def close_redis():
     """
-    Корректно закрывает пул соединений с Redis.
+    Корректно закрывает пулы соединений с Redis.
     Эта функция должна быть вызвана при остановке приложения.
     """
-    global redis_client
+    global redis_client, redis_blocking_client
     if redis_client:
-        logger.info("Закрытие пула соединений Redis...")
-        await redis_client.close()
-        # Сбрасываем глобальную переменную
+        logger.info("Закрытие пулов соединений Redis...")
+        await redis_client.aclose(close_connection_pool=True)
+        if redis_blocking_client:
+            await redis_blocking_client.aclose(close_connection_pool=True)
+        # Сбрасываем глобальные переменные
         redis_client = None
-        logger.info("Пул соединений Redis закрыт.")
\ No newline at end of file
+        redis_blocking_client = None
+        logger.info("Пулы соединений Redis закрыты.")
@@ -0,0 +1,68 @@
+# /app/shared/redis_uow.py
+"""
+Unit of Work для Redis: копит записи, сделанные при обработке одного сообщения,
+и отправляет их одним пайплайном (по умолчанию MULTI/EXEC) в конце обработки.
+
+Пример:
+    async with RedisUnitOfWork(redis_client) as uow:
+        await save_view_model(uow.pipeline, view_key, model)
+        queue_reply_context(uow, telegram_id, message_id, context)
+        uow.pipeline.xack(stream_name, group_name, message_id)
+    # здесь все команды уже выполнены за один round trip
+
+Чтения внутри UoW делаются обычным клиентом (uow.redis): пайплайн возвращает
+результаты только после commit().
+"""
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+ResultCallback = Callable[[Any], Optional[Awaitable[None]]]
+
+
+class RedisUnitOfWork:
+    def __init__(self, redis_client: redis.Redis, transaction: bool = True):
+        self.redis = redis_client
+        self.pipeline = redis_client.pipeline(transaction=transaction)
+        self._callbacks: List[Tuple[int, ResultCallback]] = []
+
+    def on_result(self, callback: ResultCallback):
+        """
+        Регистрирует обработчик результата ПОСЛЕДНЕЙ добавленной в пайплайн команды.
+        Вызывается после commit(), может быть корутиной.
+        """
+        if not len(self.pipeline):
+            raise RuntimeError("on_result() вызван до добавления команды в пайплайн.")
+        self._callbacks.append((len(self.pipeline) - 1, callback))
+
+    async def commit(self) -> List[Any]:
+        """Выполняет накопленные команды. Пустой UoW не обращается к Redis."""
+        if not len(self.pipeline):
+            return []
+        results = await self.pipeline.execute()
+        callbacks, self._callbacks = self._callbacks, []
+        for index, callback in callbacks:
+            outcome = callback(results[index])
+            if outcome is not None:
+                await outcome
+        return results
+
+    async def rollback(self):
+        """Отбрасывает накопленные команды."""
+        self._callbacks = []
+        await self.pipeline.reset()
+
+    async def __aenter__(self) -> "RedisUnitOfWork":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            # Сообщение не обработано: ничего не пишем и не подтверждаем. Оно остается в PEL
+            # потребителя и через STREAM_CLAIM_IDLE_SECONDS возвращается в обработку
+            # (PendingReclaimer в shared/streams.py), после STREAM_MAX_DELIVERIES выдач - в DLQ.
+            await self.rollback()
+            return
+        await self.commit()
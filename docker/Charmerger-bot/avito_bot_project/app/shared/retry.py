@@ -0,0 +1,248 @@
+# /app/shared/retry.py
+"""
+Повторные попытки для сообщений из стримов Redis.
+
+Как это работает:
+- обработчик ловит ошибку и вызывает queue_retry_or_dead_letter();
+- временная ошибка (таймаут, 429, 5xx) -> сообщение кладется в delay set
+  (ZSET retry:schedule, score = время следующей попытки) с экспоненциальной
+  задержкой и джиттером;
+- постоянная ошибка (4xx, битые данные) или исчерпан лимит попыток -> сообщение
+  уходит в DLQ-стрим, откуда его можно вернуть через API (redrive_dead_letters);
+- стадия retry_scheduler (run_retry_scheduler) раз в секунду атомарно переносит
+  созревшие сообщения из delay set обратно в исходные стримы.
+
+Исходное сообщение подтверждается (XACK) в том же пайплайне, что и постановка
+на повтор/в DLQ, поэтому сообщение не теряется и не дублируется.
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import httpx
+import redis.asyncio as redis
+
+from shared.config import settings, RETRY_SWEEP_INTERVAL
+from shared.exceptions import AvitoCircuitOpenError, AvitoRateLimitError
+from shared.redis_uow import RedisUnitOfWork
+from shared.serialization import json_dumps_str
+
+logger = logging.getLogger(__name__)
+
+RETRY_SCHEDULE_KEY = "retry:schedule"
+
+# Служебные поля, которые добавляются к сообщению при повторах и в DLQ
+ATTEMPT_FIELD = "retry_attempt"
+DLQ_SOURCE_FIELD = "dlq_source"
+DLQ_ERROR_FIELD = "dlq_error"
+DLQ_FAILED_AT_FIELD = "dlq_failed_at"
+_SERVICE_FIELDS = (ATTEMPT_FIELD, DLQ_SOURCE_FIELD, DLQ_ERROR_FIELD, DLQ_FAILED_AT_FIELD)
+
+# HTTP-статусы, при которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Атомарный перенос созревших сообщений из delay set в их стримы.
+# Несколько планировщиков могут работать одновременно: ZREM внутри скрипта исключает дубли.
+_MOVE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    local entry = cjson.decode(member)
+    local args = {}
+    for field, value in pairs(entry.fields) do
+        table.insert(args, field)
+        table.insert(args, tostring(value))
+    end
+    redis.call('XADD', entry.stream, '*', unpack(args))
+end
+return #due
+"""
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+
+    def delay_for(self, attempt: int) -> float:
+        """Экспоненциальная задержка с джиттером: случайное значение в [base/2, base * 2^(attempt-1)], не больше max_delay."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(min(self.base_delay / 2, ceiling), ceiling)
+
+
+AVITO_RETRY_POLICY = RetryPolicy(
+    max_attempts=settings.avito_retry_max_attempts,
+    base_delay=settings.avito_retry_base_delay,
+    max_delay=settings.avito_retry_max_delay,
+)
+
+
+def _http_status(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    return None
+
+
+def _iter_causes(exc: BaseException):
+    """Ошибка и вся цепочка причин (raise ... from e)."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Классификация ошибок:
+    - сетевые ошибки и таймауты, HTTP 408/425/429/5xx, локальный лимит
+      и разомкнутый автомат (modules/avito/policy.py) - временные;
+    - остальные HTTP 4xx и ошибки данных (KeyError, ValueError) - постоянные;
+    - неизвестные ошибки считаются временными: лучше повторить и в итоге попасть в DLQ,
+      чем потерять сообщение.
+    """
+    for error in _iter_causes(exc):
+        if isinstance(error, (httpx.TransportError, AvitoRateLimitError, AvitoCircuitOpenError)):
+            return True
+        status = _http_status(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS_CODES
+        if isinstance(error, (KeyError, ValueError, TypeError)):
+            return False
+    return True
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Значение заголовка Retry-After (в секундах) или подсказка лимитера/автомата."""
+    for error in _iter_causes(exc):
+        if isinstance(error, (AvitoRateLimitError, AvitoCircuitOpenError)):
+            return error.retry_after
+        if isinstance(error, httpx.HTTPStatusError):
+            value = error.response.headers.get("Retry-After")
+            if value and value.isdigit():
+                return float(value)
+    return None
+
+
+def strip_service_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in data.items() if k not in _SERVICE_FIELDS}
+
+
+def queue_retry_or_dead_letter(
+    uow: RedisUnitOfWork,
+    stream_name: str,
+    dlq_stream: str,
+    data: Dict[str, Any],
+    exc: BaseException,
+    policy: RetryPolicy = AVITO_RETRY_POLICY
+) -> bool:
+    """
+    Добавляет в UoW постановку сообщения на повтор или в DLQ.
+    Возвращает True, если сообщение будет повторено.
+    """
+    attempt = int(data.get(ATTEMPT_FIELD, 0)) + 1
+    fields = strip_service_fields(data)
+
+    if is_retryable(exc) and attempt < policy.max_attempts:
+        delay = max(policy.delay_for(attempt), retry_after_seconds(exc) or 0)
+        member = json_dumps_str({
+            "stream": stream_name,
+            "fields": {**fields, ATTEMPT_FIELD: str(attempt)},
+            # Уникальность члена ZSET: одинаковые сообщения не должны схлопываться
+            "nonce": f"{time.time_ns()}-{random.getrandbits(32)}",
+        })
+        uow.pipeline.zadd(RETRY_SCHEDULE_KEY, {member: time.time() + delay})
+        logger.warning(
+            f"RETRY: {stream_name} attempt {attempt}/{policy.max_attempts} failed ({exc!r}). "
+            f"Next try in {delay:.1f}s."
+        )
+        return True
+
+    reason = "permanent error" if not is_retryable(exc) else "max attempts exceeded"
+    queue_dead_letter(uow, stream_name, dlq_stream, {**fields, ATTEMPT_FIELD: str(attempt)}, repr(exc))
+    logger.error(f"RETRY: {stream_name} message moved to {dlq_stream} ({reason}): {exc!r}")
+    return False
+
+
+def queue_dead_letter(uow: RedisUnitOfWork, stream_name: str, dlq_stream: str, fields: Dict[str, Any], error: str):
+    """Добавляет в UoW запись сообщения в DLQ. dlq_source - стрим, куда его вернет redrive_dead_letters()."""
+    uow.pipeline.xadd(dlq_stream, {
+        **fields,
+        DLQ_SOURCE_FIELD: stream_name,
+        DLQ_ERROR_FIELD: error[:1000],
+        DLQ_FAILED_AT_FIELD: str(int(time.time())),
+    })
+
+
+async def move_due_retries(redis_client: redis.Redis, batch_size: int = 100) -> int:
+    """Переносит созревшие повторы обратно в исходные стримы. Возвращает число перенесенных."""
+    return await redis_client.eval(_MOVE_DUE_SCRIPT, 1, RETRY_SCHEDULE_KEY, time.time(), batch_size)
+
+
+async def run_retry_scheduler(
+    redis_client: redis.Redis,
+    interval: float = 1.0,
+    sweepers: Sequence[Callable[[redis.Redis], Awaitable[int]]] = ()
+):
+    """
+    Стадия-планировщик повторов: периодически переносит созревшие сообщения.
+    sweepers - уборка модулей (раз в RETRY_SWEEP_INTERVAL), например возврат отложенных
+    за истекшим удержанием сообщений (modules/avito/queues.release_expired_chat_holds).
+    """
+    logger.info("Retry scheduler started.")
+    last_sweep = 0.0
+    while True:
+        try:
+            if sweepers and time.monotonic() - last_sweep >= RETRY_SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                for sweep in sweepers:
+                    await sweep(redis_client)
+            moved = await move_due_retries(redis_client)
+            if moved:
+                logger.info(f"RETRY: {moved} message(s) returned to their streams.")
+                # Могли остаться еще созревшие - не ждем следующего тика
+                continue
+        except Exception as e:
+            logger.error(f"Critical error in retry scheduler: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+async def list_dead_letters(redis_client: redis.Redis, dlq_stream: str, count: int = 50) -> List[Dict[str, Any]]:
+    """Последние сообщения из DLQ (новые первыми)."""
+    entries = await redis_client.xrevrange(dlq_stream, count=count)
+    return [{"id": entry_id, **fields} for entry_id, fields in entries]
+
+
+async def redrive_dead_letters(
+    redis_client: redis.Redis,
+    dlq_stream: str,
+    ids: Optional[List[str]] = None,
+    limit: int = 100
+) -> int:
+    """
+    Возвращает сообщения из DLQ в исходные стримы со сброшенным счетчиком попыток.
+    ids=None - самые старые `limit` сообщений. Возвращает число возвращенных.
+    """
+    if ids:
+        entries = []
+        for entry_id in ids:
+            entries.extend(await redis_client.xrange(dlq_stream, min=entry_id, max=entry_id))
+    else:
+        entries = await redis_client.xrange(dlq_stream, count=limit)
+
+    redriven = 0
+    async with RedisUnitOfWork(redis_client) as uow:
+        for entry_id, fields in entries:
+            source = fields.get(DLQ_SOURCE_FIELD)
+            if not source:
+                logger.warning(f"DLQ: entry {entry_id} in {dlq_stream} has no source stream, skipping.")
+                continue
+            uow.pipeline.xadd(source, strip_service_fields(fields))
+            uow.pipeline.xdel(dlq_stream, entry_id)
+            redriven += 1
+    logger.info(f"DLQ: re-drove {redriven} message(s) from {dlq_stream}.")
+    return redriven
@@ -1,4 +1,6 @@
 # src/shared/security.py
+import functools
+
 from cryptography.fernet import Fernet
 from .config import settings
 
@@ -14,6 +16,9 @@ def encrypt_token(token: str) -> str:
         return ""
     return fernet.encrypt(token.encode()).decode()
 
+# Одни и те же токены аккаунтов расшифровываются на каждый запрос к Avito;
+# Fernet проверяет HMAC и расшифровывает AES синхронно, в цикле событий
+@functools.lru_cache(maxsize=1024)
 def decrypt_token(encrypted_token: str) -> str:
     """Дешифрует строку и возвращает результат."""
     if not encrypted_token:
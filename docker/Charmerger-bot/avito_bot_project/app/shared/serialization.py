@@ -0,0 +1,30 @@
+# /app/shared/serialization.py
+"""
+Единый слой сериализации JSON для всего проекта.
+
+Все горячие пути (стримы Redis, ChatViewModel, tg_context, вебхуки) должны
+использовать эти функции вместо стандартного модуля `json`.
+Под капотом работает orjson: он в разы быстрее stdlib и сразу отдает bytes,
+которые Redis принимает без дополнительного кодирования.
+"""
+from typing import Any, Union
+
+import orjson
+
+# OPT_NON_STR_KEYS - совместимость с json.dumps, который молча приводил int-ключи к строкам
+_DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def json_dumps(obj: Any) -> bytes:
+    """Сериализует объект в JSON (UTF-8 bytes). Подходит для записи в Redis как есть."""
+    return orjson.dumps(obj, option=_DUMPS_OPTIONS)
+
+
+def json_dumps_str(obj: Any) -> str:
+    """То же, что `json_dumps`, но возвращает str (для API, которые не принимают bytes)."""
+    return orjson.dumps(obj, option=_DUMPS_OPTIONS).decode("utf-8")
+
+
+def json_loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Десериализует JSON из str или bytes."""
+    return orjson.loads(data)
@@ -0,0 +1,91 @@
+# /app/shared/stream_stats.py
+"""
+Стадия stream_metrics: состояние стримов и consumer groups для Prometheus.
+
+Раз в STREAM_METRICS_INTERVAL секунд одним пайплайном читает XLEN и XINFO GROUPS
+по стримам из MONITORED_STREAMS, вторым - сводку XPENDING по каждой группе:
+- stream_group_lag - сколько записей группа еще не получила (отставание стадии);
+- stream_group_pending - сколько получено, но не подтверждено (PEL);
+- stream_group_oldest_pending_seconds - возраст самой старой неподтвержденной записи
+  (растет, если сообщения "застряли" у упавшего потребителя).
+Это метрики Redis, а не процесса, поэтому стадия запускается в одном экземпляре.
+"""
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+import redis.asyncio as redis
+
+from shared.config import MONITORED_STREAMS, STREAM_METRICS_INTERVAL
+from shared.metrics import (
+    RETRY_SCHEDULED, STREAM_GROUP_CONSUMERS, STREAM_GROUP_LAG, STREAM_GROUP_OLDEST_PENDING_SECONDS,
+    STREAM_GROUP_PENDING, STREAM_LENGTH
+)
+from shared.retry import RETRY_SCHEDULE_KEY
+
+logger = logging.getLogger(__name__)
+
+
+def _id_age_seconds(message_id: Optional[str], now: float) -> float:
+    """Возраст записи по ее id (миллисекунды Unix-времени до дефиса)."""
+    if not message_id:
+        return 0.0
+    return max(0.0, now - int(message_id.split("-", 1)[0]) / 1000)
+
+
+async def collect_stream_stats(redis_client: redis.Redis, streams: List[str]):
+    """Один проход сбора метрик."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for stream_name in streams:
+            pipe.xlen(stream_name)
+            pipe.xinfo_groups(stream_name)
+        pipe.zcard(RETRY_SCHEDULE_KEY)
+        results = await pipe.execute(raise_on_error=False)
+
+    RETRY_SCHEDULED.set(results[-1] if isinstance(results[-1], int) else 0)
+    groups = []
+    for index, stream_name in enumerate(streams):
+        length, infos = results[2 * index], results[2 * index + 1]
+        # Стрима еще нет (no such key) - пропускаем
+        if isinstance(length, Exception) or isinstance(infos, Exception):
+            continue
+        STREAM_LENGTH.labels(stream=stream_name).set(length)
+        for info in infos:
+            group_name = info["name"]
+            groups.append((stream_name, group_name))
+            STREAM_GROUP_PENDING.labels(stream=stream_name, group=group_name).set(info.get("pending") or 0)
+            STREAM_GROUP_CONSUMERS.labels(stream=stream_name, group=group_name).set(info.get("consumers") or 0)
+            # lag есть в Redis >= 7 и бывает None, если его нельзя вычислить (после XDEL/XTRIM)
+            lag = info.get("lag")
+            if lag is not None:
+                STREAM_GROUP_LAG.labels(stream=stream_name, group=group_name).set(lag)
+
+    if not groups:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for stream_name, group_name in groups:
+            pipe.xpending(stream_name, group_name)
+        summaries = await pipe.execute(raise_on_error=False)
+
+    now = time.time()
+    for (stream_name, group_name), summary in zip(groups, summaries):
+        if isinstance(summary, Exception):
+            continue
+        oldest = summary.get("min") if summary.get("pending") else None
+        STREAM_GROUP_OLDEST_PENDING_SECONDS.labels(stream=stream_name, group=group_name).set(
+            _id_age_seconds(oldest, now)
+        )
+
+
+async def run_stream_stats_collector(redis_client: redis.Redis, interval: float = STREAM_METRICS_INTERVAL):
+    """Периодический сбор метрик стримов (стадия stream_metrics)."""
+    logger.info(f"Stream metrics collector started: {len(MONITORED_STREAMS)} streams every {interval}s.")
+    while True:
+        try:
+            await collect_stream_stats(redis_client, MONITORED_STREAMS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"STREAM_METRICS: Failed to collect stream stats: {e}", exc_info=True)
+        await asyncio.sleep(interval)
@@ -0,0 +1,677 @@
+# /app/shared/streams.py
+"""
+Общий цикл потребителя стрима Redis с упорядоченными "полосами" (lanes).
+
+Сообщения одного чата (ключ партиции) всегда попадают в одну и ту же полосу
+и обрабатываются строго по очереди (FIFO), а разные чаты обрабатываются
+параллельно в разных полосах. Это дает параллелизм между чатами без риска
+перепутать порядок сообщений внутри переписки.
+
+Гарантия порядка действует в пределах одного потребителя (процесса). Разные
+потребители одной consumer group получают сообщения вперемешку, поэтому стадию,
+для которой важен порядок, масштабируют числом полос, а не числом процессов.
+
+Для общих стримов входящих сообщений есть справедливый режим (tenant_func):
+сообщения раскладываются по очередям арендаторов (владельцев аккаунтов) и выдаются
+в полосы по deficit round robin, поэтому всплеск у одного пользователя не задерживает остальных.
+
+Блокирующее ожидание (XREADGROUP BLOCK) идет через отдельный пул соединений
+(shared/redis_client.get_stream_reader), чтобы не занимать соединения команд.
+
+Прочитанное, но не подтвержденное сообщение остается в PEL группы. Каждый потребитель
+при старте забирает свой PEL, а затем периодически - брошенные сообщения (PendingReclaimer),
+поэтому перезапуск процесса или упавший обработчик не теряют сообщений.
+"""
+import asyncio
+import functools
+import logging
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import redis.asyncio as redis
+
+from shared.config import settings, STREAM_DEAD_LETTER_STREAM, STREAM_RECLAIM_BATCH, STREAM_RECLAIM_INTERVAL
+from shared.db_stats import query_scope
+from shared.metrics import (
+    STREAM_HANDLER_SECONDS, STREAM_MESSAGES, STREAM_RECLAIMED, STREAM_TENANT_BACKLOG, STREAM_TENANT_DISPATCHED
+)
+from shared.redis_client import get_stream_reader
+from shared.redis_uow import RedisUnitOfWork
+from shared.retry import queue_dead_letter
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+# Обработчик сообщений из нескольких стримов: (стрим, id сообщения, данные)
+StreamMessageHandler = Callable[[str, str, Dict[str, Any]], Awaitable[None]]
+PartitionKeyFunc = Callable[[Dict[str, Any]], str]
+# Арендатор сообщения и его вес (доля в справедливом планировании)
+TenantFunc = Callable[[Dict[str, Any]], Tuple[str, float]]
+
+# Сколько сообщений может ждать в одной полосе, прежде чем чтение из стрима приостановится
+LANE_QUEUE_SIZE = 100
+# Сколько ждать при остановке уже начатые обработчики (docker stop дает 10 секунд до SIGKILL)
+LANE_DRAIN_TIMEOUT = 8.0
+# Наибольший возможный id записи: XREADGROUP после него ничего не выдает
+_MAX_STREAM_ID = "18446744073709551615-18446744073709551615"
+
+
+def chat_partition_key(data: Dict[str, Any]) -> str:
+    """
+    Ключ партиции по умолчанию - (аккаунт, чат).
+    Поддерживает все форматы сообщений в наших стримах:
+    Avito-стримы (account_id/db_account_id + chat_id) и Telegram-стримы (user_id или chat_id).
+    """
+    account = data.get("account_id") or data.get("db_account_id") or ""
+    chat = data.get("chat_id") or data.get("user_id") or ""
+    return f"{account}:{chat}"
+
+
+def lane_for_key(key: str, lanes: int) -> int:
+    """Стабильный номер полосы для ключа (одинаковый во всех процессах, в отличие от hash())."""
+    return zlib.crc32(key.encode("utf-8")) % lanes
+
+
+async def ensure_consumer_group(redis_client: redis.Redis, stream_name: str, group_name: str):
+    """Создает consumer group (и сам стрим), если их еще нет."""
+    try:
+        await redis_client.xgroup_create(stream_name, group_name, id="0", mkstream=True)
+        logger.info(f"Consumer group '{group_name}' created for stream '{stream_name}'.")
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def instrument_handler(handler: MessageHandler, stream_name: str, group_name: str) -> MessageHandler:
+    """Обработчик с метриками stream_handler_seconds, stream_messages_total (ok/error)
+    и учетом SQL-запросов на сообщение (db_scope_queries{kind="stream"})."""
+    histogram = STREAM_HANDLER_SECONDS.labels(stream=stream_name, group=group_name)
+
+    async def run(message_id: str, data: Dict[str, Any]):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with query_scope("stream", stream_name):
+                await handler(message_id, data)
+            outcome = "ok"
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            STREAM_MESSAGES.labels(stream=stream_name, group=group_name, outcome=outcome).inc()
+    return run
+
+
+class OrderedLanes:
+    """
+    Набор полос обработки. submit() блокируется, если целевая полоса переполнена -
+    так чтение из стрима естественно притормаживает под нагрузкой.
+    """
+
+    def __init__(
+        self,
+        handler: MessageHandler,
+        lanes: int = 1,
+        key_func: PartitionKeyFunc = chat_partition_key,
+        name: str = "lanes"
+    ):
+        if lanes < 1:
+            raise ValueError("Число полос должно быть >= 1.")
+        self.handler = handler
+        self.key_func = key_func
+        self.name = name
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=LANE_QUEUE_SIZE) for _ in range(lanes)]
+        self._tasks: List[asyncio.Task] = []
+        # id сообщений в очередях и в обработке: их не нужно забирать из PEL повторно
+        self._held: Set[str] = set()
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run_lane(index, queue), name=f"{self.name}-lane-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+
+    async def submit(self, message_id: str, data: Dict[str, Any], handler: Optional[MessageHandler] = None):
+        """Ставит сообщение в его полосу. handler - обработчик именно этого сообщения (по умолчанию общий)."""
+        lane = lane_for_key(self.key_func(data), len(self._queues))
+        self._held.add(message_id)
+        await self._queues[lane].put((message_id, data, handler or self.handler))
+
+    def reserve(self, message_ids: Iterable[str]):
+        """Отмечает прочитанную пачку сразу: submit() может ждать места в полосе."""
+        self._held.update(message_ids)
+
+    def holds(self, message_id: str) -> bool:
+        """Сообщение уже в полосе или обрабатывается."""
+        return message_id in self._held
+
+    async def join(self):
+        """Ждет, пока все уже отправленные в полосы сообщения будут обработаны."""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self, timeout: float = LANE_DRAIN_TIMEOUT):
+        """
+        Останавливает полосы. Сообщения, ждущие в очередях, не начинаются: они остаются в PEL
+        и вернутся в обработку после перезапуска (PendingReclaimer). Уже начатые обработчики
+        получают до timeout секунд, чтобы дойти до XACK, и только потом отменяются.
+        """
+        for queue in self._queues:
+            while not queue.empty():
+                message_id, _, _ = queue.get_nowait()
+                self._held.discard(message_id)
+                queue.task_done()
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: handlers did not finish in {timeout}s, cancelling them.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run_lane(self, index: int, queue: asyncio.Queue):
+        while True:
+            message_id, data, handler = await queue.get()
+            try:
+                await handler(message_id, data)
+            except Exception as e:
+                # Сообщение остается неподтвержденным в PEL: через STREAM_CLAIM_IDLE_SECONDS его
+                # вернет PendingReclaimer, после STREAM_MAX_DELIVERIES выдач - в DLQ
+                logger.error(f"{self.name}: lane {index} failed to process message {message_id}: {e}", exc_info=True)
+            finally:
+                self._held.discard(message_id)
+                queue.task_done()
+
+
+class PendingReclaimer:
+    """
+    Возвращает в обработку сообщения из PEL группы - выданные потребителю, но не подтвержденные.
+
+    - recover() - при старте потребителя: весь его собственный PEL. Это то, что было прочитано
+      до перезапуска и не подтверждено (буфер справедливого режима, очереди полос, прерванные
+      обработчики). Имя потребителя стабильно (WORKER_CONSUMER_NAME), поэтому после рестарта
+      PEL снова принадлежит ему.
+    - claim() - раз в STREAM_RECLAIM_INTERVAL: сообщения, не подтвержденные дольше
+      STREAM_CLAIM_IDLE_SECONDS. Свои, которых нет в памяти процесса (обработчик упал), и
+      сообщения "мертвых" потребителей - не обращавшихся к группе дольше того же порога.
+      Живой потребитель отмечается каждым проходом, даже если чтение стоит на заполненных
+      полосах, поэтому его сообщения не перехватываются. Мертвые потребители без сообщений
+      удаляются из группы.
+
+    Сообщения забираются через XCLAIM с проверкой простоя: одно сообщение не достанется
+    двум потребителям, счетчик выдач (times_delivered) растет с каждым возвратом. Сообщение,
+    выданное STREAM_MAX_DELIVERIES раз и так и не подтвержденное (обработчик падает на нем
+    каждый раз), уходит в STREAM_DEAD_LETTER_STREAM и подтверждается.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        stream_name: str,
+        group_name: str,
+        consumer_name: str,
+        submit: MessageHandler,
+        is_held: Callable[[str], bool],
+        idle_seconds: Optional[int] = None
+    ):
+        self.redis = redis_client
+        self.stream_name = stream_name
+        self.group_name = group_name
+        self.consumer_name = consumer_name
+        self.submit = submit
+        self.is_held = is_held
+        self.idle_ms = int((idle_seconds if idle_seconds is not None else settings.stream_claim_idle_seconds) * 1000)
+
+    async def recover(self) -> int:
+        """Свой PEL целиком (при старте). Возвращает число сообщений, отданных в обработку."""
+        return await self._claim_from(self.consumer_name, 0, "own")
+
+    async def claim(self) -> int:
+        """Один проход: свои брошенные сообщения и сообщения мертвых потребителей."""
+        # XREADGROUP после последнего возможного id ничего не выдает и не меняет счетчики,
+        # но обновляет время последнего обращения потребителя (idle в XINFO CONSUMERS)
+        await self.redis.xreadgroup(self.group_name, self.consumer_name, {self.stream_name: _MAX_STREAM_ID}, count=1)
+        claimed = await self._claim_from(self.consumer_name, self.idle_ms, "own")
+        for consumer in await self.redis.xinfo_consumers(self.stream_name, self.group_name):
+            name = consumer["name"]
+            if name == self.consumer_name or consumer["idle"] < self.idle_ms:
+                continue
+            if consumer["pending"]:
+                claimed += await self._claim_from(name, self.idle_ms, "dead")
+            else:
+                await self.redis.xgroup_delconsumer(self.stream_name, self.group_name, name)
+                logger.info(f"{self.stream_name}/{self.group_name}: removed idle consumer '{name}' with empty PEL.")
+        return claimed
+
+    async def run(self, interval: float = STREAM_RECLAIM_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                claimed = await self.claim()
+                if claimed:
+                    logger.warning(
+                        f"{self.consumer_name}: {claimed} unacknowledged message(s) of '{self.stream_name}' "
+                        f"returned to processing."
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.consumer_name}: failed to reclaim pending messages of '{self.stream_name}': {e}",
+                             exc_info=True)
+
+    async def _claim_from(self, owner: str, min_idle_ms: int, source: str) -> int:
+        claimed = 0
+        start = "-"
+        while True:
+            entries = await self.redis.xpending_range(
+                self.stream_name, self.group_name, min=start, max="+", count=STREAM_RECLAIM_BATCH,
+                consumername=owner, idle=min_idle_ms or None
+            )
+            deliveries = {
+                entry["message_id"]: entry["times_delivered"]
+                for entry in entries if not self.is_held(entry["message_id"])
+            }
+            if deliveries:
+                messages = await self.redis.xclaim(
+                    self.stream_name, self.group_name, self.consumer_name, min_idle_ms, list(deliveries)
+                )
+                for message_id, data in messages:
+                    if message_id is None:
+                        continue
+                    if not data:
+                        # Запись удалена из стрима (XTRIM/XDEL) - обрабатывать нечего
+                        await self.redis.xack(self.stream_name, self.group_name, message_id)
+                        continue
+                    if deliveries[message_id] >= settings.stream_max_deliveries:
+                        await self._dead_letter(message_id, data, deliveries[message_id])
+                        continue
+                    await self.submit(message_id, data)
+                    claimed += 1
+            if len(entries) < STREAM_RECLAIM_BATCH:
+                break
+            start = f"({entries[-1]['message_id']}"
+        if claimed:
+            STREAM_RECLAIMED.labels(stream=self.stream_name, group=self.group_name, source=source).inc(claimed)
+        return claimed
+
+
+    async def _dead_letter(self, message_id: str, data: Dict[str, Any], deliveries: int):
+        async with RedisUnitOfWork(self.redis) as uow:
+            queue_dead_letter(
+                uow, self.stream_name, STREAM_DEAD_LETTER_STREAM, data,
+                f"not acknowledged by group '{self.group_name}' after {deliveries} deliveries"
+            )
+            uow.pipeline.xack(self.stream_name, self.group_name, message_id)
+        logger.error(
+            f"{self.consumer_name}: message {message_id} of '{self.stream_name}' was delivered {deliveries} "
+            f"time(s) without acknowledgement and moved to {STREAM_DEAD_LETTER_STREAM}."
+        )
+
+
+async def start_reclaim(reclaimers: Sequence[PendingReclaimer]) -> asyncio.Task:
+    """Отдает в обработку свой PEL и запускает периодический возврат брошенных сообщений."""
+    for reclaimer in reclaimers:
+        try:
+            recovered = await reclaimer.recover()
+            if recovered:
+                logger.warning(
+                    f"{reclaimer.consumer_name}: {recovered} message(s) of '{reclaimer.stream_name}' "
+                    f"left unacknowledged before restart returned to processing."
+                )
+        except Exception as e:
+            # Не мешаем запуску: эти сообщения заберет следующий проход claim()
+            logger.error(f"{reclaimer.consumer_name}: failed to recover pending messages of "
+                         f"'{reclaimer.stream_name}': {e}", exc_info=True)
+
+    async def watch():
+        await asyncio.gather(*(reclaimer.run() for reclaimer in reclaimers))
+    return asyncio.create_task(watch(), name=f"{reclaimers[0].consumer_name}-reclaim")
+
+
+async def stop_reclaim(task: asyncio.Task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def run_stream_consumer(
+    redis_client: redis.Redis,
+    stream_name: str,
+    group_name: str,
+    consumer_name: str,
+    handler: MessageHandler,
+    lanes: int = 1,
+    key_func: PartitionKeyFunc = chat_partition_key,
+    batch_size: Optional[int] = None,
+    tenant_func: Optional[TenantFunc] = None,
+    read_ahead: int = 50
+):
+    """
+    Читает стрим в consumer group и раздает сообщения по полосам.
+    Подтверждение (XACK) остается за обработчиком: он сам решает, когда сообщение обработано.
+    С tenant_func включается справедливый режим (см. run_fair_stream_consumer).
+    """
+    if tenant_func is not None:
+        await run_fair_stream_consumer(
+            redis_client, stream_name, group_name, consumer_name, handler,
+            tenant_func, lanes=lanes, key_func=key_func, read_ahead=read_ahead
+        )
+        return
+
+    await ensure_consumer_group(redis_client, stream_name, group_name)
+
+    reader = get_stream_reader(redis_client)
+    workers = OrderedLanes(instrument_handler(handler, stream_name, group_name), lanes, key_func, name=consumer_name)
+    workers.start()
+    reclaim_task = await start_reclaim([PendingReclaimer(
+        redis_client, stream_name, group_name, consumer_name, workers.submit, workers.holds
+    )])
+    # Читаем пачкой, чтобы загрузить все полосы, но не набирать слишком много в память
+    count = batch_size or max(1, lanes * 2)
+    try:
+        while True:
+            try:
+                events = await reader.xreadgroup(
+                    group_name, consumer_name, {stream_name: ">"}, count=count, block=5000
+                )
+                if not events:
+                    continue
+
+                workers.reserve(message_id for _, messages in events for message_id, _ in messages)
+                for _, messages in events:
+                    for message_id, data in messages:
+                        await workers.submit(message_id, data)
+            except Exception as e:
+                logger.error(f"Critical error in consumer '{consumer_name}' of '{stream_name}': {e}", exc_info=True)
+                await asyncio.sleep(5)
+    finally:
+        await stop_reclaim(reclaim_task)
+        await workers.stop()
+
+
+class WeightedRoundRobin:
+    """
+    Плавный взвешенный round-robin (как в nginx): при весах 8/3/1 и непустых стримах
+    выдает их в пропорции 8:3:1 вперемешку, а не пачками. Порядок в списке - приоритет
+    при равенстве.
+    """
+
+    def __init__(self, weights: Sequence[Tuple[str, int]]):
+        self.weights = dict(weights)
+        self.order = [name for name, _ in weights]
+        self._current = {name: 0 for name in self.order}
+
+    def plan(self, slots: int, active: Sequence[str]) -> Dict[str, int]:
+        """Распределяет slots мест между активными стримами. Возвращает {стрим: сколько читать}."""
+        counts: Dict[str, int] = {}
+        total = sum(self.weights[name] for name in active)
+        for _ in range(slots if active else 0):
+            for name in active:
+                self._current[name] += self.weights[name]
+            best = max(active, key=lambda name: self._current[name])
+            self._current[best] -= total
+            counts[best] = counts.get(best, 0) + 1
+        return counts
+
+    def reset(self, name: str):
+        """Пустой стрим не копит "долг" и не получает очередь вне пропорции, когда в нем появятся сообщения."""
+        self._current[name] = 0
+
+
+async def _read_weighted(
+    redis_client: redis.Redis,
+    scheduler: WeightedRoundRobin,
+    group_name: str,
+    consumer_name: str,
+    slots: int
+) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Неблокирующее чтение до slots сообщений из нескольких стримов по весам.
+    Места, не занятые пустыми стримами, перераспределяются между остальными.
+    """
+    batch = []
+    active = list(scheduler.order)
+    while slots > 0 and active:
+        plan = scheduler.plan(slots, active)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for stream_name, count in plan.items():
+                pipe.xreadgroup(group_name, consumer_name, {stream_name: ">"}, count=count)
+            results = await pipe.execute()
+
+        for (stream_name, count), events in zip(plan.items(), results):
+            messages = events[0][1] if events else []
+            batch.extend((stream_name, message_id, data) for message_id, data in messages)
+            slots -= len(messages)
+            if len(messages) < count:
+                active.remove(stream_name)
+                scheduler.reset(stream_name)
+    return batch
+
+
+async def run_priority_stream_consumer(
+    redis_client: redis.Redis,
+    streams: Sequence[Tuple[str, int]],
+    group_name: str,
+    consumer_name: str,
+    handler: StreamMessageHandler,
+    lanes: int = 1,
+    key_func: PartitionKeyFunc = chat_partition_key,
+    max_in_flight: Optional[int] = None
+):
+    """
+    Потребитель нескольких стримов с весами: streams = [(стрим, вес), ...] по убыванию приоритета.
+
+    Когда все стримы заполнены, сообщения берутся в пропорции весов; когда часть стримов
+    пуста, их доля достается остальным. Из стримов читается не больше max_in_flight
+    сообщений сверх обрабатываемых (по умолчанию 2 на полосу): очередь копится в Redis,
+    а не в памяти полос, поэтому новое срочное сообщение ждет только уже взятые в работу.
+    Сообщения одного чата из разных стримов попадают в одну полосу и не обрабатываются параллельно.
+    """
+    for stream_name, _ in streams:
+        await ensure_consumer_group(redis_client, stream_name, group_name)
+
+    reader = get_stream_reader(redis_client)
+    limit = max_in_flight or max(1, lanes * 2)
+    scheduler = WeightedRoundRobin(streams)
+    in_flight = 0
+    slot_freed = asyncio.Event()
+
+    def make_handler(stream_name: str) -> MessageHandler:
+        instrumented = instrument_handler(functools.partial(handler, stream_name), stream_name, group_name)
+
+        async def run(message_id: str, data: Dict[str, Any]):
+            nonlocal in_flight
+            try:
+                await instrumented(message_id, data)
+            finally:
+                in_flight -= 1
+                slot_freed.set()
+        return run
+
+    handlers = {stream_name: make_handler(stream_name) for stream_name, _ in streams}
+    workers = OrderedLanes(handlers[streams[0][0]], lanes, key_func, name=consumer_name)
+    workers.start()
+
+    def make_submit(stream_name: str) -> MessageHandler:
+        async def submit(message_id: str, data: Dict[str, Any]):
+            nonlocal in_flight
+            in_flight += 1
+            await workers.submit(message_id, data, handlers[stream_name])
+        return submit
+
+    reclaim_task = await start_reclaim([
+        PendingReclaimer(redis_client, stream_name, group_name, consumer_name, make_submit(stream_name), workers.holds)
+        for stream_name, _ in streams
+    ])
+    try:
+        while True:
+            try:
+                if in_flight >= limit:
+                    slot_freed.clear()
+                    await slot_freed.wait()
+                    continue
+
+                batch = await _read_weighted(redis_client, scheduler, group_name, consumer_name, limit - in_flight)
+                if not batch:
+                    # Все стримы пусты - ждем первое сообщение в любом из них
+                    events = await reader.xreadgroup(
+                        group_name, consumer_name, {name: ">" for name, _ in streams}, count=1, block=5000
+                    )
+                    batch = [
+                        (stream_name, message_id, data)
+                        for stream_name, messages in (events or [])
+                        for message_id, data in messages
+                    ]
+
+                workers.reserve(message_id for _, message_id, _ in batch)
+                for stream_name, message_id, data in batch:
+                    in_flight += 1
+                    await workers.submit(message_id, data, handlers[stream_name])
+            except Exception as e:
+                logger.error(f"Critical error in priority consumer '{consumer_name}': {e}", exc_info=True)
+                await asyncio.sleep(5)
+    finally:
+        await stop_reclaim(reclaim_task)
+        await workers.stop()
+
+
+class DeficitRoundRobin:
+    """
+    Deficit round robin по арендаторам: у каждого своя очередь, за один круг арендатор
+    получает weight "кредитов" и может выдать столько сообщений. Арендатор с тысячей
+    сообщений в очереди получает ту же долю, что и арендатор с одним, с поправкой на вес.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, Deque[Any]] = {}
+        self._weights: Dict[str, float] = {}
+        self._deficit: Dict[str, float] = {}
+        self._active: Deque[str] = deque()
+        self.size = 0
+
+    def push(self, tenant: str, item: Any, weight: float = 1.0):
+        queue = self._queues.get(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+            self._deficit[tenant] = 0.0
+            self._active.append(tenant)
+        self._weights[tenant] = max(weight, 0.01)
+        queue.append(item)
+        self.size += 1
+
+    def pop(self) -> Optional[Tuple[str, Any]]:
+        """Следующее сообщение (арендатор, элемент) или None, если очереди пусты."""
+        while self._active:
+            tenant = self._active[0]
+            if self._deficit[tenant] >= 1:
+                queue = self._queues[tenant]
+                item = queue.popleft()
+                self._deficit[tenant] -= 1
+                self.size -= 1
+                if not queue:
+                    # Опустевшая очередь не копит кредиты на будущее
+                    self._active.popleft()
+                    del self._queues[tenant], self._deficit[tenant], self._weights[tenant]
+                return tenant, item
+            self._active.rotate(-1)
+            next_tenant = self._active[0]
+            self._deficit[next_tenant] += self._weights[next_tenant]
+        return None
+
+    def depth(self, tenant: str) -> int:
+        queue = self._queues.get(tenant)
+        return len(queue) if queue else 0
+
+
+async def run_fair_stream_consumer(
+    redis_client: redis.Redis,
+    stream_name: str,
+    group_name: str,
+    consumer_name: str,
+    handler: MessageHandler,
+    tenant_func: TenantFunc,
+    lanes: int = 1,
+    key_func: PartitionKeyFunc = chat_partition_key,
+    read_ahead: int = 50,
+    max_in_flight: Optional[int] = None
+):
+    """
+    Справедливый потребитель: читает из стрима до read_ahead сообщений вперед, раскладывает
+    их по арендаторам (tenant_func) и отдает в полосы по deficit round robin, держа в полосах
+    не больше max_in_flight сообщений (по умолчанию 2 на полосу).
+
+    Справедливость действует в пределах окна read_ahead: чем оно больше, тем глубже
+    в очередь "видно" чужие сообщения, но тем больше сообщений висит в PEL этого потребителя.
+    При остановке буфер не подтверждается и остается в PEL: его заберет recover() после
+    перезапуска (или claim() другого потребителя, если этот не вернется).
+    Порядок внутри чата сохраняется: сообщения одного чата принадлежат одному арендатору
+    и выдаются из его очереди по порядку.
+    """
+    await ensure_consumer_group(redis_client, stream_name, group_name)
+
+    reader = get_stream_reader(redis_client)
+    limit = max_in_flight or max(1, lanes * 2)
+    scheduler = DeficitRoundRobin()
+    # id сообщений в буфере планировщика (еще не отданных в полосы)
+    buffered: Set[str] = set()
+    in_flight = 0
+    slot_freed = asyncio.Event()
+
+    instrumented = instrument_handler(handler, stream_name, group_name)
+
+    def buffer(message_id: str, data: Dict[str, Any]):
+        tenant, weight = tenant_func(data)
+        scheduler.push(tenant, (message_id, data), weight)
+        buffered.add(message_id)
+        STREAM_TENANT_BACKLOG.labels(stream=stream_name, tenant=tenant).set(scheduler.depth(tenant))
+
+    async def buffer_reclaimed(message_id: str, data: Dict[str, Any]):
+        buffer(message_id, data)
+
+    async def run(message_id: str, data: Dict[str, Any]):
+        nonlocal in_flight
+        try:
+            await instrumented(message_id, data)
+        finally:
+            in_flight -= 1
+            slot_freed.set()
+
+    workers = OrderedLanes(run, lanes, key_func, name=consumer_name)
+    workers.start()
+    reclaim_task = await start_reclaim([PendingReclaimer(
+        redis_client, stream_name, group_name, consumer_name, buffer_reclaimed,
+        lambda message_id: message_id in buffered or workers.holds(message_id)
+    )])
+    try:
+        while True:
+            try:
+                if scheduler.size < read_ahead:
+                    # Есть чем заняться - не ждем новых сообщений, иначе блокируемся на чтении
+                    events = await reader.xreadgroup(
+                        group_name, consumer_name, {stream_name: ">"},
+                        count=read_ahead - scheduler.size,
+                        block=None if scheduler.size else 5000
+                    )
+                    for _, messages in events or []:
+                        for message_id, data in messages:
+                            buffer(message_id, data)
+
+                while in_flight < limit:
+                    entry = scheduler.pop()
+                    if entry is None:
+                        break
+                    tenant, (message_id, data) = entry
+                    buffered.discard(message_id)
+                    STREAM_TENANT_BACKLOG.labels(stream=stream_name, tenant=tenant).set(scheduler.depth(tenant))
+                    STREAM_TENANT_DISPATCHED.labels(stream=stream_name, tenant=tenant).inc()
+                    in_flight += 1
+                    await workers.submit(message_id, data)
+
+                if in_flight >= limit:
+                    slot_freed.clear()
+                    await slot_freed.wait()
+            except Exception as e:
+                logger.error(f"Critical error in fair consumer '{consumer_name}' of '{stream_name}': {e}", exc_info=True)
+                await asyncio.sleep(5)
+    finally:
+        await stop_reclaim(reclaim_task)
+        await workers.stop()
@@ -0,0 +1,170 @@
+# /app/shared/tracing.py
+"""
+Сквозная трассировка входящего сообщения: вебхук Avito -> карточка в Telegram.
+
+Вебхук (stamp_trace) добавляет в сообщение поля:
+- trace_id  - id трассы (32 hex, совместим с OpenTelemetry);
+- ingest_ts - когда вебхук принял сообщение (Unix-время, сек);
+- hop_ts    - когда сообщение последний раз поставлено в стрим;
+- span_id   - span предыдущего шага (родитель для следующего).
+Поля едут вместе с сообщением через avito:incoming:messages -> autoreply ->
+avito:processed:messages -> forwarder -> events:new_avito_message -> event_processor.
+
+Каждая стадия оборачивает обработчик в traced(handler, "стадия"): время ожидания в стриме
+попадает в pipeline_queue_wait_seconds{stage}, а перед XADD дальше вызывается
+mark_enqueued(data). Когда карточка отправлена, observe_delivery(data) пишет
+pipeline_ingest_to_delivery_seconds ("вебхук -> карточка") и
+pipeline_client_to_delivery_seconds ("клиент написал -> продавец видит карточку", по created_ts Avito).
+
+Если установлен opentelemetry-sdk и TRACING_EXPORTER не none, каждый шаг дополнительно
+становится span'ом одной трассы: otlp - в коллектор (OTEL_EXPORTER_OTLP_ENDPOINT),
+console - в stdout или в файл TRACING_FILE.
+
+Пока стадия обрабатывает сообщение, его trace_id доступен через current_trace_id() -
+так он попадает в JSON-логи (shared/logs.py).
+"""
+import functools
+import logging
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from shared.config import settings
+from shared.metrics import (
+    PIPELINE_CLIENT_TO_DELIVERY_SECONDS, PIPELINE_INGEST_TO_DELIVERY_SECONDS, PIPELINE_QUEUE_WAIT_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags
+    OTEL_AVAILABLE = True
+except ImportError:  # pragma: no cover - зависит от окружения
+    OTEL_AVAILABLE = False
+
+TRACE_ID_FIELD = "trace_id"
+SPAN_ID_FIELD = "span_id"
+INGEST_TS_FIELD = "ingest_ts"
+HOP_TS_FIELD = "hop_ts"
+
+_tracer = None
+# trace_id сообщения, которое сейчас обрабатывает стадия (для логов, см. shared/logs.py)
+_current_trace_id: ContextVar[Optional[str]] = ContextVar("current_trace_id", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    return _current_trace_id.get()
+
+
+def setup_tracing(service_name: str):
+    """Включает экспорт span'ов OpenTelemetry согласно TRACING_EXPORTER (один раз на процесс)."""
+    global _tracer
+    exporter_name = settings.tracing_exporter
+    if exporter_name == "none" or _tracer is not None:
+        return
+    if not OTEL_AVAILABLE:
+        logger.warning(f"TRACING_EXPORTER={exporter_name}, но opentelemetry-sdk не установлен - span'ы не экспортируются.")
+        return
+
+    if exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif exporter_name == "console":
+        out = open(settings.tracing_file, "a", encoding="utf-8") if settings.tracing_file else sys.stdout
+        exporter = ConsoleSpanExporter(out=out)
+    else:
+        raise ValueError(f"Неизвестный TRACING_EXPORTER '{exporter_name}': none, otlp или console.")
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("chatmerger.pipeline")
+    logger.info(f"Трассировка OpenTelemetry включена: {exporter_name}, сервис {service_name}.")
+
+
+def _float_field(data: Dict[str, Any], field: str) -> Optional[float]:
+    try:
+        return float(data[field])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def mark_enqueued(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Отмечает момент постановки сообщения в следующий стрим. Возвращает те же данные."""
+    if TRACE_ID_FIELD in data:
+        data[HOP_TS_FIELD] = f"{time.time():.6f}"
+    return data
+
+
+@contextmanager
+def _span(data: Dict[str, Any], name: str, attributes: Dict[str, Any]):
+    """Span OpenTelemetry, продолжающий трассу сообщения; его id записывается в data для следующего шага."""
+    if _tracer is None or TRACE_ID_FIELD not in data:
+        yield
+        return
+    try:
+        parent = SpanContext(
+            trace_id=int(data[TRACE_ID_FIELD], 16),
+            span_id=int(data.get(SPAN_ID_FIELD) or "1", 16),
+            is_remote=True,
+            trace_flags=TraceFlags(TraceFlags.SAMPLED),
+        )
+    except ValueError:
+        yield
+        return
+    context = trace.set_span_in_context(NonRecordingSpan(parent))
+    with _tracer.start_as_current_span(name, context=context, attributes=attributes) as span:
+        data[SPAN_ID_FIELD] = format(span.get_span_context().span_id, "016x")
+        yield
+
+
+def stamp_trace(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Начинает трассу входящего сообщения (вебхук Avito)."""
+    now = time.time()
+    data[TRACE_ID_FIELD] = uuid.uuid4().hex
+    data[INGEST_TS_FIELD] = f"{now:.6f}"
+    data[HOP_TS_FIELD] = data[INGEST_TS_FIELD]
+    _current_trace_id.set(data[TRACE_ID_FIELD])
+    with _span(data, "avito.webhook", {"avito.chat_id": data.get("chat_id", "")}):
+        pass
+    return data
+
+
+def traced(handler, stage: str):
+    """Обработчик стадии, который учитывает ожидание в стриме и создает span шага."""
+    wait_histogram = PIPELINE_QUEUE_WAIT_SECONDS.labels(stage=stage)
+
+    @functools.wraps(handler)
+    async def run(message_id: str, data: Dict[str, Any]):
+        hop_ts = _float_field(data, HOP_TS_FIELD)
+        wait = max(0.0, time.time() - hop_ts) if hop_ts is not None else None
+        if wait is not None:
+            wait_histogram.observe(wait)
+        attributes = {"messaging.message.id": message_id, "pipeline.queue_wait_ms": round((wait or 0) * 1000, 1)}
+        token = _current_trace_id.set(data.get(TRACE_ID_FIELD))
+        try:
+            with _span(data, f"pipeline.{stage}", attributes):
+                await handler(message_id, data)
+        finally:
+            _current_trace_id.reset(token)
+    return run
+
+
+def observe_delivery(data: Dict[str, Any]):
+    """Карточка доставлена в Telegram: полная задержка от вебхука и от отправки клиентом."""
+    now = time.time()
+    ingest_ts = _float_field(data, INGEST_TS_FIELD)
+    if ingest_ts is not None:
+        PIPELINE_INGEST_TO_DELIVERY_SECONDS.observe(max(0.0, now - ingest_ts))
+    created_ts = _float_field(data, "created_ts")
+    if created_ts:
+        PIPELINE_CLIENT_TO_DELIVERY_SECONDS.observe(max(0.0, now - created_ts))
+    if ingest_ts is not None:
+        logger.debug(f"TRACE {data.get(TRACE_ID_FIELD)}: delivered in {(now - ingest_ts) * 1000:.0f} ms after ingest.")
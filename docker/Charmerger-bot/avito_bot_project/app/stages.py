@@ -0,0 +1,131 @@
+# /app/stages.py
+"""
+Реестр стадий конвейера - фоновых потребителей стримов Redis.
+
+Используется в двух режимах:
+- main.py (RUN_WORKERS_IN_WEB=true): стадии крутятся в процессе веб-приложения, как раньше;
+- worker.py: отдельный процесс только со стадиями, без HTTP.
+
+Конкурентность стадии - это число упорядоченных полос обработки (см. shared/streams.py):
+сообщения разных чатов обрабатываются параллельно, сообщения одного чата - строго
+по очереди. Процессы, запущенные с одной стадией, делят сообщения через consumer group,
+но порядок внутри чата гарантируется только в пределах одного процесса.
+"""
+import asyncio
+import logging
+import socket
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import redis.asyncio as redis
+
+from shared.config import settings
+from shared.scheduler import start_scheduler, stop_scheduler
+from modules.telegram.bot import bot
+from modules.telegram.worker import (
+    start_telegram_sender_worker,
+    start_chat_action_worker,
+    start_event_processor_worker
+)
+from modules.telegram.updates import start_telegram_update_worker
+from modules.telegram.view_snapshots import run_view_checkpointer
+from modules.avito.worker import process_outgoing_messages, process_chat_actions
+from modules.avito.queues import release_expired_chat_holds
+from modules.autoreplies.worker import start_autoreply_worker
+from modules.avito.forwarder import avito_to_telegram_forwarder
+from shared.retry import run_retry_scheduler
+from shared.stream_stats import run_stream_stats_collector
+
+logger = logging.getLogger(__name__)
+
+StageRunner = Callable[[redis.Redis, str, int], Awaitable[None]]
+
+
+async def _run_scheduler(redis_client: redis.Redis, consumer_name: str, lanes: int):
+    """Планировщик APScheduler как стадия: должен работать ровно в одном процессе."""
+    start_scheduler()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        stop_scheduler()
+
+
+# Имя стадии -> корутина потребителя (redis_client, consumer_name, lanes)
+STAGES: Dict[str, StageRunner] = {
+    # Воркеры Telegram
+    "telegram_sender": lambda r, c, n: start_telegram_sender_worker(r, bot, consumer_name=c, lanes=n),
+    "event_processor": lambda r, c, n: start_event_processor_worker(r, bot, consumer_name=c, lanes=n),
+    "chat_actions": lambda r, c, n: start_chat_action_worker(r, bot, consumer_name=c, lanes=n),
+    # Обновления Telegram из стрима (TELEGRAM_UPDATES_MODE=stream)
+    "telegram_updates": lambda r, c, n: start_telegram_update_worker(r, consumer_name=c, lanes=n),
+    # Воркеры Avito
+    "avito_outgoing": lambda r, c, n: process_outgoing_messages(r, consumer_name=c, lanes=n),
+    "avito_actions": lambda r, c, n: process_chat_actions(r, consumer_name=c, lanes=n),
+    "forwarder": lambda r, c, n: avito_to_telegram_forwarder(r, consumer_name=c, lanes=n),
+    # Воркер Автоответов
+    "autoreply": lambda r, c, n: start_autoreply_worker(r, consumer_name=c, lanes=n),
+    # Возврат отложенных повторов (delay set) в исходные стримы
+    # и сообщений, отложенных за истекшим удержанием чата
+    "retry_scheduler": lambda r, c, n: run_retry_scheduler(r, sweepers=[release_expired_chat_holds]),
+    # Длина стримов, отставание и PEL consumer groups для Prometheus
+    "stream_metrics": lambda r, c, n: run_stream_stats_collector(r),
+    # Копии карточек чатов из Redis в PostgreSQL (chat_view_snapshots)
+    "view_checkpointer": lambda r, c, n: run_view_checkpointer(r),
+    # Планировщик
+    "scheduler": _run_scheduler,
+}
+
+# Стадии, которые нельзя запускать в нескольких экземплярах
+SINGLETON_STAGES = {"scheduler", "retry_scheduler", "stream_metrics", "view_checkpointer"}
+
+
+def parse_stages(spec: str, default_concurrency: int) -> List[Tuple[str, int]]:
+    """
+    Разбирает строку вида "all" или "autoreply=4,forwarder,event_processor=2"
+    в список (стадия, число полос).
+    """
+    result: Dict[str, int] = {}
+    for part in (p.strip() for p in spec.split(",")):
+        if not part:
+            continue
+        name, _, concurrency = part.partition("=")
+        concurrency = int(concurrency) if concurrency else default_concurrency
+        names = list(STAGES) if name == "all" else [name]
+        for stage in names:
+            if stage not in STAGES:
+                raise ValueError(f"Неизвестная стадия '{stage}'. Доступны: {', '.join(STAGES)}")
+            if concurrency < 1:
+                raise ValueError(f"Конкурентность стадии '{stage}' должна быть >= 1.")
+            result[stage] = 1 if stage in SINGLETON_STAGES else concurrency
+    return list(result.items())
+
+
+def start_stages(
+    redis_client: redis.Redis,
+    stages: List[Tuple[str, int]],
+    consumer_prefix: str = ""
+) -> List[asyncio.Task]:
+    """
+    Запускает по одному потребителю на стадию (задача asyncio), внутри - concurrency полос.
+    Имена потребителей: {prefix}-{stage}, prefix - consumer_prefix, WORKER_CONSUMER_NAME или имя хоста.
+    """
+    prefix = consumer_prefix or settings.worker_consumer_name
+    if not prefix:
+        prefix = socket.gethostname()
+        logger.warning(
+            f"WORKER_CONSUMER_NAME не задан, потребители называются по имени хоста '{prefix}'. "
+            f"Если оно меняется при перезапуске, неподтвержденные сообщения вернутся в обработку "
+            f"только через STREAM_CLAIM_IDLE_SECONDS."
+        )
+    tasks = []
+    for stage, concurrency in stages:
+        consumer_name = f"{prefix}-{stage}"
+        tasks.append(asyncio.create_task(STAGES[stage](redis_client, consumer_name, concurrency), name=consumer_name))
+        logger.info(f"Стадия '{stage}' запущена: {concurrency} полос(ы).")
+    return tasks
+
+
+async def stop_stages(tasks: List[asyncio.Task]):
+    """Останавливает задачи стадий и дожидается их завершения."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,25 @@
+# /app/tests/conftest.py
+"""
+Общая настройка тестов. Запуск из каталога /app: python -m pytest tests
+
+Обязательные переменные окружения (shared/config.py) получают тестовые значения,
+если не заданы: тесты не ходят ни в Telegram, ни в Avito, ни в PostgreSQL/Redis.
+"""
+import base64
+import os
+
+_TEST_ENV = {
+    "TELEGRAM_BOT_TOKEN": "123456:test-token",
+    "TELEGRAM_BOT_USERNAME": "test_bot",
+    "AVITO_CLIENT_ID": "test",
+    "AVITO_CLIENT_SECRET": "test",
+    "AVITO_WEBHOOK_SECRET": "test",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_DB": "test",
+    "ENCRYPTION_KEY": base64.urlsafe_b64encode(b"0" * 32).decode(),
+    "JWT_SECRET_KEY": "test",
+}
+
+for _name, _value in _TEST_ENV.items():
+    os.environ.setdefault(_name, _value)
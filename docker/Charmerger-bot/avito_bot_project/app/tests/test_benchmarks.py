@@ -0,0 +1,17 @@
+# /app/tests/test_benchmarks.py
+"""
+Случаи benchmarks/hotpaths.py выполняются по одному разу: бенчмарк не сломан и меряет то,
+что заявлено (build_cases сам проверяет initData и то, что совпадает только последнее правило).
+Время здесь не меряется - для этого python -m benchmarks.hotpaths --check.
+"""
+import pytest
+
+from benchmarks.hotpaths import build_cases
+
+
+CASES = build_cases()
+
+
+@pytest.mark.parametrize("func", [func for _, func in CASES], ids=[name for name, _ in CASES])
+def test_hotpath_case_runs(func):
+    func()
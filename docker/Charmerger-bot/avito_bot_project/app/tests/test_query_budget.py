@@ -0,0 +1,105 @@
+# /app/tests/test_query_budget.py
+"""
+Бюджеты SQL-запросов горячих путей (shared/db_stats.assert_query_budget).
+
+Запросы выполняются в SQLite в памяти (нужен aiosqlite): считается их число, а не планы -
+планы PostgreSQL проверяет tests/test_query_plans.py. Если тест упал, в сообщении
+AssertionError перечислены повторяющиеся выражения - обычно это N+1 в цикле.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import shared.database as database
+from db_models import AvitoAccount, Base, ForwardingRule, User
+from shared.db_stats import assert_query_budget, install_query_hooks
+
+pytest.importorskip("aiosqlite")
+
+OWNER_TELEGRAM_ID = 700000001
+AVITO_USER_ID = 500001
+
+
+async def seed(session: AsyncSession, rules: int) -> User:
+    owner = User(telegram_id=OWNER_TELEGRAM_ID, first_name="Владелец", has_agreed_to_terms=True)
+    session.add(owner)
+    await session.flush()
+    for index in range(3):
+        session.add(AvitoAccount(
+            user_id=owner.id, avito_user_id=AVITO_USER_ID + index, alias=f"Аккаунт {index}",
+            encrypted_oauth_token="-", encrypted_refresh_token="-",
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+        ))
+    for index in range(rules):
+        session.add(ForwardingRule(
+            owner_id=owner.id, custom_rule_name=f"Помощник {index}",
+            target_telegram_id=800000000 + index if index % 2 else None,
+            permissions={"can_reply": bool(index % 3), "allowed_accounts": None},
+        ))
+    await session.commit()
+    return owner
+
+
+def run_with_database(monkeypatch, scenario, rules: int = 10):
+    """Подменяет движки shared/database на SQLite и выполняет scenario(owner)."""
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        install_query_hooks(engine, "test")
+        makers = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        monkeypatch.setattr(database, "async_session_maker", makers)
+        monkeypatch.setattr(database, "read_session_maker", makers)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all, tables=[
+                    User.__table__, AvitoAccount.__table__, ForwardingRule.__table__,
+                ])
+            async with makers() as session:
+                owner = await seed(session, rules)
+            return await scenario(owner)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("rules", [1, 25])
+def test_forwarding_rules_api_single_query(monkeypatch, rules):
+    from modules.webapp.routers import api_get_forwarding_rules
+
+    async def scenario(owner):
+        with assert_query_budget(1):
+            return await api_get_forwarding_rules(current_user=owner)
+
+    response = run_with_database(monkeypatch, scenario, rules)
+    assert len(response) == rules
+
+
+@pytest.mark.parametrize("rules", [1, 25])
+def test_forwarder_owner_lookup_does_not_grow_with_rules(monkeypatch, rules):
+    from modules.avito.forwarder import load_forwarding_owner
+
+    async def scenario(owner):
+        # Владелец + аккаунты + правила (selectinload), независимо от числа правил
+        with assert_query_budget(3):
+            loaded = await load_forwarding_owner(AVITO_USER_ID)
+        # Связи уже загружены: обращение к ним не выполняет запросов
+        with assert_query_budget(0):
+            return loaded, len(loaded.avito_accounts), len(loaded.owned_forwarding_rules)
+
+    loaded, accounts, loaded_rules = run_with_database(monkeypatch, scenario, rules)
+    assert loaded.telegram_id == OWNER_TELEGRAM_ID
+    assert (accounts, loaded_rules) == (3, rules)
+
+
+def test_query_budget_reports_overrun(monkeypatch):
+    from modules.avito.forwarder import load_forwarding_owner
+
+    async def scenario(owner):
+        with pytest.raises(AssertionError, match="SQL-запросов при бюджете 1"):
+            with assert_query_budget(1):
+                await load_forwarding_owner(AVITO_USER_ID)
+
+    run_with_database(monkeypatch, scenario)
@@ -0,0 +1,114 @@
+# /app/tests/test_query_plans.py
+"""
+Планы горячих запросов: каждый должен идти по индексу, а не полным чтением таблицы.
+
+Нужен тестовый PostgreSQL: URL в TEST_DATABASE_URL (postgresql+asyncpg://...). Без него или
+если база недоступна, тесты пропускаются. Таблицы, которых нет, создаются из db_models
+(create_all); на базе после alembic upgrade head проверяются индексы миграций.
+
+На маленькой тестовой базе планировщик честно выбирает Seq Scan, поэтому запросы
+объясняются с enable_seqscan=off: полное чтение остается в плане, только если
+подходящего индекса нет.
+
+Запросы повторяют места в коде (указаны в HOT_QUERIES); новый горячий запрос - новая запись.
+"""
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+from sqlalchemy import and_, desc, func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from db_models import (
+    AutoReplyRule, AvitoAccount, Base, ChatNote, ForwardingRule, MessageLog, Transaction, User
+)
+from shared.serialization import json_loads
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+CONNECT_TIMEOUT = 5
+
+# (имя, где используется, построитель запроса)
+HOT_QUERIES: List[Tuple[str, str, Callable[[], Any]]] = [
+    ("autoreply_active_rules", "modules/autoreplies/engine.py: find_and_apply_rule",
+     lambda: select(AutoReplyRule).where(AutoReplyRule.account_id == 1, AutoReplyRule.is_active == True)),
+    ("autoreplies_for_account", "modules/database/crud.py: get_autoreplies_for_account",
+     lambda: select(AutoReplyRule).join(AutoReplyRule.account)
+     .where(AutoReplyRule.account_id == 1, AvitoAccount.user_id == 1).order_by(AutoReplyRule.name)),
+    ("user_autoreplies", "modules/database/crud.py: get_user_autoreplies",
+     lambda: select(AutoReplyRule).join(AutoReplyRule.account)
+     .where(AvitoAccount.user_id == 1).order_by(AutoReplyRule.name)),
+    ("forwarding_rules_for_owner", "modules/database/crud.py: get_forwarding_rules_for_owner",
+     lambda: select(ForwardingRule).where(ForwardingRule.owner_id == 1)),
+    ("forwarding_rules_count", "modules/billing/service.py: лимит помощников",
+     lambda: select(func.count(ForwardingRule.id)).where(ForwardingRule.owner_id == 1)),
+    ("accounts_for_user", "modules/billing/service.py, modules/database/crud.py",
+     lambda: select(AvitoAccount).where(AvitoAccount.user_id == 1)),
+    ("tenant_by_avito_user", "modules/avito/tenants.py: resolve_tenant",
+     lambda: select(User.id, User.tariff_plan).join(AvitoAccount, AvitoAccount.user_id == User.id)
+     .where(AvitoAccount.avito_user_id == 1)),
+    ("user_transactions", "modules/database/crud.py: get_user_transactions",
+     lambda: select(Transaction).where(Transaction.user_id == 1).order_by(desc(Transaction.timestamp)).limit(20)),
+    ("account_stats", "modules/database/crud.py: get_account_stats",
+     lambda: select(MessageLog.direction, func.count(MessageLog.id))
+     .where(and_(MessageLog.account_id == 1, MessageLog.timestamp >= func.now() - text("interval '7 days'")))
+     .group_by(MessageLog.direction)),
+    ("chat_notes", "modules/database/crud.py: заметки чата",
+     lambda: select(ChatNote).where(ChatNote.account_id == 1, ChatNote.chat_id == "u2i-check")),
+    ("notes_by_author", "каскадное удаление пользователя (chat_notes.author_id)",
+     lambda: select(ChatNote).where(ChatNote.author_id == 1)),
+]
+
+
+def _compile(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def _plan_nodes(node: Dict[str, Any]):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+async def _prepare_schema(url: str):
+    engine = create_async_engine(url, connect_args={"timeout": CONNECT_TIMEOUT})
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    finally:
+        await engine.dispose()
+
+
+async def _explain(url: str, sql: str) -> Dict[str, Any]:
+    engine = create_async_engine(url)
+    try:
+        async with engine.connect() as conn:
+            # SET LOCAL действует до конца транзакции - откатываем ее после запроса
+            async with conn.begin() as transaction:
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+                raw = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar_one()
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+    return (json_loads(raw) if isinstance(raw, (str, bytes)) else raw)[0]["Plan"]
+
+
+@pytest.fixture(scope="module")
+def database_url() -> str:
+    if not DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан - планы запросов не проверяются.")
+    pytest.importorskip("asyncpg")
+    try:
+        asyncio.run(_prepare_schema(DATABASE_URL))
+    except (OSError, asyncio.TimeoutError) as e:
+        pytest.skip(f"PostgreSQL из TEST_DATABASE_URL недоступен: {e}")
+    return DATABASE_URL
+
+
+@pytest.mark.parametrize("build,location", [(q[2], q[1]) for q in HOT_QUERIES], ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(database_url, build, location):
+    sql = _compile(build())
+    nodes = list(_plan_nodes(asyncio.run(_explain(database_url, sql))))
+    seq_scans = sorted({node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"})
+    assert not seq_scans, f"Полное чтение {', '.join(seq_scans)} ({location}):\n{sql}"
@@ -0,0 +1,180 @@
+# /app/tests/test_streams.py
+"""
+Полосы и планировщики shared/streams.py: порядок внутри чата, параллелизм между чатами,
+доли WeightedRoundRobin и DeficitRoundRobin.
+"""
+import asyncio
+import random
+from collections import Counter, defaultdict
+
+import pytest
+
+from shared.streams import DeficitRoundRobin, OrderedLanes, WeightedRoundRobin, lane_for_key
+
+
+def make_burst(chats: int, per_chat: int, seed: int = 7):
+    """Сообщения нескольких чатов вперемешку, как их отдает XREADGROUP при всплеске."""
+    messages = [(f"chat-{chat}", seq) for chat in range(chats) for seq in range(per_chat)]
+    random.Random(seed).shuffle(messages)
+    # Перемешивание ломает порядок внутри чата - восстанавливаем его, сохраняя чередование чатов
+    next_seq = defaultdict(int)
+    burst = []
+    for chat_id, _ in messages:
+        burst.append((chat_id, next_seq[chat_id]))
+        next_seq[chat_id] += 1
+    return burst
+
+
+async def run_lanes(burst, lanes: int, handle_time: float = 0.002):
+    """Прогоняет пачку через OrderedLanes. Возвращает порядок обработки по чатам и пик параллелизма."""
+    seen = defaultdict(list)
+    active_by_chat = Counter()
+    active = 0
+    peak = 0
+
+    async def handler(message_id: str, data: dict):
+        nonlocal active, peak
+        chat_id = data["chat_id"]
+        active_by_chat[chat_id] += 1
+        active += 1
+        peak = max(peak, active)
+        assert active_by_chat[chat_id] == 1, f"Чат {chat_id} обрабатывается параллельно"
+        # Разная длительность: без полос более поздние сообщения обгоняли бы ранние
+        await asyncio.sleep(handle_time * random.random())
+        seen[chat_id].append(int(data["seq"]))
+        active_by_chat[chat_id] -= 1
+        active -= 1
+
+    workers = OrderedLanes(handler, lanes=lanes, name="test")
+    workers.start()
+    try:
+        for index, (chat_id, seq) in enumerate(burst):
+            await workers.submit(f"{index}-0", {"account_id": "1", "chat_id": chat_id, "seq": str(seq)})
+        await workers.join()
+    finally:
+        await workers.stop()
+    return seen, peak
+
+
+def test_lane_for_key_is_stable():
+    assert lane_for_key("1:chat-1", 8) == lane_for_key("1:chat-1", 8)
+    assert all(0 <= lane_for_key(f"1:chat-{i}", 8) < 8 for i in range(100))
+
+
+@pytest.mark.parametrize("lanes", [1, 4, 16])
+def test_ordered_lanes_keep_fifo_within_chat(lanes):
+    burst = make_burst(chats=20, per_chat=15)
+    seen, _ = asyncio.run(run_lanes(burst, lanes))
+
+    assert sum(len(seqs) for seqs in seen.values()) == len(burst)
+    for chat_id, seqs in seen.items():
+        assert seqs == list(range(15)), f"Нарушен порядок в {chat_id}: {seqs}"
+
+
+def test_ordered_lanes_process_chats_in_parallel():
+    burst = make_burst(chats=20, per_chat=5)
+    lanes = 4
+    busy_lanes = len({lane_for_key(f"1:{chat_id}", lanes) for chat_id, _ in burst})
+
+    _, peak = asyncio.run(run_lanes(burst, lanes, handle_time=0.01))
+
+    assert busy_lanes > 1
+    assert 1 < peak <= lanes
+
+
+def test_ordered_lanes_single_lane_is_sequential():
+    _, peak = asyncio.run(run_lanes(make_burst(chats=5, per_chat=5), lanes=1))
+    assert peak == 1
+
+
+def test_ordered_lanes_stop_leaves_queued_messages():
+    async def scenario():
+        started, finished = [], []
+
+        async def handler(message_id: str, data: dict):
+            started.append(message_id)
+            await asyncio.sleep(0.05)
+            finished.append(message_id)
+
+        workers = OrderedLanes(handler, lanes=1, name="test")
+        workers.start()
+        for index in range(5):
+            await workers.submit(str(index), {"chat_id": "chat-1"})
+        await asyncio.sleep(0.01)
+        await workers.stop(timeout=1)
+        return started, finished, workers
+
+    started, finished, workers = asyncio.run(scenario())
+    # Начатый обработчик доработал, остальные не начинались и остаются в PEL
+    assert started == finished == ["0"]
+    assert not any(workers.holds(str(index)) for index in range(5))
+
+
+def test_weighted_round_robin_shares_by_weight():
+    scheduler = WeightedRoundRobin([("high", 8), ("normal", 3), ("low", 1)])
+
+    assert scheduler.plan(12, ["high", "normal", "low"]) == {"high": 8, "normal": 3, "low": 1}
+    assert scheduler.plan(120, ["high", "normal", "low"]) == {"high": 80, "normal": 30, "low": 10}
+
+
+def test_weighted_round_robin_interleaves_instead_of_batches():
+    scheduler = WeightedRoundRobin([("high", 2), ("low", 1)])
+    sequence = [next(iter(scheduler.plan(1, ["high", "low"]))) for _ in range(6)]
+
+    assert sequence == ["high", "low", "high", "high", "low", "high"]
+
+
+def test_weighted_round_robin_gives_idle_share_to_others():
+    scheduler = WeightedRoundRobin([("high", 8), ("normal", 3), ("low", 1)])
+
+    assert scheduler.plan(8, ["normal", "low"]) == {"normal": 6, "low": 2}
+    assert scheduler.plan(5, ["low"]) == {"low": 5}
+    assert scheduler.plan(5, []) == {}
+
+
+def test_deficit_round_robin_equal_weights_alternate():
+    scheduler = DeficitRoundRobin()
+    for seq in range(6):
+        scheduler.push("flood", ("flood", seq))
+    for seq in range(2):
+        scheduler.push("small", ("small", seq))
+
+    order = []
+    while (entry := scheduler.pop()) is not None:
+        order.append(entry[1])
+
+    # Арендатор с двумя сообщениями не ждет, пока разберут весь поток соседа: очереди чередуются
+    assert Counter(tenant for tenant, _ in order[:4]) == {"flood": 2, "small": 2}
+    assert [item for item in order if item[0] == "flood"] == [("flood", seq) for seq in range(6)]
+    assert [item for item in order if item[0] == "small"] == [("small", seq) for seq in range(2)]
+    assert scheduler.size == 0
+    assert scheduler.pop() is None
+
+
+def test_deficit_round_robin_respects_weights():
+    scheduler = DeficitRoundRobin()
+    for seq in range(30):
+        scheduler.push("expert", seq, weight=4.0)
+        scheduler.push("start", seq, weight=1.0)
+
+    first = [scheduler.pop()[0] for _ in range(25)]
+    counts = Counter(first)
+
+    assert counts["expert"] == 20 and counts["start"] == 5
+    assert scheduler.size == 35
+    assert scheduler.depth("expert") == 10 and scheduler.depth("start") == 25
+
+
+def test_deficit_round_robin_drained_tenant_does_not_bank_credit():
+    scheduler = DeficitRoundRobin()
+    # Вес 4 при одном сообщении: три неиспользованных кредита не должны сохраниться
+    scheduler.push("a", 0, weight=4.0)
+    assert scheduler.pop() == ("a", 0)
+    assert scheduler.depth("a") == 0
+
+    for seq in range(4):
+        scheduler.push("b", seq)
+        scheduler.push("a", seq + 1, weight=1.0)
+    # Вернувшийся "a" чередуется с "b", а не выдает три сообщения подряд
+    order = [scheduler.pop()[0] for _ in range(8)]
+    assert all(order[i] != order[i + 1] for i in range(len(order) - 1)), order
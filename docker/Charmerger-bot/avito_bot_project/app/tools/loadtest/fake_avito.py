@@ -0,0 +1,147 @@
+# /app/tools/loadtest/fake_avito.py
+"""
+Заглушка API мессенджера Avito для нагрузочных тестов (без сети).
+
+Запуск (из каталога /app):
+    python -m tools.loadtest.fake_avito --port 8081 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+
+Приложение направляется сюда через AVITO_API_BASE_URL=http://localhost:8081.
+Поддержаны эндпоинты, которыми пользуется бот: токен, /core/v1/accounts/self, подписка
+на вебхук, список, карточка и история чата, отправка текста и изображений, загрузка изображений,
+прочтение, блокировка, черный список и голосовые. Ответы синтетические, но той же формы, что у Avito.
+GET /_stats - сколько запросов какого вида пришло (для отчета генератора нагрузки).
+"""
+import argparse
+import time
+import uuid
+import zlib
+from collections import Counter
+
+from fastapi import FastAPI, Request
+
+from .faults import FaultProfile, add_fault_arguments, install_faults, profile_from_args
+
+
+def create_app(profile: FaultProfile) -> FastAPI:
+    app = FastAPI(title="Fake Avito API")
+    install_faults(app, profile)
+    stats: Counter = Counter()
+
+    def chat_info(user_id: int, chat_id: str) -> dict:
+        return {
+            "id": chat_id,
+            "users": [
+                {"id": user_id, "name": "Продавец"},
+                {"id": zlib.crc32(chat_id.encode()), "name": f"Клиент {chat_id[-6:]}"},
+            ],
+            "context": {"type": "item", "value": {
+                "id": 1, "title": "Тестовое объявление", "price_string": "1 000 ₽",
+                "url": "https://www.avito.ru/item/1",
+            }},
+            "created": int(time.time()),
+            "updated": int(time.time()),
+        }
+
+    @app.post("/token")
+    async def token():
+        stats["token"] += 1
+        return {
+            "access_token": uuid.uuid4().hex, "refresh_token": uuid.uuid4().hex,
+            "expires_in": 86400, "token_type": "Bearer",
+        }
+
+    @app.get("/core/v1/accounts/self")
+    async def account_self():
+        stats["self"] += 1
+        return {"id": 1, "name": "Fake seller", "email": "seller@example.com"}
+
+    @app.post("/messenger/v3/webhook")
+    async def subscribe_webhook():
+        stats["webhook_subscribe"] += 1
+        return {"ok": True}
+
+    @app.get("/messenger/v2/accounts/{user_id}/chats")
+    async def chats(user_id: int, limit: int = 100, offset: int = 0):
+        stats["chats"] += 1
+        return {"chats": [chat_info(user_id, f"fake-chat-{offset + i}") for i in range(min(limit, 5))]}
+
+    @app.get("/messenger/v2/accounts/{user_id}/chats/{chat_id}")
+    async def chat(user_id: int, chat_id: str):
+        stats["chat_info"] += 1
+        return chat_info(user_id, chat_id)
+
+    @app.get("/messenger/v3/accounts/{user_id}/chats/{chat_id}/messages/")
+    async def messages(user_id: int, chat_id: str, limit: int = 25):
+        stats["messages"] += 1
+        return [{
+            "id": f"{chat_id}-{i}", "author_id": user_id if i % 2 else 0, "created": int(time.time()) - i * 60,
+            "direction": "out" if i % 2 else "in", "type": "text", "content": {"text": f"Сообщение {i}"},
+        } for i in range(min(limit, 5))]
+
+    @app.post("/messenger/v1/accounts/{user_id}/chats/{chat_id}/messages")
+    async def send_message(user_id: int, chat_id: str):
+        stats["send_text"] += 1
+        return {"id": uuid.uuid4().hex, "created": int(time.time()), "direction": "out", "type": "text"}
+
+    @app.post("/messenger/v1/accounts/{user_id}/chats/{chat_id}/messages/image")
+    async def send_image(user_id: int, chat_id: str):
+        stats["send_image"] += 1
+        return {"id": uuid.uuid4().hex, "created": int(time.time()), "direction": "out", "type": "image"}
+
+    @app.post("/messenger/v1/accounts/{user_id}/uploadImages")
+    async def upload_images(user_id: int):
+        stats["upload"] += 1
+        image_id = uuid.uuid4().hex
+        return {image_id: {"1280x960": f"https://img.example.com/{image_id}.jpg"}}
+
+    @app.post("/messenger/v1/accounts/{user_id}/chats/{chat_id}/read")
+    async def read(user_id: int, chat_id: str):
+        stats["read"] += 1
+        return {"ok": True}
+
+    @app.post("/messenger/v1/accounts/{user_id}/chats/{chat_id}/block")
+    async def block(user_id: int, chat_id: str):
+        stats["block"] += 1
+        return {"ok": True}
+
+    @app.post("/messenger/v2/accounts/{user_id}/blacklist")
+    async def blacklist(user_id: int):
+        stats["blacklist"] += 1
+        return {"ok": True}
+
+    @app.delete("/messenger/v2/accounts/{user_id}/blacklist/{blocked_user_id}")
+    async def unblacklist(user_id: int, blocked_user_id: int):
+        stats["unblacklist"] += 1
+        return {"ok": True}
+
+    @app.get("/messenger/v1/accounts/{user_id}/getVoiceFiles")
+    async def voice_files(request: Request, user_id: int):
+        stats["voice"] += 1
+        voice_ids = [v for v in request.query_params.get("voice_ids", "").split(",") if v]
+        return {"voices_urls": {voice_id: f"https://voice.example.com/{voice_id}.mp4" for voice_id in voice_ids}}
+
+    @app.get("/_stats")
+    async def get_stats():
+        return dict(stats)
+
+    @app.post("/_reset")
+    async def reset():
+        stats.clear()
+        return {"ok": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка API мессенджера Avito.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
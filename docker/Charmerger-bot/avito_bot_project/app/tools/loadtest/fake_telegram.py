@@ -0,0 +1,101 @@
+# /app/tools/loadtest/fake_telegram.py
+"""
+Заглушка Bot API Telegram для нагрузочных тестов (без сети).
+
+Запуск (из каталога /app):
+    python -m tools.loadtest.fake_telegram --port 8082 --latency-ms 50 --jitter-ms 20
+
+Бот направляется сюда через TELEGRAM_API_BASE_URL=http://localhost:8082.
+Все методы /bot{token}/{method} отвечают успехом; отправка и редактирование сообщений
+возвращают объект Message. Маркеры генератора нагрузки (lt-<run>-<n>) в тексте карточек
+запоминаются вместе со временем первой доставки:
+- GET /_deliveries - {маркер: Unix-время доставки};
+- GET /_stats - число вызовов по методам.
+"""
+import argparse
+import re
+import time
+from collections import Counter
+from typing import Dict
+
+from fastapi import FastAPI, Request
+
+from .faults import FaultProfile, add_fault_arguments, install_faults, profile_from_args
+
+MARKER_RE = re.compile(r"lt-[0-9a-f]+-\d+")
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+# Методы, которые возвращают Message
+MESSAGE_METHODS = {
+    "sendmessage", "sendphoto", "sendvoice", "sendlocation", "senddocument",
+    "editmessagetext", "editmessagereplymarkup", "editmessagecaption",
+}
+
+
+def create_app(profile: FaultProfile) -> FastAPI:
+    app = FastAPI(title="Fake Telegram Bot API")
+    install_faults(app, profile)
+    stats: Counter = Counter()
+    deliveries: Dict[str, float] = {}
+    next_message_id = 0
+
+    @app.post("/bot{token}/{method}")
+    async def bot_method(token: str, method: str, request: Request):
+        nonlocal next_message_id
+        method = method.lower()
+        stats[method] += 1
+        form = await request.form()
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+
+        if method in MESSAGE_METHODS:
+            now = time.time()
+            text = params.get("text") or params.get("caption") or ""
+            for marker in MARKER_RE.findall(text):
+                deliveries.setdefault(marker, now)
+            next_message_id += 1
+            chat_id = int(params.get("chat_id") or 0)
+            result = {
+                "message_id": int(params.get("message_id") or next_message_id),
+                "date": int(now),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": text,
+            }
+        elif method == "getme":
+            result = BOT_USER
+        elif method == "getwebhookinfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        else:
+            # sendChatAction, answerCallbackQuery, setWebhook, deleteWebhook, deleteMessage...
+            result = True
+        return {"ok": True, "result": result}
+
+    @app.get("/_deliveries")
+    async def get_deliveries():
+        return deliveries
+
+    @app.get("/_stats")
+    async def get_stats():
+        return dict(stats)
+
+    @app.post("/_reset")
+    async def reset():
+        stats.clear()
+        deliveries.clear()
+        return {"ok": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Bot API Telegram.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
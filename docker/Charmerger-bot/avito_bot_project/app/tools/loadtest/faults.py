@@ -0,0 +1,66 @@
+# /app/tools/loadtest/faults.py
+"""
+Внесение задержек и ошибок в заглушки API (fake_avito, fake_telegram).
+
+Профиль задается флагами командной строки и применяется middleware ко всем запросам,
+кроме служебных (/_stats, /_deliveries, /_reset). Генератор случайных чисел
+инициализируется --seed, поэтому последовательность сбоев воспроизводима.
+"""
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+SERVICE_PATH_PREFIX = "/_"
+
+
+@dataclass
+class FaultProfile:
+    latency_ms: float = 0.0    # базовая задержка ответа
+    jitter_ms: float = 0.0     # +- равномерный разброс задержки
+    error_rate: float = 0.0    # доля ответов 500
+    throttle_rate: float = 0.0 # доля ответов 429 (Retry-After: 1)
+    seed: Optional[int] = None
+    _random: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    async def delay(self):
+        latency = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def failure(self) -> Optional[JSONResponse]:
+        roll = self._random.random()
+        if roll < self.error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        if roll < self.error_rate + self.throttle_rate:
+            return JSONResponse({"error": "injected throttling"}, status_code=429, headers={"Retry-After": "1"})
+        return None
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответа, мс.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Разброс задержки, мс.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500 (0..1).")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Доля ответов 429 (0..1).")
+    parser.add_argument("--seed", type=int, default=42, help="Seed генератора сбоев.")
+
+
+def profile_from_args(args: argparse.Namespace) -> FaultProfile:
+    return FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate, args.seed)
+
+
+def install_faults(app: FastAPI, profile: FaultProfile):
+    """Middleware: задержка и внесенные сбои для всех запросов, кроме служебных."""
+    @app.middleware("http")
+    async def inject_faults(request: Request, call_next):
+        if request.url.path.startswith(SERVICE_PATH_PREFIX):
+            return await call_next(request)
+        await profile.delay()
+        return profile.failure() or await call_next(request)
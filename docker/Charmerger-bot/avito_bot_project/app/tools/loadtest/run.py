@@ -0,0 +1,267 @@
+# /app/tools/loadtest/run.py
+"""
+Нагрузочный тест всего конвейера: вебхук Avito -> стадии -> карточка в Telegram.
+
+Стенд (все локально, без api.avito.ru и api.telegram.org; Redis и PostgreSQL - тестовые):
+    python -m tools.loadtest.fake_avito --port 8081 --latency-ms 80 --jitter-ms 40
+    python -m tools.loadtest.fake_telegram --port 8082 --latency-ms 50 --jitter-ms 20
+    python -m tools.loadtest.seed --accounts 20
+    AVITO_API_BASE_URL=http://localhost:8081 TELEGRAM_API_BASE_URL=http://localhost:8082 \\
+        uvicorn main:app --port 8000              # и/или python -m worker с WORKER_METRICS_PORT
+    python -m tools.loadtest.run --rate 50 --duration 30 --accounts 20 --json report.json
+
+Генератор шлет синтетические вебхуки с постоянной частотой (--rate в секунду) по --accounts
+аккаунтам и --chats-per-account чатам; в тексте каждого сообщения есть уникальный маркер.
+Заглушка Telegram запоминает, когда маркер впервые пришел в карточке - так считаются
+сквозная задержка и потери. Задержки по стадиям берутся из разницы гистограмм /metrics
+(pipeline_queue_wait_seconds, stream_handler_seconds) до и после прогона.
+
+Трафик детерминирован (--seed), поэтому прогоны сравнимы. Для контроля регрессий:
+--max-loss и --max-p99 - при превышении код возврата 1.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from shared.serialization import json_dumps_str
+from .seed import AVITO_USER_ID_BASE
+
+# Гистограммы /metrics, из которых строится разбивка по стадиям
+STAGE_HISTOGRAMS = ("pipeline_queue_wait_seconds", "stream_handler_seconds", "pipeline_ingest_to_delivery_seconds")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def parse_histograms(text: str) -> Dict[Tuple[str, Labels], Dict[float, float]]:
+    """Бакеты гистограмм из текстового формата Prometheus: {(метрика, метки без le): {le: count}}."""
+    result: Dict[Tuple[str, Labels], Dict[float, float]] = defaultdict(dict)
+    for line in text.splitlines():
+        if line.startswith("#") or "_bucket{" not in line:
+            continue
+        series, _, value = line.rpartition(" ")
+        name, _, raw_labels = series.partition("{")
+        name = name[: -len("_bucket")]
+        if name not in STAGE_HISTOGRAMS:
+            continue
+        labels, le = [], None
+        for pair in raw_labels.rstrip("}").split(","):
+            if not pair:
+                continue
+            key, _, label_value = pair.partition("=")
+            label_value = label_value.strip('"')
+            if key == "le":
+                le = float(label_value)
+            else:
+                labels.append((key, label_value))
+        if le is not None:
+            result[(name, tuple(sorted(labels)))][le] = float(value)
+    return result
+
+
+def histogram_quantile(buckets: Dict[float, float], q: float) -> Optional[float]:
+    """Квантиль по кумулятивным бакетам (линейная интерполяция, как histogram_quantile в PromQL)."""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return previous_bound
+            share = (rank - previous_count) / (count - previous_count) if count > previous_count else 0
+            return previous_bound + (bound - previous_bound) * share
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def webhook_payload(account_id: int, chat_id: str, text: str) -> dict:
+    """Вебхук Avito о новом текстовом сообщении клиента (формат messenger v3)."""
+    now = int(time.time())
+    return {
+        "id": uuid.uuid4().hex,
+        "version": "v3.0.0",
+        "timestamp": now,
+        "payload": {
+            "type": "message",
+            "value": {
+                "id": uuid.uuid4().hex,
+                "chat_id": chat_id,
+                "user_id": account_id,
+                "author_id": account_id + 1_000_000,
+                "created": now,
+                "type": "text",
+                "chat_type": "u2i",
+                "content": {"text": text},
+            },
+        },
+    }
+
+
+async def fetch_metrics(client: httpx.AsyncClient, urls: List[str]) -> Dict[Tuple[str, Labels], Dict[float, float]]:
+    merged: Dict[Tuple[str, Labels], Dict[float, float]] = defaultdict(dict)
+    for url in urls:
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Не удалось получить метрики {url}: {e}", file=sys.stderr)
+            continue
+        for key, buckets in parse_histograms(response.text).items():
+            for le, count in buckets.items():
+                merged[key][le] = merged[key].get(le, 0.0) + count
+    return merged
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    total = int(args.rate * args.duration)
+    sent_at: Dict[str, float] = {}
+    webhook_latencies: List[float] = []
+    rejected = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        await client.post(f"{args.fake_telegram_url}/_reset")
+        metrics_before = await fetch_metrics(client, args.metrics_url)
+
+        async def send(marker: str, payload: dict):
+            nonlocal rejected
+            async with semaphore:
+                started = time.time()
+                try:
+                    response = await client.post(f"{args.app_url}/webhook/avito", content=json_dumps_str(payload),
+                                                 headers={"Content-Type": "application/json"})
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                webhook_latencies.append(time.time() - started)
+                if ok:
+                    sent_at[marker] = started
+                else:
+                    rejected += 1
+
+        print(f"Прогон {run_id}: {total} сообщений, {args.rate}/с, {args.accounts} аккаунтов.")
+        tasks = []
+        started = time.time()
+        for i in range(total):
+            delay = started + i / args.rate - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            marker = f"lt-{run_id}-{i}"
+            account_id = AVITO_USER_ID_BASE + rng.randrange(args.accounts)
+            chat_id = f"lt-chat-{account_id}-{rng.randrange(args.chats_per_account)}"
+            tasks.append(asyncio.create_task(send(marker, webhook_payload(account_id, chat_id, f"Тест {marker}"))))
+        await asyncio.gather(*tasks)
+        send_finished = time.time()
+
+        # Ждем, пока карточки дойдут до заглушки Telegram (или истечет --drain-timeout)
+        deliveries: Dict[str, float] = {}
+        deadline = time.time() + args.drain_timeout
+        while time.time() < deadline:
+            response = await client.get(f"{args.fake_telegram_url}/_deliveries")
+            deliveries = {marker: ts for marker, ts in response.json().items() if marker in sent_at}
+            if len(deliveries) >= len(sent_at):
+                break
+            await asyncio.sleep(1)
+        metrics_after = await fetch_metrics(client, args.metrics_url)
+
+    latencies = [deliveries[marker] - sent_at[marker] for marker in deliveries]
+    last_delivery = max(deliveries.values(), default=send_finished)
+    stages = {}
+    for key, buckets in metrics_after.items():
+        before = metrics_before.get(key, {})
+        delta = {le: count - before.get(le, 0.0) for le, count in buckets.items()}
+        if not delta or max(delta.values()) <= 0:
+            continue
+        name, labels = key
+        label = ",".join(value for _, value in labels)
+        stages[f"{name}{{{label}}}" if label else name] = {
+            "count": int(max(delta.values())),
+            "p50": histogram_quantile(delta, 0.5),
+            "p99": histogram_quantile(delta, 0.99),
+        }
+
+    return {
+        "run_id": run_id,
+        "sent": total,
+        "accepted": len(sent_at),
+        "rejected": rejected,
+        "delivered": len(deliveries),
+        "lost": len(sent_at) - len(deliveries),
+        "loss_ratio": (len(sent_at) - len(deliveries)) / len(sent_at) if sent_at else 0.0,
+        "throughput_per_s": len(deliveries) / max(last_delivery - started, 1e-9),
+        "webhook_p50": percentile(webhook_latencies, 0.5),
+        "webhook_p99": percentile(webhook_latencies, 0.99),
+        "e2e_p50": percentile(latencies, 0.5),
+        "e2e_p95": percentile(latencies, 0.95),
+        "e2e_p99": percentile(latencies, 0.99),
+        "stages": stages,
+    }
+
+
+def print_report(report: dict):
+    def ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 1000:.0f} мс"
+
+    print(f"Отправлено: {report['sent']}, принято: {report['accepted']}, отклонено: {report['rejected']}")
+    print(f"Доставлено: {report['delivered']}, потеряно: {report['lost']} ({report['loss_ratio']:.2%})")
+    print(f"Пропускная способность: {report['throughput_per_s']:.1f} сообщ./с")
+    print(f"Ответ вебхука: p50={ms(report['webhook_p50'])}, p99={ms(report['webhook_p99'])}")
+    print(f"Вебхук -> карточка: p50={ms(report['e2e_p50'])}, p95={ms(report['e2e_p95'])}, p99={ms(report['e2e_p99'])}")
+    if report["stages"]:
+        print("По стадиям (из /metrics):")
+        for name, values in sorted(report["stages"].items()):
+            print(f"  {name}: n={values['count']}, p50={ms(values['p50'])}, p99={ms(values['p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест конвейера Avito -> Telegram.")
+    parser.add_argument("--app-url", default="http://localhost:8000", help="Адрес веб-приложения.")
+    parser.add_argument("--fake-telegram-url", default="http://localhost:8082", help="Адрес заглушки Bot API.")
+    parser.add_argument("--metrics-url", action="append", default=None,
+                        help="Адреса /metrics процессов (можно несколько). По умолчанию - {app-url}/metrics.")
+    parser.add_argument("--rate", type=float, default=20, help="Сообщений в секунду.")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность подачи нагрузки, сек.")
+    parser.add_argument("--accounts", type=int, default=20, help="Число тестовых аккаунтов (см. tools.loadtest.seed).")
+    parser.add_argument("--chats-per-account", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=200, help="Максимум одновременных запросов вебхука.")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="Сколько ждать доставки после подачи, сек.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed распределения по аккаунтам и чатам.")
+    parser.add_argument("--json", help="Сохранить отчет в JSON-файл.")
+    parser.add_argument("--max-loss", type=float, default=0.0, help="Допустимая доля потерь.")
+    parser.add_argument("--max-p99", type=float, default=None, help="Допустимый p99 вебхук -> карточка, сек.")
+    args = parser.parse_args()
+    args.metrics_url = args.metrics_url or [f"{args.app_url}/metrics"]
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(json_dumps_str(report))
+
+    failed = report["loss_ratio"] > args.max_loss
+    if args.max_p99 is not None and (report["e2e_p99"] is None or report["e2e_p99"] > args.max_p99):
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# /app/tools/loadtest/seed.py
+"""
+Тестовые пользователи и аккаунты Avito для нагрузочного теста.
+
+Запуск (из каталога /app, БД и Redis - локальные/тестовые, не боевые!):
+    python -m tools.loadtest.seed --accounts 20
+
+Создает пользователей с telegram_id TELEGRAM_ID_BASE + i (соглашение принято) и по одному
+аккаунту Avito с avito_user_id AVITO_USER_ID_BASE + i. Токены действуют сутки, поэтому
+во время прогона бот не ходит за новыми. Повторный запуск ничего не дублирует.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from db_models import AvitoAccount, User
+from shared.database import dispose_engines, get_session
+from shared.security import encrypt_token
+
+TELEGRAM_ID_BASE = 990_000_000
+AVITO_USER_ID_BASE = 880_000_000
+
+
+async def seed(accounts: int) -> int:
+    """Создает недостающих пользователей и аккаунты. Возвращает число созданных аккаунтов."""
+    created = 0
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    async with get_session() as session:
+        existing = set(await session.scalars(
+            select(AvitoAccount.avito_user_id).where(
+                AvitoAccount.avito_user_id.between(AVITO_USER_ID_BASE, AVITO_USER_ID_BASE + accounts - 1)
+            )
+        ))
+        users = {
+            user.telegram_id: user for user in await session.scalars(
+                select(User).where(User.telegram_id.between(TELEGRAM_ID_BASE, TELEGRAM_ID_BASE + accounts - 1))
+            )
+        }
+        for i in range(accounts):
+            if AVITO_USER_ID_BASE + i in existing:
+                continue
+            user = users.get(TELEGRAM_ID_BASE + i)
+            if user is None:
+                user = User(
+                    telegram_id=TELEGRAM_ID_BASE + i, first_name=f"Loadtest {i}",
+                    username=f"loadtest_{i}", has_agreed_to_terms=True,
+                )
+                session.add(user)
+                await session.flush()
+            session.add(AvitoAccount(
+                user_id=user.id, alias=f"loadtest-{i}", avito_user_id=AVITO_USER_ID_BASE + i,
+                encrypted_oauth_token=encrypt_token("loadtest-access"),
+                encrypted_refresh_token=encrypt_token("loadtest-refresh"),
+                expires_at=expires_at, is_active=True,
+            ))
+            created += 1
+    return created
+
+
+async def main(accounts: int):
+    try:
+        created = await seed(accounts)
+        print(f"Аккаунтов создано: {created}, всего тестовых: {accounts}.")
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Тестовые пользователи и аккаунты для нагрузочного теста.")
+    parser.add_argument("--accounts", type=int, default=20, help="Сколько аккаунтов Avito (и владельцев) создать.")
+    args = parser.parse_args()
+    asyncio.run(main(args.accounts))
@@ -0,0 +1,108 @@
+# /app/tools/migrate_chat_views.py
+"""
+Миграция ключей chat_view:* в компактный формат и отчет по памяти Redis.
+
+Запуск (из каталога /app, внутри контейнера):
+    python -m tools.migrate_chat_views --dry-run   # только отчет: сколько байт на чат сейчас и после
+    python -m tools.migrate_chat_views             # перекодировать все модели в формат VIEW_CODEC
+
+Ключи tg_context:{message_id} старого формата не переносятся: в них нет telegram_id
+пользователя, поэтому их нельзя разложить по хешам tg_ctx:{telegram_id}.
+Они продолжают читаться фильтром ответов и сами истекают через REPLY_MAPPING_TTL.
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from redis.client import NEVER_DECODE
+
+from shared.redis_client import init_redis, close_redis
+from modules.telegram.view_codec import encode_view, decode_view
+from modules.telegram.view_provider import VIEW_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class KeyspaceReport:
+    keys: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    migrated: int = 0
+    without_ttl: int = 0
+
+    def print(self, title: str):
+        print(f"--- {title} ---")
+        print(f"Ключей: {self.keys}")
+        if not self.keys:
+            return
+        print(f"Памяти до:    {self.bytes_before} B ({self.bytes_before / self.keys:.0f} B на чат)")
+        print(f"Памяти после: {self.bytes_after} B ({self.bytes_after / self.keys:.0f} B на чат)")
+        if self.bytes_after:
+            print(f"Экономия: {self.bytes_before / self.bytes_after:.2f}x")
+        print(f"Перекодировано: {self.migrated}, без TTL (TTL будет выставлен): {self.without_ttl}")
+
+
+async def _memory_usage(redis_client, key: str) -> int:
+    return await redis_client.execute_command("MEMORY", "USAGE", key) or 0
+
+
+async def migrate_chat_views(redis_client, dry_run: bool, batch_size: int) -> KeyspaceReport:
+    report = KeyspaceReport()
+    async for key in redis_client.scan_iter(match="chat_view:*", count=batch_size):
+        raw = await redis_client.execute_command("GET", key, **{NEVER_DECODE: True})
+        if not raw:
+            continue
+        report.keys += 1
+        before = await _memory_usage(redis_client, key)
+        report.bytes_before += before
+
+        model = decode_view(raw)
+        encoded = encode_view(model)
+        ttl = await redis_client.ttl(key)
+        if ttl == -1:
+            report.without_ttl += 1
+
+        if dry_run:
+            # Оценка: служебные расходы Redis на ключ не меняются, меняется только длина значения
+            report.bytes_after += max(before - len(raw) + len(encoded), 0)
+            continue
+
+        if encoded != raw or ttl == -1:
+            if ttl > 0:
+                await redis_client.set(key, encoded, keepttl=True)
+            else:
+                await redis_client.set(key, encoded, ex=VIEW_TTL_SECONDS)
+            report.migrated += 1
+        report.bytes_after += await _memory_usage(redis_client, key)
+    return report
+
+
+async def report_legacy_contexts(redis_client, batch_size: int) -> KeyspaceReport:
+    report = KeyspaceReport()
+    async for key in redis_client.scan_iter(match="tg_context:*", count=batch_size):
+        report.keys += 1
+        report.bytes_before += await _memory_usage(redis_client, key)
+    return report
+
+
+async def main(dry_run: bool, batch_size: int):
+    redis_client = await init_redis()
+    try:
+        views = await migrate_chat_views(redis_client, dry_run, batch_size)
+        views.print("chat_view:* (оценка)" if dry_run else "chat_view:*")
+
+        contexts = await report_legacy_contexts(redis_client, batch_size)
+        print("--- tg_context:* (старый формат, истекают сами) ---")
+        print(f"Ключей: {contexts.keys}, памяти: {contexts.bytes_before} B")
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграция chat_view:* в компактный формат.")
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать память, ничего не менять.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Размер пачки SCAN.")
+    args = parser.parse_args()
+    asyncio.run(main(args.dry_run, args.batch_size))
@@ -0,0 +1,110 @@
+# /app/worker.py
+"""
+Отдельный процесс фоновых стадий конвейера (без HTTP).
+
+Примеры (из каталога /app):
+    python -m worker                                        # все стадии, WORKER_STAGES/WORKER_CONCURRENCY из .env
+    python -m worker --stages autoreply,forwarder --concurrency 8
+    python -m worker --stages event_processor=4,telegram_sender=2
+    python -m worker --list
+
+Веб-процесс при этом запускается с RUN_WORKERS_IN_WEB=false, чтобы потребители
+не дублировались в каждом воркере uvicorn. --concurrency задает число упорядоченных
+полос стадии: чаты обрабатываются параллельно, сообщения одного чата - по порядку.
+Разные стадии можно разносить по разным процессам. Одну стадию в нескольких процессах
+запускать можно, но тогда порядок сообщений внутри чата не гарантируется.
+Стадию scheduler запускайте только в одном процессе.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+
+from shared.config import settings
+from shared.database import dispose_engines
+from shared.metrics import start_metrics_server
+from shared.tracing import setup_tracing
+from shared.logs import setup_logging, run_log_level_sync
+from shared.diagnostics import run_diagnostics_listener
+from shared.loop_monitor import run_loop_monitor
+from shared.offload import shutdown_offload_pools
+from shared.redis_client import init_redis, close_redis
+from modules.telegram.bot import bot
+from stages import STAGES, parse_stages, start_stages, stop_stages
+
+setup_logging("chatmerger-worker")
+logger = logging.getLogger("worker")
+
+
+async def run(stages_spec: str, concurrency: int, consumer_prefix: str) -> int:
+    stages = parse_stages(stages_spec, concurrency)
+    redis_client = await init_redis()
+    if settings.worker_metrics_port:
+        start_metrics_server(settings.worker_metrics_port)
+    setup_tracing("chatmerger-worker")
+    log_levels_task = asyncio.create_task(run_log_level_sync(redis_client))
+    diagnostics_task = asyncio.create_task(run_diagnostics_listener(redis_client, "chatmerger-worker"))
+    loop_monitor_task = asyncio.create_task(run_loop_monitor())
+
+    tasks = start_stages(redis_client, stages, consumer_prefix)
+    logger.info(f"Процесс воркеров запущен: {len(tasks)} стадий.")
+
+    # Корректное завершение по SIGTERM (docker stop) и SIGINT (Ctrl+C)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    # Если какая-то стадия упала с необработанной ошибкой - останавливаем процесс целиком,
+    # чтобы оркестратор его перезапустил, а не оставил работать наполовину. Стадии работают
+    # бесконечно, поэтому завершение любой из них до сигнала - сбой (код возврата 1).
+    stop_waiter = asyncio.create_task(stop_event.wait())
+    done, _ = await asyncio.wait([stop_waiter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    failed = [task for task in done if task is not stop_waiter]
+    for task in failed:
+        if not task.cancelled() and task.exception():
+            logger.critical(f"Стадия {task.get_name()} завершилась с ошибкой: {task.exception()!r}")
+        else:
+            logger.critical(f"Стадия {task.get_name()} неожиданно завершилась.")
+
+    logger.info("Остановка процесса воркеров...")
+    stop_waiter.cancel()
+    log_levels_task.cancel()
+    diagnostics_task.cancel()
+    loop_monitor_task.cancel()
+    await stop_stages(tasks)
+    await close_redis()
+    await bot.session.close()
+    shutdown_offload_pools()
+    await dispose_engines()
+    logger.info("Процесс воркеров остановлен.")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фоновые стадии конвейера Avito <-> Telegram.")
+    parser.add_argument(
+        "--stages", default=settings.worker_stages,
+        help='Стадии через запятую, "all" - все. Конкурентность стадии: "autoreply=4".'
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=settings.worker_concurrency,
+        help="Число упорядоченных полос (параллельно обрабатываемых чатов) на стадию по умолчанию."
+    )
+    parser.add_argument(
+        "--consumer-prefix", default="",
+        help="Префикс имен потребителей в consumer group (по умолчанию - WORKER_CONSUMER_NAME или имя хоста)."
+    )
+    parser.add_argument("--list", action="store_true", help="Показать доступные стадии и выйти.")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(STAGES))
+        return
+
+    sys.exit(asyncio.run(run(args.stages, args.concurrency, args.consumer_prefix)))
+
+
+if __name__ == "__main__":
+    main()